@@ -1,5 +1,5 @@
 from __future__ import annotations
-from typing import Dict, Tuple, FrozenSet, Set
+from typing import Dict, Tuple, FrozenSet, Set, Optional
 import logging
 
 from intersection_control.algorithms.utils.discretised_intersection import InternalVehicle, Intersection
@@ -18,6 +18,8 @@ MUST_ACCELERATE_THRESHOLD = 4  # Vehicles travelling slower than this threshold
 
 
 class QBIMIntersectionManager(IntersectionManager):
+    VEHICLE_GETTERS = frozenset()
+
     def __init__(self, intersection_id: str, environment: Environment, granularity: int, time_discretisation: float,
                  messaging_unit: MessagingUnit):
         super().__init__(intersection_id, environment)
@@ -27,17 +29,38 @@ class QBIMIntersectionManager(IntersectionManager):
         # A map from vehicles to sets of tiles
         self.reservations: Dict[str, Set[Tuple[float, FrozenSet[Tuple[int, int]]]]] = {}
         self.timeouts = {}  # A map from vehicles to times
-        self.intersection = Intersection(self.get_width(),
-                                         self.get_height(),
-                                         self.get_position(),
-                                         granularity,
-                                         self.get_trajectories())
+        self.granularity = granularity
+        self._intersection: Optional[Intersection] = None  # Built on first use, see intersection
         self.d = {trajectory[0]: np.inf for trajectory in self.get_trajectories()}
 
+    @property
+    def intersection(self) -> Intersection:
+        """The discretised intersection used to check reservations, built the first time
+        a reservation is requested - so that IMs for intersections no vehicle ever approaches
+        cost almost nothing
+        """
+        if self._intersection is None:
+            self._intersection = Intersection(self.get_width(),
+                                              self.get_height(),
+                                              self.get_position(),
+                                              self.granularity,
+                                              self.get_trajectories())
+        return self._intersection
+
+    def destroy(self):
+        self.messaging_unit.destroy()
+
     def step(self):
         for message in self.messaging_unit.receive():
             self.handle_message(message)
 
+    def get_next_wake_up_time(self) -> Optional[float]:
+        # The IM only acts on the messages it receives, which vehicles only send while approaching or holding a
+        # reservation - and those vehicles wake on every step anyway
+        if self.reservations or self.messaging_unit.has_messages():
+            return self.environment.get_current_time()
+        return None
+
     def handle_message(self, message: Message):
         if message.contents["type"] == VehicleMessageType.REQUEST \
                 or message.contents["type"] == VehicleMessageType.CHANGE_REQUEST:
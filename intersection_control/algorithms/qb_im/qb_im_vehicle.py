@@ -1,3 +1,4 @@
+from math import hypot
 from typing import Optional
 
 from intersection_control.core import Vehicle, Environment, MessagingUnit
@@ -11,6 +12,10 @@ logger = logging.getLogger(__name__)
 
 
 class QBIMVehicle(Vehicle):
+    VEHICLE_GETTERS = frozenset({"approaching", "departing", "in_intersection", "get_trajectory", "get_length",
+                                 "get_width", "get_driving_distance", "get_speed", "get_position", "get_speed_limit",
+                                 "get_max_acceleration", "get_max_deceleration"})
+
     def __init__(self, vehicle_id: str, environment: Environment, messaging_unit: MessagingUnit):
         super().__init__(vehicle_id, environment)
         self.messaging_unit = messaging_unit
@@ -46,6 +51,22 @@ class QBIMVehicle(Vehicle):
 
         self.act()
 
+    def get_next_wake_up_time(self) -> Optional[float]:
+        # Outside of the default state the vehicle is dealing with the IM or crossing the intersection, so it acts on
+        # every step. Otherwise, all it does is wait to be within range of the IM of an intersection it approaches
+        if self.state != VehicleState.DEFAULT or self.messaging_unit.has_messages():
+            return self.environment.get_current_time()
+        intersection_id = self.approaching()
+        if intersection_id is None:
+            # Whether the vehicle is approaching an intersection only changes once it moves onto the next road
+            return self.get_earliest_arrival_time(self.get_driving_distance())
+        communication_range = self.messaging_unit.communication_range
+        if communication_range is None:
+            return self.environment.get_current_time()
+        x, y = self.get_position()
+        intersection_x, intersection_y = self.environment.intersections.get_position(intersection_id)
+        return self.get_earliest_arrival_time(hypot(x - intersection_x, y - intersection_y) - communication_range)
+
     def transition_to_approaching_without_reservation(self):
         self.state = VehicleState.APPROACHING_WITHOUT_RESERVATION
 
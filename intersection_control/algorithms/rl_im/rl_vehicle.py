@@ -8,6 +8,8 @@ from ray.rllib.agents.trainer import Trainer
 
 
 class RLVehicle(Vehicle):
+    VEHICLE_GETTERS = frozenset({"get_trajectory", "get_speed", "get_position", "get_direction", "get_speed_limit"})
+
     def __init__(self, vehicle_id: str, environment: Environment, intersection_id: str,
                  mode: int, messaging_unit: MessagingUnit = None, policy: Optional[Trainer] = None):
         super().__init__(vehicle_id, environment)
@@ -37,7 +37,8 @@ class MultiAgentSumoEnv(MultiAgentEnv):
         ]
         self.demand_generator = ScenarioGenerator(initial_vehicle_spawns)
         self.env = SumoEnvironment("../../../environments/sumo/networks/single_intersection/intersection.sumocfg",
-                                   demand_generator=self.demand_generator, time_step=0.1, gui=self.gui, warnings=False)
+                                   demand_generator=self.demand_generator, time_step=0.1, gui=self.gui, warnings=False,
+                                   vehicle_getters=RLVehicle.VEHICLE_GETTERS)
         self.env.step()  # Load all the vehicles in
 
         self.vehicles: Dict[str, RLVehicle] = {vehicle_id: RLVehicle(vehicle_id, self.env, "intersection", RLMode.TRAIN)
@@ -92,16 +93,16 @@ class MultiAgentSumoEnv(MultiAgentEnv):
         for v, action in action_dict.items():
             self.vehicles[v].apply_action(action)
 
-        for _ in range(self.env_steps_per_step):
-            self.env.step()
+        # The vehicles only act between calls to step, so SUMO is advanced over all the steps in between at once
+        self.env.step_until(self.env.get_current_time() + self.env_steps_per_step * self.env.time_step)
 
-            if len(self.env.get_removed_vehicles()) > 0:
-                obs = {vehicle: self.observation_space.sample() for vehicle in self.vehicles}
-                rewards = {vehicle: -20 for vehicle in self.vehicles}
-                dones = {vehicle: True for vehicle in self.vehicles}
-                infos = {vehicle: {} for vehicle in self.vehicles}
-                dones["__all__"] = True
-                return obs, rewards, dones, infos
+        if len(self.env.get_removed_vehicles()) > 0:
+            obs = {vehicle: self.observation_space.sample() for vehicle in self.vehicles}
+            rewards = {vehicle: -20 for vehicle in self.vehicles}
+            dones = {vehicle: True for vehicle in self.vehicles}
+            infos = {vehicle: {} for vehicle in self.vehicles}
+            dones["__all__"] = True
+            return obs, rewards, dones, infos
 
         for vehicle in self.vehicles.values():
             vehicle.step()  # So they all broadcast their details, ready for the observations
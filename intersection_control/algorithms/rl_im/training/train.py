@@ -7,6 +7,7 @@ from ray.tune.registry import register_env
 
 from intersection_control.algorithms.rl_im.constants import RLMode
 from intersection_control.algorithms.rl_im.rl_vehicle import RLVehicle
+from intersection_control.core import Simulation
 from intersection_control.environments import SumoEnvironment
 from intersection_control.environments.sumo import RandomDemandGenerator
 from intersection_control.environments.sumo.sumo_environment import ControlType
@@ -79,20 +80,12 @@ def evaluate():
     }, 0.05, control_type=ControlType.MANUAL)
     env = SumoEnvironment("../../../environments/sumo/networks/single_intersection/intersection.sumocfg",
                           demand_generator=demand_generator, time_step=0.05, gui=True)
-    vehicles = {RLVehicle(vehicle_id, env, env.intersections.get_ids()[0], RLMode.EVALUATE, trainer) for vehicle_id in
-                env.vehicles.get_ids()}
+    simulation = Simulation(env, lambda vehicle_id, env: RLVehicle(vehicle_id, env, env.intersections.get_ids()[0],
+                                                                   RLMode.EVALUATE, trainer))
 
     step_count = 360000  # 1 hour
-    for _ in range(step_count):
-        env.step()
-        removed_vehicles = {v for v in vehicles if v.get_id() in env.get_removed_vehicles()}
-        for v in removed_vehicles:
-            v.destroy()
-        new_vehicles = {RLVehicle(vehicle_id, env, env.intersections.get_ids()[0], RLMode.EVALUATE, trainer) for
-                        vehicle_id in env.get_added_vehicles()}
-        vehicles = (vehicles - removed_vehicles).union(new_vehicles)
-        for vehicle in vehicles:
-            vehicle.step()
+    simulation.run(step_count)
+    simulation.close()
 
 
 if __name__ == "__main__":
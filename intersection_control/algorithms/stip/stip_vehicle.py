@@ -9,6 +9,9 @@ from intersection_control.core.environment import Trajectory
 
 
 class STIPVehicle(Vehicle):
+    VEHICLE_GETTERS = frozenset({"approaching", "departing", "in_intersection", "get_trajectory", "get_length",
+                                 "get_width", "get_driving_distance", "get_speed", "get_position",
+                                 "get_max_acceleration"})
     INTERSECTION_GRANULARITY = 30
     RECALCULATE_THRESHOLD = 0.5
     SAFETY_BUFFER = (0.5, 1)
@@ -18,6 +21,7 @@ class STIPVehicle(Vehicle):
         self.messaging_unit = messaging_unit
         self.state = VehicleState.EXIT
         self.approaching_intersection: Optional[Intersection] = None
+        self.trajectory_id: Optional[str] = None
         self.trajectory: Optional[Trajectory] = None
         self.arrived_at: Optional[float] = None
         self.target_speed: float = self.get_speed()
@@ -41,6 +45,13 @@ class STIPVehicle(Vehicle):
 
         self.last_sent_distance = self.get_driving_distance()
 
+    def get_next_wake_up_time(self) -> Optional[float]:
+        # Between intersections the vehicle only broadcasts exit messages, which other vehicles ignore, until it moves
+        # onto a road approaching the next one
+        if self.state == VehicleState.EXIT and self.approaching() is None:
+            return self.get_earliest_arrival_time(self.get_driving_distance())
+        return self.environment.get_current_time()
+
     def receiver_logic(self, safety_message: Message):
         c = safety_message.contents
         if self.state == VehicleState.APPROACH:
@@ -64,7 +75,7 @@ class STIPVehicle(Vehicle):
             "arrival_time": self.approximate_arrival_time(),
             "exit_time": self.approximate_exit_time(),
             "trajectory_cells_list": self.get_trajectory_cells_list(),
-            "lane": self.get_trajectory()[0],
+            "lane": self.trajectory_id[0],
             "distance": self.get_driving_distance()
         })
 
@@ -75,7 +86,7 @@ class STIPVehicle(Vehicle):
             "arrival_time": self.arrived_at,
             "exit_time": self.approximate_exit_time(),
             "trajectory_cells_list": self.get_trajectory_cells_list(),
-            "lane": self.get_trajectory()[0],
+            "lane": self.trajectory_id[0],
             "distance": 0
         })
 
@@ -103,7 +114,7 @@ class STIPVehicle(Vehicle):
             arrival_time, cells = self.cached_cells
             if abs(self.approximate_arrival_time() - arrival_time) < self.RECALCULATE_THRESHOLD:
                 return cells
-        v = InternalVehicle(self.trajectory.speed_limit, self.get_length(), self.get_width(), self.get_trajectory(),
+        v = InternalVehicle(self.trajectory.speed_limit, self.get_length(), self.get_width(), self.trajectory_id,
                             self.approaching_intersection)
         cells = set()
         while v.is_in_intersection():
@@ -120,6 +131,7 @@ class STIPVehicle(Vehicle):
 
     def transition_to_exit(self):
         self.approaching_intersection = None
+        self.trajectory_id = None
         self.trajectory = None
         self.cached_cells = None
         self.arrived_at = None
@@ -134,7 +146,9 @@ class STIPVehicle(Vehicle):
                                                      self.environment.intersections.get_position(intersection_id),
                                                      self.INTERSECTION_GRANULARITY,
                                                      self.environment.intersections.get_trajectories(intersection_id))
-        self.trajectory = self.environment.intersections.get_trajectories(intersection_id)[self.get_trajectory()]
+        # Once inside the intersection the vehicle reports a different trajectory ID, so hold on to this one
+        self.trajectory_id = self.get_trajectory()
+        self.trajectory = self.environment.intersections.get_trajectories(intersection_id)[self.trajectory_id]
         self.state = VehicleState.APPROACH
         self.target_speed = self.get_speed()
         self.cached_cells = None
@@ -1,13 +1,16 @@
-from typing import Set, Tuple, List
+from typing import Set, Tuple, List, Optional
 
 from intersection_control.core import IntersectionManager, Environment
 
 
 class TLIntersectionManager(IntersectionManager):
+    VEHICLE_GETTERS = frozenset()
+
     def __init__(self, intersection_id: str, environment: Environment,
                  phases: List[Tuple[Tuple[Set[str], Set[str], Set[str]], float]]):
         super().__init__(intersection_id, environment)
-        self.phases = phases
+        # Store each phase as frozensets so the environment can cheaply memoise the state each phase compiles to
+        self.phases = [(tuple(frozenset(lights) for lights in phase), duration) for phase, duration in phases]
         self.phase_index = 0
         self.set_traffic_light_phase(self.phases[self.phase_index][0])
         self.phase_start = self.environment.get_current_time()
@@ -17,6 +20,11 @@ class TLIntersectionManager(IntersectionManager):
         if self.environment.get_current_time() - self.phase_start >= duration:
             self._switch_to_next_phase()
 
+    def get_next_wake_up_time(self) -> Optional[float]:
+        # Nothing changes until the current phase ends
+        (_, duration) = self.phases[self.phase_index]
+        return self.phase_start + duration
+
     def _switch_to_next_phase(self):
         self.phase_index += 1
         self.phase_index = self.phase_index % len(self.phases)
@@ -1,7 +1,14 @@
+from typing import Optional
+
 from intersection_control.core import Vehicle
 
 
 class TLVehicle(Vehicle):
+    VEHICLE_GETTERS = frozenset()
+
     def step(self):
         # Nothing needed here, will behave according to environment
         pass
+
+    def get_next_wake_up_time(self) -> Optional[float]:
+        return None
@@ -1,4 +1,5 @@
 from __future__ import annotations
+import functools
 import math
 from typing import Tuple, Dict, FrozenSet
 from shapely.geometry import Polygon
@@ -49,8 +50,7 @@ class Intersection:
 
     def __init__(self, width: float, height: float, position: Tuple[float, float], granularity: int,
                  trajectories: Dict[str, Trajectory]):
-        self.tile_shapes = [[Polygon([(i, j), (i, j + 1), (i + 1, j + 1), (i + 1, j)]) for j in range(granularity)]
-                            for i in range(granularity)]
+        self.tile_shapes = _get_tile_shapes(granularity)
         self.granularity = granularity
         self.size = np.array([width, height])
         self.trajectories = trajectories
@@ -89,3 +89,10 @@ class Intersection:
                     tile_coords.add((i, j))
 
         return frozenset(tile_coords)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_tile_shapes(granularity: int) -> Tuple[Tuple[Polygon, ...], ...]:
+    # The tiles only depend on the granularity, so are shared by every intersection rather than rebuilt for each
+    return tuple(tuple(Polygon([(i, j), (i, j + 1), (i + 1, j + 1), (i + 1, j)]) for j in range(granularity))
+                 for i in range(granularity))
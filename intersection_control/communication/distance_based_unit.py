@@ -57,6 +57,9 @@ class DistanceBasedUnit(MessagingUnit):
         self._message_queue = []
         return messages
 
+    def has_messages(self) -> bool:
+        return bool(self._message_queue)
+
     def broadcast(self, message: Message):
         for address in self.discover():
             self.send(address, message)
@@ -1,5 +1,8 @@
 from .environment import Environment
 from .communication import Message, MessagingUnit
 from intersection_control.core.algorithm import Vehicle, IntersectionManager
+from .profiling import StepProfiler, StreamingHistogram
+from .simulation import Simulation
 
-__all__ = ["Environment", "Message", "MessagingUnit", "IntersectionManager", "Vehicle"]
+__all__ = ["Environment", "Message", "MessagingUnit", "IntersectionManager", "Vehicle", "Simulation", "StepProfiler",
+           "StreamingHistogram"]
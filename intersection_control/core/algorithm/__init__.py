@@ -1,7 +1,9 @@
-from .vehicle import Vehicle
-from .intersection_manager import IntersectionManager
+from .vehicle import Vehicle, vehicle_getters_used_by
+from .intersection_manager import IntersectionManager, next_wake_up_time
 
 __all__ = [
     "Vehicle",
-    "IntersectionManager"
+    "IntersectionManager",
+    "vehicle_getters_used_by",
+    "next_wake_up_time"
 ]
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from typing import Dict, Tuple, Set
+from typing import Dict, Tuple, Set, Optional, FrozenSet, Iterable, Union
 from intersection_control.core import Environment
 from intersection_control.core.environment import Trajectory
+from .vehicle import Vehicle
 
 '''
 Intersection Manager
@@ -13,6 +14,11 @@ Communicates with Vehicles and coordinates their movements through the intersect
 
 
 class IntersectionManager(ABC):
+    #: The names of the :class:`VehicleHandler <intersection_control.core.environment.VehicleHandler>` getters
+    #: used by this intersection manager, so that environments can avoid fetching anything else. None means the
+    #: getters used are unknown, and all of them should be available
+    VEHICLE_GETTERS: Optional[FrozenSet[str]] = None
+
     def __init__(self, intersection_id: str, environment: Environment):
         self.environment = environment
         self.intersection_id = intersection_id
@@ -26,6 +32,26 @@ class IntersectionManager(ABC):
         manager should be implemented"""
         raise NotImplementedError
 
+    def get_next_wake_up_time(self) -> Optional[float]:
+        """Returns the time at which :func:`step` next needs to be called
+
+        Runners may skip calling step on any time steps before this - so it should be no
+        later than the next time the intersection manager needs to react to anything (such
+        as a phase change, or a message being received). By default, this is the current
+        time, so that step is called on every time step.
+
+        :return: The time in seconds, or None if step never needs to be called again
+        """
+        return self.environment.get_current_time()
+
+    def destroy(self):
+        """Called when the intersection manager is no longer needed, such as at the end of a run
+
+        Can optionally be implemented to do some clean-up functions if needed.
+        If this isn't needed, this method can simply be ignored.
+        """
+        pass
+
     def get_width(self) -> float:
         """Return the width of the intersection
 
@@ -69,3 +95,17 @@ class IntersectionManager(ABC):
             light, and the same for Yellow and Green
         """
         self.environment.intersections.set_traffic_light_phase(self.intersection_id, phase)
+
+
+def next_wake_up_time(agents: Iterable[Union[Vehicle, IntersectionManager]]) -> Optional[float]:
+    """Returns the earliest time at which any of the given vehicles or intersection managers
+    next needs to be stepped
+
+    Runners can pass this to :func:`Environment.step_until <intersection_control.core.Environment.step_until>`
+    to skip over any steps before it.
+
+    :param agents: The Vehicles and IntersectionManagers in the environment
+    :return: The earliest of their wake-up times, or None if none of them need to be stepped again
+    """
+    wake_up_times = [agent.get_next_wake_up_time() for agent in agents]
+    return min([time for time in wake_up_times if time is not None], default=None)
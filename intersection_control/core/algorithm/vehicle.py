@@ -1,7 +1,8 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from typing import Tuple, Optional
+from math import sqrt
+from typing import Tuple, Optional, FrozenSet
 
 from intersection_control.core import Environment
 
@@ -14,6 +15,11 @@ intersection
 
 
 class Vehicle(ABC):
+    #: The names of the :class:`VehicleHandler <intersection_control.core.environment.VehicleHandler>` getters
+    #: used by this vehicle (including any used by its messaging unit), so that environments can avoid
+    #: fetching anything else. None means the getters used are unknown, and all of them should be available
+    VEHICLE_GETTERS: Optional[FrozenSet[str]] = None
+
     def __init__(self, vehicle_id: str, environment: Environment):
         self.vehicle_id = vehicle_id
         self.environment = environment
@@ -27,6 +33,36 @@ class Vehicle(ABC):
         should be implemented"""
         raise NotImplementedError
 
+    def get_next_wake_up_time(self) -> Optional[float]:
+        """Returns the time at which :func:`step` next needs to be called
+
+        Runners may skip calling step on any time steps before this - so it should be no
+        later than the next time the vehicle needs to react to anything. By default, this
+        is the current time, so that step is called on every time step.
+
+        :return: The time in seconds, or None if step never needs to be called again
+        """
+        return self.environment.get_current_time()
+
+    def get_earliest_arrival_time(self, distance: float) -> float:
+        """Returns the earliest time at which the vehicle could have travelled the given distance
+
+        This assumes the vehicle accelerates as hard as it can the whole way, ignoring any speed
+        limit - so the vehicle will not get there any sooner, and this can safely be used as a
+        wake-up time (see :func:`get_next_wake_up_time`).
+
+        :param float distance: The distance in metres
+        :return: The time in seconds, or the current time if the distance is not positive
+        """
+        now = self.environment.get_current_time()
+        if distance <= 0:
+            return now
+        speed = self.get_speed()
+        acceleration = self.get_max_acceleration()
+        if acceleration <= 0:
+            return now + distance / speed if speed > 0 else now
+        return now + (sqrt(speed ** 2 + 2 * acceleration * distance) - speed) / acceleration
+
     def destroy(self):
         """Called when the vehicle is removed from the environment
 
@@ -172,3 +208,18 @@ class Vehicle(ABC):
         :return: The maximum deceleration in m/s^2
         """
         return self.environment.vehicles.get_max_deceleration(self.vehicle_id)
+
+
+def vehicle_getters_used_by(*algorithm_classes: type) -> Optional[FrozenSet[str]]:
+    """Returns the names of all the VehicleHandler getters used by the given vehicle and
+    intersection manager classes, as declared by their ``VEHICLE_GETTERS`` attributes
+
+    This can be passed to an environment so that it only fetches what is needed.
+
+    :param algorithm_classes: The Vehicle and IntersectionManager classes that will be used
+    :return: The union of the getters declared by each class, or None if any class has
+        not declared the getters it uses
+    """
+    if any(algorithm_class.VEHICLE_GETTERS is None for algorithm_class in algorithm_classes):
+        return None
+    return frozenset().union(*[algorithm_class.VEHICLE_GETTERS for algorithm_class in algorithm_classes])
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 
 class MessagingUnit(ABC):
@@ -19,6 +19,10 @@ class MessagingUnit(ABC):
     implementation of different Unit types that behave slightly differently
     but are able to communicate.
     """
+    #: The distance in metres within which the unit can reach others, or None if this is not
+    #: known (or not how the unit decides what it can reach)
+    communication_range: Optional[float] = None
+
     @property
     @abstractmethod
     def address(self) -> str:
@@ -62,6 +66,16 @@ class MessagingUnit(ABC):
         """
         raise NotImplementedError
 
+    def has_messages(self) -> bool:
+        """Returns True if there may be messages waiting to be received
+
+        This lets the user of the unit tell whether it needs to act, without taking the messages.
+        By default, this is always True, as the unit cannot tell.
+
+        :return: False only if :func:`receive` would return no messages
+        """
+        return True
+
     def destroy(self):
         """Called when the user of this unit no longer exists
 
@@ -1,5 +1,5 @@
-from .environment import Environment
+from .environment import Environment, StepEvents
 from .vehicle_handler import VehicleHandler
 from .intersection_handler import IntersectionHandler, Trajectory
 
-__all__ = ["Environment", "VehicleHandler", "IntersectionHandler", "Trajectory"]
+__all__ = ["Environment", "StepEvents", "VehicleHandler", "IntersectionHandler", "Trajectory"]
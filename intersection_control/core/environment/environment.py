@@ -1,9 +1,31 @@
 from abc import ABC, abstractmethod
-from typing import List
+from dataclasses import dataclass
+from typing import Any, FrozenSet
 from .intersection_handler import IntersectionHandler
 from .vehicle_handler import VehicleHandler
 
 
+@dataclass(frozen=True)
+class StepEvents:
+    """The changes to the vehicles in an environment over a single step, as returned by
+    :func:`Environment.step`
+
+    :ivar FrozenSet[str] added: The IDs of the vehicles added to the environment
+    :ivar FrozenSet[str] removed: The IDs of the vehicles removed from the environment - including,
+        as for :func:`Environment.get_removed_vehicles`, any that collided
+    :ivar FrozenSet[str] collided: The IDs of the vehicles involved in a collision
+    :ivar FrozenSet[str] teleported: The IDs of the vehicles the environment moved elsewhere, for
+        example to resolve a jam
+
+    The events of several steps (see :func:`Environment.step_until`) are combined, so a vehicle
+    can then be both added and removed.
+    """
+    added: FrozenSet[str] = frozenset()
+    removed: FrozenSet[str] = frozenset()
+    collided: FrozenSet[str] = frozenset()
+    teleported: FrozenSet[str] = frozenset()
+
+
 class Environment(ABC):
     @property
     @abstractmethod
@@ -30,31 +52,63 @@ class Environment(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def step(self):
+    def step(self) -> StepEvents:
         """Performs a single step in the environment
 
         In a simulated environment, this should advance the simulation by a
         single time step, and in a real-time environment, this could either
         introduce a time delay - in order to tune the sampling frequency,
         or simply do nothing
+
+        :return: The changes to the environment's vehicles over the step, as
+            also returned by :func:`get_step_events`
+        """
+        raise NotImplementedError
+
+    def step_until(self, time: float, stop_on_added: bool = False) -> StepEvents:
+        """Advances the environment to the given time, as if :func:`step` had been called
+        repeatedly, but without giving any algorithm the chance to act in between
+
+        Implementing this is optional, but allows runners to skip over steps in which no
+        vehicle or intersection manager needs to act (see
+        :func:`next_wake_up_time <intersection_control.core.algorithm.next_wake_up_time>`)
+        more cheaply than stepping through each of them. Afterwards, :func:`get_step_events`
+        reports everything that happened in any of the steps performed - so a vehicle that was
+        both added and removed during the call appears in both.
+
+        :param float time: The time in seconds to advance to. At least a single step is
+            always performed
+        :param bool stop_on_added: If True, stops early after any step in which vehicles were
+            added - so that they can act straight away
+        :return: The changes to the environment's vehicles since before the call
         """
         raise NotImplementedError
 
+    def get_step_events(self) -> StepEvents:
+        """Returns the changes to the environment's vehicles in the last time step
+
+        By default, this is built from :func:`get_added_vehicles` and :func:`get_removed_vehicles`,
+        with no collisions or teleports - environments that know about these should override it.
+
+        :return: The changes in the last time step
+        """
+        return StepEvents(frozenset(self.get_added_vehicles()), frozenset(self.get_removed_vehicles()))
+
     @abstractmethod
-    def get_removed_vehicles(self) -> List[str]:
-        """Returns a list of the vehicles removed from the environment in
+    def get_removed_vehicles(self) -> FrozenSet[str]:
+        """Returns the vehicles removed from the environment in
         last time step
 
         In a simulation environment, this may be, for example, because the
         vehicle has completed its trip.
 
-        :return: List of vehicle IDs removed from the environment
+        :return: The IDs of the vehicles removed from the environment
         """
         raise NotImplementedError
 
     @abstractmethod
-    def get_added_vehicles(self) -> List[str]:
-        """Returns a list of the vehicles added to the environment in
+    def get_added_vehicles(self) -> FrozenSet[str]:
+        """Returns the vehicles added to the environment in
         the last time step
 
         In a simulation environment, a vehicle demand generator may be
@@ -62,7 +116,7 @@ class Environment(ABC):
         method allows the user know about these new vehicles entering
         the environment
 
-        :return: List of vehicle IDs added to the environment
+        :return: The IDs of the vehicles added to the environment
         """
         raise NotImplementedError
 
@@ -70,3 +124,27 @@ class Environment(ABC):
     def clear(self):
         """Removes all vehicles from the environment"""
         raise NotImplementedError
+
+    def snapshot(self) -> Any:
+        """Saves the current state of the environment, so that it can be returned
+        to later using :func:`restore`
+
+        Implementing this is optional, but allows, for example, episodic experiments
+        to be reset to a known starting scenario without having to clear and
+        repopulate the environment.
+
+        :return: An opaque handle to the saved state, to be passed to :func:`restore`
+        """
+        raise NotImplementedError
+
+    def restore(self, snapshot: Any):
+        """Returns the environment to a state previously saved using :func:`snapshot`
+
+        The vehicles in the environment will be exactly those present when the
+        snapshot was taken, and :func:`get_added_vehicles` and
+        :func:`get_removed_vehicles` will report no changes - so any vehicle
+        objects should be re-created from the IDs in the vehicle handler.
+
+        :param snapshot: A handle previously returned by :func:`snapshot`
+        """
+        raise NotImplementedError
@@ -1,4 +1,4 @@
-from typing import List, Any, Dict, Callable, Tuple, Optional, Set, Type
+from typing import List, Any, Dict, Callable, Tuple, Optional, Set, Type, Sequence
 from timeit import default_timer as timer
 import numpy as np
 from intersection_control.core import Environment, MessagingUnit
@@ -16,6 +16,8 @@ class Metric:
     ALL_VEHICLE_IDS = 8
     WALL_TIME = 9
     MESSAGES_EXCHANGED = 10
+    COLLISIONS = 11
+    TELEPORTS = 12
 
 
 class MetricCollector:
@@ -34,6 +36,8 @@ class MetricCollector:
             Metric.ALL_VEHICLE_IDS: self._poll_all_vehicle_ids,
             Metric.WALL_TIME: self._poll_wall_time,
             Metric.MESSAGES_EXCHANGED: self._poll_messages_exchanged,
+            Metric.COLLISIONS: self._poll_collisions,
+            Metric.TELEPORTS: self._poll_teleports,
         }
         if Metric.WALL_TIME in metrics:
             self.last_wall_time: Optional[float] = None
@@ -42,8 +46,12 @@ class MetricCollector:
             assert messaging_unit_class is not None
             self.last_num_send_calls = 0
             self.num_send_calls = 0
-            # A little bit of python magic to be able to count the number of calls to send()
-            messaging_unit_class.send = self._count_send_calls(messaging_unit_class.send)
+            # A little bit of python magic to be able to count the number of calls to send(). The original send is
+            # kept so that collectors created later (e.g. for successive runs in the same process) replace this
+            # wrapper rather than stacking on top of it
+            if "_uncounted_send" not in messaging_unit_class.__dict__:
+                messaging_unit_class._uncounted_send = messaging_unit_class.send
+            messaging_unit_class.send = self._count_send_calls(messaging_unit_class)
 
     def poll(self):
         for metric, result in self.results.items():
@@ -99,9 +107,43 @@ class MetricCollector:
         self.last_num_send_calls = self.num_send_calls
         return result
 
-    def _count_send_calls(self, send):
+    def _poll_collisions(self) -> int:
+        return len(self.environment.get_step_events().collided)
+
+    def _poll_teleports(self) -> int:
+        return len(self.environment.get_step_events().teleported)
+
+    def _count_send_calls(self, messaging_unit_class: Type[MessagingUnit]):
+        # The original send is looked up on every call, so that anything that wrapped it before this collector was
+        # created (such as a StepProfiler) can still put it back
         def wrapper(instance, address, message):
             self.num_send_calls += 1
-            send(instance, address, message)
+            messaging_unit_class._uncounted_send(instance, address, message)
 
         return wrapper
+
+
+def get_warm_up_length(values: Sequence[float], batch_size: int = 5) -> int:
+    """Estimates how many of a run's observations were made before it reached steady state, using
+    the MSER-5 rule
+
+    The observations (for example, the delay of each vehicle, in the order they left the
+    environment) are averaged in batches of ``batch_size``, and the warm up period is taken to
+    be the number of leading batches whose deletion minimises the standard error of the mean of
+    the rest. At most half of the batches are ever deleted.
+
+    :param Sequence[float] values: The observations, in the order they were made
+    :param int batch_size: The number of observations averaged in each batch
+    :return: The number of leading observations to discard
+    """
+    num_batches = len(values) // batch_size
+    if num_batches < 2:
+        return 0
+    batches = np.asarray(values[:num_batches * batch_size], dtype=float).reshape(num_batches, batch_size).mean(axis=1)
+    # The mean and sum of squared deviations of every suffix of the batches, found in one pass from the end
+    suffix_lengths = np.arange(num_batches, 0, -1)
+    suffix_sums = np.cumsum(batches[::-1])[::-1]
+    suffix_squares = np.cumsum(batches[::-1] ** 2)[::-1]
+    deviations = suffix_squares - suffix_sums ** 2 / suffix_lengths
+    candidates = num_batches // 2 + 1
+    return int(np.argmin(deviations[:candidates] / suffix_lengths[:candidates] ** 2)) * batch_size
@@ -0,0 +1,289 @@
+from __future__ import annotations
+
+import math
+from time import perf_counter, process_time
+from typing import Dict, Iterable, Optional, Type, Any
+
+from intersection_control.core.communication import MessagingUnit
+from intersection_control.core.algorithm import Vehicle
+
+
+class StreamingHistogram:
+    """A histogram of positive values, that can estimate quantiles without storing every value
+
+    Values are counted in logarithmically sized buckets - each power of two is split into
+    :attr:`SUB_BUCKETS` buckets, so any quantile is estimated to within about 3%, using
+    memory proportional to the range of magnitudes seen rather than the number of values.
+    """
+    #: The number of buckets each power of two is split into
+    SUB_BUCKETS = 16
+
+    def __init__(self):
+        # Dictionary mapping bucket indices to the number of values in that bucket
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, value: float):
+        """Add a value to the histogram
+
+        :param float value: The value to add. Values of zero or less are all counted together
+        """
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            bucket = -math.inf
+        else:
+            mantissa, exponent = math.frexp(value)  # 0.5 <= mantissa < 1
+            bucket = exponent * self.SUB_BUCKETS + int((mantissa - 0.5) * 2 * self.SUB_BUCKETS)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def mean(self) -> float:
+        """Returns the mean of the values added
+
+        :return: The mean, or 0 if no values have been added
+        """
+        return self.total / self.count if self.count > 0 else 0.
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile of the values added
+
+        :param float q: The quantile to estimate, between 0 and 1
+        :return: The estimated quantile, or 0 if no values have been added
+        """
+        remaining = q * self.count
+        for bucket in sorted(self.buckets):
+            remaining -= self.buckets[bucket]
+            if remaining <= 0:
+                if bucket == -math.inf:
+                    return 0.
+                exponent, sub_bucket = divmod(bucket, self.SUB_BUCKETS)
+                # The midpoint of the bucket, capped so that a quantile is never above the largest value
+                return min(math.ldexp(0.5 + (sub_bucket + 0.5) / (2 * self.SUB_BUCKETS), exponent), self.max)
+        return self.max
+
+
+class StepProfiler:
+    """Records how long each phase of a :class:`Simulation <intersection_control.core.Simulation>`'s
+    steps takes
+
+    Pass a profiler to a Simulation to have it record the wall and CPU time of each of the
+    phases below, on every step, in a :class:`StreamingHistogram`. When a Simulation has no
+    profiler, none of this is done.
+
+    Timing a messaging unit class replaces its methods for every instance in the process, so the
+    profiler should be closed as soon as it is no longer needed - using it as a context manager
+    does so even if the run fails.
+
+    :cvar str ENVIRONMENT: Advancing the environment. Any time spent in another process (such as
+        SUMO) counts towards the wall time, but not the CPU time
+    :cvar str LIFECYCLE: Creating and destroying the vehicles added to and removed from the environment
+    :cvar str VEHICLES: Stepping every vehicle. The wall time of each class of vehicle is also
+        recorded separately, under ``vehicles.<class name>``
+    :cvar str INTERSECTION_MANAGERS: Stepping every intersection manager
+    :cvar str HOOKS: Running the step hooks - such as polling a
+        :class:`MetricCollector <intersection_control.core.performance_indication.MetricCollector>`
+    :cvar str MESSAGING: Discovering, sending and broadcasting messages. This happens while the
+        vehicles and intersection managers are stepped, so it is part of their time too, and is
+        only recorded if a messaging unit class is given
+    """
+    ENVIRONMENT = "environment"
+    LIFECYCLE = "lifecycle"
+    VEHICLES = "vehicles"
+    INTERSECTION_MANAGERS = "intersection_managers"
+    HOOKS = "hooks"
+    MESSAGING = "messaging"
+
+    #: The methods of the messaging unit class whose time counts towards MESSAGING
+    MESSAGING_METHODS = ("discover", "send", "broadcast")
+
+    def __init__(self, messaging_unit_class: Optional[Type[MessagingUnit]] = None):
+        """Construct a StepProfiler
+
+        :param Optional[Type[MessagingUnit]] messaging_unit_class: The class of messaging unit used by
+            the algorithm, whose methods are timed until :func:`close` is called. To also count the
+            messages sent using a
+            :class:`MetricCollector <intersection_control.core.performance_indication.MetricCollector>`,
+            create the MetricCollector first.
+        """
+        self.wall_times: Dict[str, StreamingHistogram] = {}
+        self.cpu_times: Dict[str, StreamingHistogram] = {}
+        self.steps = 0
+        self.simulated_time = 0.
+        self.total_wall_time = 0.
+
+        # The times recorded so far in the current step
+        self._step_start_time = 0.
+        self._step_start_wall = 0.
+        self._last_wall = 0.
+        self._last_cpu = 0.
+        self._step_wall: Dict[str, float] = {}
+        self._step_cpu: Dict[str, float] = {}
+        self._step_vehicle_wall: Dict[type, float] = {}
+        self._messaging_wall = 0.
+        self._messaging_cpu = 0.
+        self._messaging_depth = 0
+
+        self.messaging_unit_class = messaging_unit_class
+        # The original methods of the messaging unit class, restored by close, and the wrappers that replace them
+        self._original_messaging_methods: Dict[str, Any] = {}
+        self._messaging_wrappers: Dict[str, Any] = {}
+        # Whether the wrappers time the calls - once closed, any wrappers that could not be removed pass calls through
+        self._timing_messaging = messaging_unit_class is not None
+        if messaging_unit_class is not None:
+            for name in self.MESSAGING_METHODS:
+                original = getattr(messaging_unit_class, name)
+                self._original_messaging_methods[name] = original
+                self._messaging_wrappers[name] = self._time_messaging(original)
+                setattr(messaging_unit_class, name, self._messaging_wrappers[name])
+
+    def close(self):
+        """Stops timing the messaging unit class's methods"""
+        self._timing_messaging = False
+        # Only this profiler's own wrappers are restored, wherever the class still holds them - including where another
+        # wrapper keeps the method it wraps (as a MetricCollector does). Anything else is left alone
+        for name, wrapper in self._messaging_wrappers.items():
+            for attribute, value in list(vars(self.messaging_unit_class).items()):
+                if value is wrapper:
+                    setattr(self.messaging_unit_class, attribute, self._original_messaging_methods[name])
+        self._original_messaging_methods = {}
+        self._messaging_wrappers = {}
+
+    def __enter__(self) -> StepProfiler:
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def start_step(self, time: float):
+        """Called by the simulation before advancing the environment
+
+        :param float time: The environment's current time
+        """
+        self._step_start_time = time
+        self._last_wall = self._step_start_wall = perf_counter()
+        self._last_cpu = process_time()
+
+    def mark(self, phase: str):
+        """Called by the simulation at the end of each phase, to record the time since the end of
+        the previous phase
+
+        :param str phase: The phase that has just ended
+        """
+        wall, cpu = perf_counter(), process_time()
+        self._step_wall[phase] = wall - self._last_wall
+        self._step_cpu[phase] = cpu - self._last_cpu
+        self._last_wall, self._last_cpu = wall, cpu
+
+    def step_vehicles(self, vehicles: Iterable[Vehicle]):
+        """Steps each of the vehicles, recording the time taken by each class of vehicle, and then
+        marks the end of the :attr:`VEHICLES` phase
+
+        :param Iterable[Vehicle] vehicles: The vehicles to step
+        """
+        vehicle_wall = self._step_vehicle_wall
+        # The clock is only read when the class of vehicle changes, so this costs next to nothing per vehicle when
+        # (as is usual) every vehicle is of the same class
+        current_class = None
+        last = perf_counter()
+        for vehicle in vehicles:
+            if type(vehicle) is not current_class:
+                now = perf_counter()
+                if current_class is not None:
+                    vehicle_wall[current_class] = vehicle_wall.get(current_class, 0.) + now - last
+                current_class, last = type(vehicle), now
+            vehicle.step()
+        if current_class is not None:
+            vehicle_wall[current_class] = vehicle_wall.get(current_class, 0.) + perf_counter() - last
+        self.mark(self.VEHICLES)
+
+    def end_step(self, time: float):
+        """Called by the simulation once the step is over, to add the times of each of its phases to
+        the histograms
+
+        :param float time: The environment's current time
+        """
+        self.steps += 1
+        self.simulated_time += time - self._step_start_time
+        self.total_wall_time += self._last_wall - self._step_start_wall
+        for phase, wall in self._step_wall.items():
+            self._histogram(self.wall_times, phase).add(wall)
+            self._histogram(self.cpu_times, phase).add(self._step_cpu[phase])
+        for vehicle_class, wall in self._step_vehicle_wall.items():
+            self._histogram(self.wall_times, f"{self.VEHICLES}.{vehicle_class.__name__}").add(wall)
+        if self.messaging_unit_class is not None:
+            self._histogram(self.wall_times, self.MESSAGING).add(self._messaging_wall)
+            self._histogram(self.cpu_times, self.MESSAGING).add(self._messaging_cpu)
+        self._step_wall = {}
+        self._step_cpu = {}
+        self._step_vehicle_wall = {}
+        self._messaging_wall = self._messaging_cpu = 0.
+
+    def real_time_factor(self) -> float:
+        """Returns how many times faster than real time the profiled steps ran
+
+        :return: The simulated time divided by the wall time of the profiled steps
+        """
+        return self.simulated_time / self.total_wall_time if self.total_wall_time > 0 else 0.
+
+    def report(self) -> Dict[str, Any]:
+        """Summarises the times recorded
+
+        :return: A dictionary with the number of steps profiled, the real time factor, and for each
+            phase, the mean, p50, p95, p99 and total of its wall and (where recorded) CPU time per
+            step, in seconds
+        """
+        return {
+            "steps": self.steps,
+            "real_time_factor": self.real_time_factor(),
+            "phases": {phase: {clock: self._summarise(times[phase])
+                               for clock, times in [("wall", self.wall_times), ("cpu", self.cpu_times)]
+                               if phase in times}
+                       for phase in self.wall_times}
+        }
+
+    def summary(self) -> str:
+        """Formats the wall times recorded as a table, one row per phase
+
+        :return: The table
+        """
+        lines = [f"{self.steps} steps, real time factor {self.real_time_factor():.2f}",
+                 f"{'phase':<40}{'mean (ms)':>12}{'p50 (ms)':>12}{'p95 (ms)':>12}{'p99 (ms)':>12}"]
+        for phase, histogram in self.wall_times.items():
+            lines.append(f"{phase:<40}{histogram.mean() * 1000:>12.3f}{histogram.quantile(0.5) * 1000:>12.3f}"
+                         f"{histogram.quantile(0.95) * 1000:>12.3f}{histogram.quantile(0.99) * 1000:>12.3f}")
+        return "\n".join(lines)
+
+    def _time_messaging(self, method):
+        profiler = self
+
+        def wrapper(*args, **kwargs):
+            # Broadcasting discovers and sends too, so only the outermost call is timed
+            if profiler._messaging_depth > 0 or not profiler._timing_messaging:
+                return method(*args, **kwargs)
+            profiler._messaging_depth += 1
+            wall, cpu = perf_counter(), process_time()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                profiler._messaging_wall += perf_counter() - wall
+                profiler._messaging_cpu += process_time() - cpu
+                profiler._messaging_depth -= 1
+
+        wrapper._profiler = self
+        return wrapper
+
+    @staticmethod
+    def _histogram(histograms: Dict[str, StreamingHistogram], phase: str) -> StreamingHistogram:
+        histogram = histograms.get(phase)
+        if histogram is None:
+            histogram = histograms[phase] = StreamingHistogram()
+        return histogram
+
+    @staticmethod
+    def _summarise(histogram: StreamingHistogram) -> Dict[str, float]:
+        return {"mean": histogram.mean(), "p50": histogram.quantile(0.5), "p95": histogram.quantile(0.95),
+                "p99": histogram.quantile(0.99), "total": histogram.total}
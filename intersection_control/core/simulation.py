@@ -0,0 +1,143 @@
+from typing import Callable, Dict, List, Optional
+
+from intersection_control.core.environment import Environment
+from intersection_control.core.algorithm import Vehicle, IntersectionManager, next_wake_up_time
+from intersection_control.core.profiling import StepProfiler
+
+'''
+Simulation
+-------------
+Runs an intersection control algorithm in an environment - keeping a vehicle object for every
+vehicle in the environment, and stepping the vehicles and intersection managers along with it
+'''
+
+
+class Simulation:
+    """Runs an intersection control algorithm in an environment
+
+    A vehicle is created, using the given factory, for every vehicle in the environment, and
+    destroyed when the vehicle leaves it. Vehicles and intersection managers are kept in
+    dictionaries keyed by ID, so the work done to keep track of them each step is proportional
+    to the number of vehicles added and removed, rather than the number in the environment.
+
+    Hooks can be added to be called at the end of every step, once every vehicle and
+    intersection manager has been stepped - for example to poll a
+    :class:`MetricCollector <intersection_control.core.performance_indication.MetricCollector>`.
+
+    If a :class:`StepProfiler <intersection_control.core.profiling.StepProfiler>` is given, the
+    time taken by each phase of every step is recorded in it.
+    """
+
+    def __init__(self, environment: Environment, vehicle_factory: Callable[[str, Environment], Vehicle],
+                 intersection_manager_factory: Optional[Callable[[str, Environment], IntersectionManager]] = None,
+                 skip_idle_steps: bool = False, profiler: Optional[StepProfiler] = None):
+        """Construct a Simulation, creating the vehicles and intersection managers for everything
+        already in the environment
+
+        :param Environment environment: The environment to run the algorithm in
+        :param Callable[[str, Environment], Vehicle] vehicle_factory: A function that creates the
+            vehicle with the given ID in the given environment
+        :param Optional[Callable[[str, Environment], IntersectionManager]] intersection_manager_factory:
+            A function that creates the intersection manager for the intersection with the given ID
+            in the given environment, or None if the algorithm does not use intersection managers
+        :param bool skip_idle_steps: If True, :func:`run_until` skips over any steps in which no
+            vehicle or intersection manager needs to act, using
+            :func:`Environment.step_until <intersection_control.core.Environment.step_until>`
+        :param Optional[StepProfiler] profiler: The profiler to record the time taken by each phase
+            of every step in, or None to not profile the steps
+        """
+        self.environment = environment
+        self.vehicle_factory = vehicle_factory
+        self.skip_idle_steps = skip_idle_steps
+        self.profiler = profiler
+        self.vehicles: Dict[str, Vehicle] = {vehicle_id: vehicle_factory(vehicle_id, environment)
+                                             for vehicle_id in environment.vehicles.get_ids()}
+        self.intersection_managers: Dict[str, IntersectionManager] = {
+            intersection_id: intersection_manager_factory(intersection_id, environment)
+            for intersection_id in environment.intersections.get_ids()
+        } if intersection_manager_factory else {}
+        # Functions called at the end of every step
+        self.step_hooks: List[Callable[[], None]] = []
+
+    def add_step_hook(self, hook: Callable[[], None]):
+        """Add a function to be called at the end of every step
+
+        :param Callable[[], None] hook: The function to call
+        """
+        self.step_hooks.append(hook)
+
+    def step(self):
+        """Performs a single step in the environment, and then steps every vehicle and
+        intersection manager"""
+        self._step(self.environment.step)
+
+    def run(self, steps: int):
+        """Performs the given number of steps
+
+        :param int steps: The number of steps to perform
+        """
+        for _ in range(steps):
+            self.step()
+
+    def run_until(self, time: float):
+        """Steps until the environment reaches the given time
+
+        If the simulation skips idle steps, the environment is advanced straight to the next
+        time any vehicle or intersection manager needs to act (or any vehicle is added), rather
+        than a step at a time.
+
+        :param float time: The time in seconds to run until
+        """
+        while self.environment.get_current_time() < time:
+            if not self.skip_idle_steps:
+                self.step()
+                continue
+            wake_up_time = next_wake_up_time(list(self.vehicles.values()) + list(self.intersection_managers.values()))
+            target = min(wake_up_time, time) if wake_up_time is not None else time
+            # Vehicles added along the way have not yet had the chance to say when they need to act
+            self._step(lambda: self.environment.step_until(target, stop_on_added=True))
+
+    def close(self):
+        """Destroys every remaining vehicle and intersection manager"""
+        for vehicle in self.vehicles.values():
+            vehicle.destroy()
+        for intersection_manager in self.intersection_managers.values():
+            intersection_manager.destroy()
+        self.vehicles = {}
+        self.intersection_managers = {}
+
+    def _step(self, advance_environment: Callable[[], None]):
+        profiler = self.profiler
+        if profiler is None:
+            advance_environment()
+            self._update_vehicles()
+            for vehicle in self.vehicles.values():
+                vehicle.step()
+            for intersection_manager in self.intersection_managers.values():
+                intersection_manager.step()
+            for hook in self.step_hooks:
+                hook()
+            return
+
+        profiler.start_step(self.environment.get_current_time())
+        advance_environment()
+        profiler.mark(StepProfiler.ENVIRONMENT)
+        self._update_vehicles()
+        profiler.mark(StepProfiler.LIFECYCLE)
+        profiler.step_vehicles(self.vehicles.values())
+        for intersection_manager in self.intersection_managers.values():
+            intersection_manager.step()
+        profiler.mark(StepProfiler.INTERSECTION_MANAGERS)
+        for hook in self.step_hooks:
+            hook()
+        profiler.mark(StepProfiler.HOOKS)
+        profiler.end_step(self.environment.get_current_time())
+
+    def _update_vehicles(self):
+        for vehicle_id in self.environment.get_removed_vehicles():
+            vehicle = self.vehicles.pop(vehicle_id, None)
+            if vehicle is not None:
+                vehicle.destroy()
+        # After skipping steps, vehicles that came and went in between are reported as both added and removed
+        for vehicle_id in self.environment.get_added_vehicles() - self.environment.get_removed_vehicles():
+            self.vehicles[vehicle_id] = self.vehicle_factory(vehicle_id, self.environment)
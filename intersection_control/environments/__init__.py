@@ -1,3 +1,19 @@
 from .sumo import SumoEnvironment
+from .env_pool import EnvPool, WorkerError
+from .profiling_environment import ProfilingEnvironment, CallStats
+from .sweep import Sweep, StoppingRule, RunRecord, RunTimedOut, run_sweep, load_run_records, aggregate_results
 
-__all__ = ["SumoEnvironment"]
+__all__ = [
+    "SumoEnvironment",
+    "EnvPool",
+    "WorkerError",
+    "ProfilingEnvironment",
+    "CallStats",
+    "Sweep",
+    "StoppingRule",
+    "RunRecord",
+    "RunTimedOut",
+    "run_sweep",
+    "load_run_records",
+    "aggregate_results"
+]
@@ -0,0 +1,261 @@
+from __future__ import annotations
+
+import multiprocessing
+import traceback
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Iterable, List, Optional, Dict, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class WorkerError(Exception):
+    """Raised in the parent process when a worker in an :class:`EnvPool` fails
+
+    :ivar int worker_index: The index of the worker that failed
+    :ivar str worker_traceback: The formatted traceback from the worker, or a
+        description of how the worker died if it crashed
+    :ivar Optional[int] task_index: The index of the :func:`EnvPool.run` task that
+        failed, if the error comes from one
+    """
+
+    def __init__(self, worker_index: int, worker_traceback: str, task_index: Optional[int] = None):
+        super().__init__(f"Worker {worker_index} failed:\n{worker_traceback}")
+        self.worker_index = worker_index
+        self.worker_traceback = worker_traceback
+        self.task_index = task_index
+
+
+class EnvPool:
+    """A pool of worker processes, each owning its own environment
+
+    Every worker calls ``env_factory`` once when it starts, and keeps the object
+    it returns for its whole lifetime. This would usually be an environment (such
+    as a :class:`SumoEnvironment <intersection_control.environments.SumoEnvironment>`,
+    which starts its own SUMO instance), but can be any object bundling an
+    environment together with its algorithm stack.
+
+    Workers can be driven in lock-step using :func:`step` and :func:`call`, or
+    handed independent tasks (e.g. the runs of a parameter sweep) using :func:`run`.
+
+    If a worker raises an exception or its process dies, the worker is restarted
+    with a fresh environment. Failed :func:`run` tasks are retried up to
+    ``max_retries`` times; anything else is propagated as a :class:`WorkerError`.
+    If a worker cannot be restarted (because ``env_factory`` fails), the pool can
+    no longer be used, and every later call raises a :class:`WorkerError` - only
+    :func:`close` still works.
+
+    .. note::
+        Anything sent to a worker (``env_factory`` when using the ``spawn`` start
+        method, the functions passed to :func:`run`, and all arguments and results)
+        must be picklable - so module-level functions should be used rather than
+        lambdas.
+    """
+
+    def __init__(self, env_factory: Callable[[], Any], num_workers: Optional[int] = None, max_retries: int = 2,
+                 start_method: Optional[str] = None):
+        """Construct an EnvPool, starting all of its workers
+
+        :param Callable[[], Any] env_factory: Called once in each worker to build
+            the environment the worker owns
+        :param Optional[int] num_workers: The number of worker processes to start.
+            Defaults to the number of CPUs
+        :param int max_retries: The number of times a :func:`run` task is retried
+            on a fresh worker before its failure is propagated
+        :param Optional[str] start_method: The multiprocessing start method to use
+            (``"fork"``, ``"spawn"`` or ``"forkserver"``). Defaults to the platform default
+        """
+        self.env_factory = env_factory
+        self.num_workers = num_workers if num_workers is not None else multiprocessing.cpu_count()
+        self.max_retries = max_retries
+        self._context = multiprocessing.get_context(start_method)
+        self._processes: List[Optional[multiprocessing.process.BaseProcess]] = [None] * self.num_workers
+        self._connections: List[Optional[Connection]] = [None] * self.num_workers
+        for i in range(self.num_workers):
+            self._start_worker(i)
+        try:
+            for i in range(self.num_workers):
+                self._receive(i, restart=False)  # Wait for every environment to be ready
+        except WorkerError:
+            self.close()
+            raise
+
+    def __enter__(self) -> EnvPool:
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def step(self, num_steps: int = 1) -> List[Any]:
+        """Steps every worker's environment ``num_steps`` times
+
+        :param int num_steps: The number of steps each environment should perform
+        :return: The value returned by each environment's last call to step, in worker order
+        """
+        return self.call("step", _repeat=num_steps)
+
+    def call(self, method: str, *args, _repeat: int = 1, **kwargs) -> List[Any]:
+        """Calls the given method on every worker's environment, in parallel
+
+        :param str method: The name of the method to call
+        :return: The value returned by each environment, in worker order
+        """
+        self._check_workers()
+        for i in range(self.num_workers):
+            self._connections[i].send(("call", (method, args, kwargs, _repeat)))
+        results = []
+        errors = []
+        for i in range(self.num_workers):
+            try:
+                results.append(self._receive(i))
+            except WorkerError as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+        return results
+
+    def run(self, fn: Callable[[Any, T], R], tasks: Iterable[T]) -> List[R]:
+        """Runs ``fn(env, task)`` for each task, spreading the tasks across the workers
+
+        Tasks are handed out to workers as they become free, so runs of varying
+        length keep every worker busy.
+
+        :param Callable[[Any, T], R] fn: The function to run for each task. It is passed
+            the environment owned by the worker it runs on, and the task
+        :param Iterable[T] tasks: The tasks to run
+        :return: The result of each task, in the same order as the tasks
+        :raises WorkerError: If a task fails more than ``max_retries`` times, with its index in
+            :attr:`WorkerError.task_index`. The tasks still running are waited for, but any
+            not yet handed out are not run
+        """
+        self._check_workers()
+        tasks = list(tasks)
+        pending = list(enumerate(tasks))[::-1]
+        results: Dict[int, R] = {}
+        attempts: Dict[int, int] = {}
+        busy: Dict[int, int] = {}  # Maps worker indices to the index of the task they are running
+
+        while pending or busy:
+            for i in range(self.num_workers):
+                if i not in busy and pending:
+                    task_index, task = pending.pop()
+                    self._connections[i].send(("run", (fn, task)))
+                    busy[i] = task_index
+            ready = wait([self._connections[i] for i in busy])
+            for i in [i for i in busy if self._connections[i] in ready]:
+                task_index = busy.pop(i)
+                try:
+                    results[task_index] = self._receive(i)
+                except WorkerError as e:
+                    attempts[task_index] = attempts.get(task_index, 0) + 1
+                    # There is no point retrying once a worker could not be restarted
+                    if attempts[task_index] > self.max_retries or self._connections[i] is None:
+                        self._drain(busy)
+                        e.task_index = task_index
+                        raise
+                    pending.append((task_index, tasks[task_index]))
+        return [results[i] for i in range(len(tasks))]
+
+    def close(self):
+        """Closes every worker's environment and stops the worker processes"""
+        for i in range(self.num_workers):
+            if self._connections[i] is not None:
+                try:
+                    self._connections[i].send(("close", None))
+                except (BrokenPipeError, OSError):
+                    pass
+        for i in range(self.num_workers):
+            if self._processes[i] is not None:
+                self._processes[i].join(timeout=10)
+                if self._processes[i].is_alive():
+                    self._processes[i].terminate()
+                self._connections[i].close()
+                self._processes[i] = None
+                self._connections[i] = None
+
+    def _start_worker(self, i: int):
+        parent, child = self._context.Pipe()
+        process = self._context.Process(target=_worker, args=(child, self.env_factory), daemon=True)
+        process.start()
+        child.close()
+        self._processes[i] = process
+        self._connections[i] = parent
+
+    def _restart_worker(self, i: int):
+        if self._processes[i].is_alive():
+            # The worker survived the failure, so give it the chance to close its environment cleanly
+            try:
+                self._connections[i].send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+            self._processes[i].join(timeout=10)
+            if self._processes[i].is_alive():
+                self._processes[i].terminate()
+        self._processes[i].join()
+        self._connections[i].close()
+        self._start_worker(i)
+        try:
+            self._receive(i, restart=False)
+        except WorkerError as e:
+            # The slot is emptied rather than left holding a dead worker, which would hang or fail confusingly later
+            self._processes[i].join()
+            self._connections[i].close()
+            self._processes[i] = None
+            self._connections[i] = None
+            raise WorkerError(i, f"The worker could not be restarted:\n{e.worker_traceback}") from e
+
+    def _check_workers(self):
+        for i in range(self.num_workers):
+            if self._connections[i] is None:
+                raise WorkerError(i, "The worker could not be restarted, so the pool can no longer be used")
+
+    def _receive(self, i: int, restart: bool = True) -> Any:
+        try:
+            status, payload = self._connections[i].recv()
+        except (EOFError, ConnectionResetError):
+            self._processes[i].join()
+            status, payload = "error", f"Worker process died with exit code {self._processes[i].exitcode}"
+        if status == "error":
+            if restart:
+                self._restart_worker(i)
+            raise WorkerError(i, payload)
+        return payload
+
+    def _drain(self, busy: Dict[int, int]):
+        """Waits for the tasks still running to finish, so the workers are left in a usable state"""
+        for i in list(busy):
+            try:
+                self._receive(i)
+            except WorkerError:
+                pass
+        busy.clear()
+
+
+def _worker(connection: Connection, env_factory: Callable[[], Any]):
+    try:
+        env = env_factory()
+    except Exception:
+        connection.send(("error", traceback.format_exc()))
+        connection.close()
+        return
+    connection.send(("ok", None))
+
+    while True:
+        command, payload = connection.recv()
+        if command == "close":
+            if hasattr(env, "close"):
+                env.close()
+            connection.close()
+            return
+        try:
+            if command == "call":
+                method, args, kwargs, repeat = payload
+                result = None
+                for _ in range(repeat):
+                    result = getattr(env, method)(*args, **kwargs)
+            else:
+                fn, task = payload
+                result = fn(env, task)
+            connection.send(("ok", result))
+        except Exception:
+            connection.send(("error", traceback.format_exc()))
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import os
+import sys
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from intersection_control.core import Environment, Vehicle, IntersectionManager
+from intersection_control.core.environment import StepEvents
+
+# The number of frames above a handler call searched for the vehicle or intersection manager making it
+MAX_CALLER_DEPTH = 12
+# The directory of the environment modules (this one included). Frames running their code are skipped when looking
+# for the caller, however many wrappers - such as other ProfilingEnvironments - there are between it and the call
+ENVIRONMENTS_DIR = os.path.dirname(__file__) + os.sep
+
+
+@dataclass
+class CallStats:
+    """The calls made to a single method of an environment, from a single class
+
+    :ivar int calls: The number of calls made
+    :ivar float total_time: The total wall time spent in the calls, in seconds
+    :ivar int round_trips: The number of round trips the environment made to its backend during
+        the calls (such as TraCI commands sent to SUMO), if the backend supports counting them
+    """
+    calls: int = 0
+    total_time: float = 0.
+    round_trips: int = 0
+
+
+class ProfilingEnvironment(Environment):
+    """Wraps another environment, counting and timing every call made to it
+
+    Calls to the environment itself, and to its :attr:`vehicles` and :attr:`intersections`
+    handlers, are recorded per method (e.g. ``vehicles.get_speed``) and per calling class. Code
+    in the environment modules (such as another ProfilingEnvironment wrapping this one) is never
+    the caller - beyond that, the caller is the innermost :class:`Vehicle <intersection_control.core.Vehicle>` or
+    :class:`IntersectionManager <intersection_control.core.IntersectionManager>` on the call
+    stack - so calls made by a messaging unit on behalf of a vehicle count towards the vehicle's
+    class - or otherwise the innermost object with a method on the stack (such as a
+    :class:`MetricCollector <intersection_control.core.performance_indication.MetricCollector>`).
+
+    If the wrapped environment talks to SUMO over TraCI, the commands sent during each call are
+    counted too, by wrapping the private method of the TraCI connection that sends them. If the
+    connection has no such method (as in other versions of TraCI), they are not counted. Any
+    other attribute of the wrapped environment (such as ``close``) can be used
+    through the wrapper directly, but is not profiled.
+
+    Finding the caller of every call is not free, so this is meant for finding out where load
+    comes from, rather than for timing runs.
+    """
+
+    def __init__(self, environment: Environment):
+        """Construct a ProfilingEnvironment
+
+        :param Environment environment: The environment to wrap
+        """
+        self.environment = environment
+        # Dictionary mapping (method, calling class) to the calls made to that method from that class
+        self.stats: Dict[Tuple[str, str], CallStats] = {}
+        # The stats of the call in progress, which any round trips are counted towards
+        self._current_stats: Optional[CallStats] = None
+        self._vehicles = _ProfilingHandler(self, "vehicles")
+        self._intersections = _ProfilingHandler(self, "intersections")
+
+        # The TraCI connection whose commands are counted, and its method that sends them, if it has one
+        self._connection = getattr(environment, "connection", None)
+        self._send: Optional[Callable] = None
+        # The send method wrapped to count the round trips, and whatever the connection itself held under its name
+        # beforehand (rather than getting from its class), so that stop_counting_round_trips can put it back
+        self._counting_send: Optional[Callable] = None
+        self._own_send: Optional[Callable] = None
+        send = getattr(self._connection, "_sendExact", None)
+        if callable(send):
+            self._send = send
+            self._own_send = vars(self._connection).get("_sendExact")
+            self._counting_send = self._count_round_trips(send)
+            self._connection._sendExact = self._counting_send
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "environment":  # Not set yet, so would otherwise recurse
+            raise AttributeError(name)
+        return getattr(self.environment, name)
+
+    @property
+    def intersections(self) -> _ProfilingHandler:
+        return self._intersections
+
+    @property
+    def vehicles(self) -> _ProfilingHandler:
+        return self._vehicles
+
+    def get_current_time(self) -> float:
+        return self.call("environment.get_current_time", self.environment.get_current_time)
+
+    def step(self) -> StepEvents:
+        return self.call("environment.step", self.environment.step)
+
+    def step_until(self, time: float, stop_on_added: bool = False) -> StepEvents:
+        return self.call("environment.step_until", self.environment.step_until, time, stop_on_added)
+
+    def get_step_events(self) -> StepEvents:
+        return self.call("environment.get_step_events", self.environment.get_step_events)
+
+    def get_removed_vehicles(self):
+        return self.call("environment.get_removed_vehicles", self.environment.get_removed_vehicles)
+
+    def get_added_vehicles(self):
+        return self.call("environment.get_added_vehicles", self.environment.get_added_vehicles)
+
+    def clear(self):
+        return self.call("environment.clear", self.environment.clear)
+
+    def snapshot(self) -> Any:
+        return self.call("environment.snapshot", self.environment.snapshot)
+
+    def restore(self, snapshot: Any):
+        return self.call("environment.restore", self.environment.restore, snapshot)
+
+    def call(self, method_name: str, method: Callable, *args, **kwargs) -> Any:
+        """Calls a method of the wrapped environment, recording the call
+
+        The call is recorded against the caller found outside of the environment modules (see
+        :class:`ProfilingEnvironment`).
+
+        :param str method_name: The name the call is recorded under
+        :param Callable method: The method to call
+        :return: Whatever the method returns
+        """
+        key = (method_name, _caller_class_name())
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = CallStats()
+        previous_stats, self._current_stats = self._current_stats, stats
+        start = perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            stats.total_time += perf_counter() - start
+            stats.calls += 1
+            self._current_stats = previous_stats
+
+    def reset_stats(self):
+        """Forgets all the calls recorded so far"""
+        self.stats = {}
+
+    def stop_counting_round_trips(self):
+        """Stops counting the round trips made by the wrapped environment - this should be called
+        before the wrapper is discarded, if the wrapped environment is still to be used"""
+        if self._send is None:
+            return
+        # Anything that has replaced the wrapper since is left alone
+        if vars(self._connection).get("_sendExact") is self._counting_send:
+            if self._own_send is not None:
+                self._connection._sendExact = self._own_send
+            else:
+                del self._connection._sendExact
+        self._send = self._counting_send = self._own_send = None
+
+    def summary(self, by_caller: bool = True) -> str:
+        """Formats the calls recorded as a table, ordered by the total time spent in them
+
+        :param bool by_caller: Whether to give each calling class its own row, rather than
+            combining the calls to each method
+        :return: The table
+        """
+        stats: Dict[Tuple[str, str], CallStats] = {}
+        for (method_name, caller), method_stats in self.stats.items():
+            combined = stats.setdefault((method_name, caller if by_caller else ""), CallStats())
+            combined.calls += method_stats.calls
+            combined.total_time += method_stats.total_time
+            combined.round_trips += method_stats.round_trips
+        lines = [f"{'method':<40}{'caller':<30}{'calls':>10}{'total (ms)':>14}{'mean (us)':>12}{'round trips':>14}"]
+        for (method_name, caller), method_stats in sorted(stats.items(), key=lambda item: -item[1].total_time):
+            lines.append(f"{method_name:<40}{caller:<30}{method_stats.calls:>10}"
+                         f"{method_stats.total_time * 1000:>14.3f}"
+                         f"{method_stats.total_time / method_stats.calls * 1e6:>12.2f}{method_stats.round_trips:>14}")
+        return "\n".join(lines)
+
+    def _count_round_trips(self, send: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            if self._current_stats is not None:
+                self._current_stats.round_trips += 1
+            return send(*args, **kwargs)
+
+        return wrapper
+
+
+class _ProfilingHandler:
+    """Stands in for one of the wrapped environment's handlers, recording every method called on it
+
+    The handler is looked up on every call, so that the wrapper keeps working if the wrapped
+    environment replaces its handlers (for example, when a SumoEnvironment is reloaded)
+    """
+
+    def __init__(self, profiling_environment: ProfilingEnvironment, handler_name: str):
+        self._profiling_environment = profiling_environment
+        self._handler_name = handler_name
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(getattr(self._profiling_environment.environment, self._handler_name), name)
+        if not callable(attribute):
+            return attribute
+        profiling_environment, handler_name, method_name = \
+            self._profiling_environment, self._handler_name, f"{self._handler_name}.{name}"
+
+        def method(*args, **kwargs):
+            return profiling_environment.call(
+                method_name, getattr(getattr(profiling_environment.environment, handler_name), name), *args, **kwargs)
+
+        # Cached, so that later lookups skip __getattr__
+        setattr(self, name, method)
+        return method
+
+
+def _caller_class_name() -> str:
+    # Without frame inspection (outside of CPython), the caller is unknown
+    try:
+        frame = sys._getframe(1)
+    except AttributeError:
+        return "<none>"
+    while frame is not None and frame.f_code.co_filename.startswith(ENVIRONMENTS_DIR):
+        frame = frame.f_back
+    first_class_name = None
+    for _ in range(MAX_CALLER_DEPTH):
+        if frame is None:
+            break
+        caller = frame.f_locals.get("self")
+        if isinstance(caller, (Vehicle, IntersectionManager)):
+            return type(caller).__name__
+        if first_class_name is None and caller is not None:
+            first_class_name = type(caller).__name__
+        frame = frame.f_back
+    return first_class_name or "<none>"
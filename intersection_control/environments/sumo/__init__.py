@@ -1,15 +1,29 @@
-from .sumo_environment import SumoEnvironment
+from .sumo_environment import SumoEnvironment, SumoSnapshot
 from .sumo_vehicle_handler import SumoVehicleHandler
 from .sumo_intersection_handler import SumoIntersectionHandler
-from .utils import DemandGenerator, ScenarioGenerator, RandomDemandGenerator, ControlType, NewVehicleParams
+from .utils import DemandGenerator, ScenarioGenerator, RandomDemandGenerator, RateProfile, ProfileDemandGenerator, \
+    TraceDemandGenerator, ControlType, NewVehicleParams
+from .network_generator import GeneratedNetwork, generate_grid_network, generate_arterial_network
+from .network_cache import NetworkData, load_network_data
+from .demand_compiler import compile_demand
 
 __all__ = [
     "SumoEnvironment",
+    "SumoSnapshot",
     "SumoVehicleHandler",
     "SumoIntersectionHandler",
     "DemandGenerator",
     "ScenarioGenerator",
     "RandomDemandGenerator",
+    "RateProfile",
+    "ProfileDemandGenerator",
+    "TraceDemandGenerator",
     "ControlType",
-    "NewVehicleParams"
+    "NewVehicleParams",
+    "GeneratedNetwork",
+    "generate_grid_network",
+    "generate_arterial_network",
+    "NetworkData",
+    "load_network_data",
+    "compile_demand"
 ]
@@ -0,0 +1,42 @@
+from typing import Optional
+from xml.sax.saxutils import quoteattr
+
+from .network_cache import load_network_data, get_input_files
+from .sumo_environment import VEHICLE_TYPES
+from .utils import DemandGenerator
+
+
+def compile_demand(demand_generator: DemandGenerator, net_config_file: str, duration: float, output_file: str,
+                   time_step: float = 0.05, cache_dir: Optional[str] = None) -> str:
+    """Samples every vehicle a demand generator would add over a run, and writes them to a
+    SUMO route file
+
+    The route file can be passed as the ``demand_file`` of a
+    :class:`SumoEnvironment <intersection_control.environments.SumoEnvironment>`, which then
+    has SUMO insert the vehicles itself, without any TraCI calls - so this is only suitable
+    for demand generators that do not depend on what happens in the simulation. Vehicles
+    depart at exactly the same times, on the same lanes, as they would if the demand
+    generator were passed to the environment instead, given the same seed.
+
+    :param DemandGenerator demand_generator: The demand generator to sample vehicles from
+    :param str net_config_file: The SUMO configuration file of the network the vehicles are for
+    :param float duration: The length of the run in seconds
+    :param str output_file: The route file to write
+    :param float time_step: The length of a single time step in the simulation the file will be used in
+    :param Optional[str] cache_dir: The directory the network's derived data is cached in - see
+        :func:`load_network_data <intersection_control.environments.sumo.load_network_data>`
+    :return: The path of the route file written
+    """
+    departure_lanes = load_network_data(get_input_files(net_config_file, "net-file")[0],
+                                        get_input_files(net_config_file, "route-files")[0], cache_dir).departure_lanes
+    with open(output_file, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n\n<routes>\n')
+        # The environment performs a single step before the demand generator is first stepped
+        for step in range(1, round(duration / time_step) + 1):
+            for v in demand_generator.step():
+                f.write(f'    <vehicle id={quoteattr(v.veh_id)} type="{VEHICLE_TYPES[v.control_type]}" '
+                        f'route={quoteattr(v.route_id)} depart="{step * time_step:.3f}" '
+                        f'departLane="{demand_generator.choose_departure_lane(v, departure_lanes[v.route_id])}" '
+                        f'departSpeed="{v.depart_speed}" departPos="{v.depart_pos}"/>\n')
+        f.write('</routes>\n')
+    return output_file
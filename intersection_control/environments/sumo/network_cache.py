@@ -0,0 +1,168 @@
+from __future__ import annotations
+import hashlib
+import os
+import pickle
+import tempfile
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple, Optional
+
+import numpy as np
+import sumolib
+
+# Bump this whenever the contents of NetworkData change, so that old cache entries are not loaded
+CACHE_VERSION = 1
+
+
+@dataclass
+class NetworkData:
+    """Everything the SUMO environment derives from a network and its routes
+
+    Building this requires parsing the network file, which can take a long time for large
+    networks. :func:`load_network_data` can instead load it from an on-disk cache.
+
+    :ivar Dict[str, List[str]] routes: The route IDs in the route file, mapped to the edges they pass through
+    :ivar List[str] edge_ids: The IDs of the edges in the network, including internal edges
+    :ivar List[str] traffic_lights: The IDs of the traffic light controlled junctions
+    :ivar Dict[str, List[str]] incoming_edges: The edges entering each junction
+    :ivar Dict[str, List[str]] outgoing_edges: The edges leaving each junction
+    :ivar Dict[str, List[str]] internal_lanes: The internal lanes of each junction
+    :ivar Dict[str, float] lane_lengths: The length of every lane (including internal lanes)
+    :ivar Dict[str, Tuple[str, float, int, int]] internal_lane_geometry: The incoming lane, speed limit, and
+        start and end indices of the shape in :attr:`points`, of each internal lane
+    :ivar np.ndarray points: The points of all internal lane shapes, one per row
+    :ivar Dict[str, List[str]] internal_lanes_on_route: The internal lanes each route passes through
+    :ivar Dict[str, List[int]] departure_lanes: The indices of the lanes a vehicle on each route can depart from
+    """
+    routes: Dict[str, List[str]]
+    edge_ids: List[str]
+    traffic_lights: List[str]
+    incoming_edges: Dict[str, List[str]]
+    outgoing_edges: Dict[str, List[str]]
+    internal_lanes: Dict[str, List[str]]
+    lane_lengths: Dict[str, float]
+    internal_lane_geometry: Dict[str, Tuple[str, float, int, int]]
+    points: np.ndarray = field(repr=False)
+    internal_lanes_on_route: Dict[str, List[str]]
+    departure_lanes: Dict[str, List[int]]
+
+    @staticmethod
+    def from_files(net_file: str, route_file: str) -> NetworkData:
+        """Parses the given network and route files, and derives everything from them
+
+        :param str net_file: The SUMO network file
+        :param str route_file: The SUMO route file
+        :return: The derived network data
+        """
+        net = sumolib.net.readNet(net_file, withInternal=True)
+        routes = {route.id: route.edges.split() for route in
+                  sumolib.xml.parse_fast(route_file, 'route', ['id', 'edges'])}
+        # Internal junctions are not intersections in their own right - their lanes belong to the junction around them
+        junctions = [node for node in net.getNodes() if node.getType() != "internal"]
+
+        points = []
+        internal_lane_geometry = {}
+        for node in junctions:
+            for lane in [net.getLane(lane_id) for lane_id in _get_internal_lanes(node)]:
+                internal_lane_geometry[lane.getID()] = (lane.getIncoming()[0].getID(), lane.getSpeed(), len(points),
+                                                        len(points) + len(lane.getShape()))
+                points += lane.getShape()
+
+        return NetworkData(
+            routes=routes,
+            edge_ids=[edge.getID() for edge in net.getEdges()],
+            traffic_lights=[node.getID() for node in junctions if node.getType() == "traffic_light"],
+            incoming_edges={node.getID(): [edge.getID() for edge in node.getIncoming()
+                                           if edge.getFunction() != "internal"] for node in junctions},
+            outgoing_edges={node.getID(): [edge.getID() for edge in node.getOutgoing()
+                                           if edge.getFunction() != "internal"] for node in junctions},
+            internal_lanes={node.getID(): _get_internal_lanes(node) for node in junctions},
+            lane_lengths={lane.getID(): lane.getLength() for edge in net.getEdges(withInternal=True)
+                          for lane in edge.getLanes()},
+            internal_lane_geometry=internal_lane_geometry,
+            points=np.array(points, dtype=float).reshape(-1, 2),
+            internal_lanes_on_route={
+                route: [connection.getViaLaneID() for from_edge, to_edge in zip(edges, edges[1:]) for connection
+                        in net.getEdge(from_edge).getConnections(net.getEdge(to_edge)) if connection.getViaLaneID()]
+                for route, edges in routes.items()
+            },
+            departure_lanes={
+                route: [lane.getIndex() for lane in net.getEdge(edges[0]).getLanes()
+                        if edges[1] in [conn.getTo().getID() for conn in lane.getOutgoing()]]
+                for route, edges in routes.items()
+            }
+        )
+
+    def get_shape(self, internal_lane_id: str) -> np.ndarray:
+        """Returns the points making up the shape of an internal lane
+
+        :param str internal_lane_id: The ID of an internal lane
+        :return: The points of the lane's shape, one per row
+        """
+        _, _, start, end = self.internal_lane_geometry[internal_lane_id]
+        return self.points[start:end]
+
+
+def load_network_data(net_file: str, route_file: str, cache_dir: Optional[str] = None) -> NetworkData:
+    """Returns the :class:`NetworkData` derived from the given network and route files
+
+    If a cache directory is given, the data is loaded from there if the same files have been
+    loaded before - and stored there if not. Entries are keyed by a hash of the contents of
+    the files, so an entry is never loaded once the files it was built from change. The
+    point arrays are memory mapped, so they are shared between processes loading the same
+    network.
+
+    :param str net_file: The SUMO network file
+    :param str route_file: The SUMO route file
+    :param Optional[str] cache_dir: The cache directory, or None to skip the cache
+    :return: The derived network data
+    """
+    if cache_dir is None:
+        return NetworkData.from_files(net_file, route_file)
+
+    entry_dir = os.path.join(cache_dir, _hash_files(net_file, route_file))
+    data_file, points_file = os.path.join(entry_dir, "data.pkl"), os.path.join(entry_dir, "points.npy")
+    if os.path.exists(data_file) and os.path.exists(points_file):
+        with open(data_file, "rb") as f:
+            data = pickle.load(f)
+        data.points = np.load(points_file, mmap_mode="r")
+        return data
+
+    data = NetworkData.from_files(net_file, route_file)
+    os.makedirs(entry_dir, exist_ok=True)
+    # Written to temporary files first and then moved into place, so that concurrent processes building the same
+    # entry never see a partially written one
+    with tempfile.NamedTemporaryFile(dir=entry_dir, suffix=".npy", delete=False) as f:
+        np.save(f, data.points)
+    os.replace(f.name, points_file)
+    points, data.points = data.points, np.empty((0, 2))
+    with tempfile.NamedTemporaryFile(dir=entry_dir, delete=False) as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f.name, data_file)
+    data.points = points
+    return data
+
+
+def get_input_files(net_config_file: str, option: str) -> List[str]:
+    """Returns the files given for an input option in a SUMO configuration file
+
+    :param str net_config_file: The SUMO configuration file
+    :param str option: The name of the option, e.g. ``"route-files"``
+    :return: The paths of the files, relative to the current directory rather than the configuration file
+    """
+    return [os.path.join(os.path.dirname(net_config_file), file)
+            for element in sumolib.xml.parse_fast(net_config_file, option, "value")
+            for file in element.value.split(",")]
+
+
+def _get_internal_lanes(node: sumolib.net.node.Node) -> List[str]:
+    # Junctions without any internal lanes report a single empty lane ID
+    return [lane_id for lane_id in node.getInternal() if lane_id]
+
+
+def _hash_files(*files: str) -> str:
+    digest = hashlib.sha256(str(CACHE_VERSION).encode())
+    for file in files:
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
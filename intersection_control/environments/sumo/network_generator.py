@@ -0,0 +1,146 @@
+from __future__ import annotations
+import os
+import subprocess
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import sumolib
+
+from .utils import RandomDemandGenerator, ControlType, DEFAULT_SEED
+
+
+@dataclass
+class GeneratedNetwork:
+    """A network produced by :func:`generate_grid_network` or :func:`generate_arterial_network`
+
+    :ivar str config_file: The SUMO configuration file, to be passed to a
+        :class:`SumoEnvironment <intersection_control.environments.SumoEnvironment>`
+    :ivar Dict[str, List[str]] routes: The route IDs in the network's route file, mapped
+        to the edges they pass through. There is a route from every entry point of the
+        network to every exit point, except the one it entered from
+    :ivar List[str] intersection_ids: The IDs of the traffic light controlled junctions
+    """
+    config_file: str
+    routes: Dict[str, List[str]]
+    intersection_ids: List[str]
+
+    def get_entry_edges(self) -> List[str]:
+        """Returns the edges vehicles enter the network from
+
+        :return: The first edge of every route, without duplicates
+        """
+        return list(dict.fromkeys(edges[0] for edges in self.routes.values()))
+
+    def demand_generator(self, vehicles_per_minute: float, time_step_length: float, depart_speed: float = 10,
+                         control_type: ControlType = ControlType.WITH_SAFETY_PRECAUTIONS,
+                         seed: Optional[int] = DEFAULT_SEED) -> RandomDemandGenerator:
+        """Returns a demand generator spawning vehicles at every entry point of the network
+
+        :param float vehicles_per_minute: The average number of vehicles per minute that
+            should enter the network from each entry point. These are spread evenly across
+            the routes starting there
+        :param float time_step_length: The length of a single time step in the sumo simulation
+        :param float depart_speed: The speed vehicles should be spawned with
+        :param ControlType control_type: The control type of the vehicles spawned
+        :param Optional[int] seed: The seed of the demand generator's random number generator
+        :return: A :class:`RandomDemandGenerator` for the network's routes
+        """
+        routes_per_entry_edge = {edge: 0 for edge in self.get_entry_edges()}
+        for edges in self.routes.values():
+            routes_per_entry_edge[edges[0]] += 1
+        return RandomDemandGenerator({route: vehicles_per_minute / routes_per_entry_edge[edges[0]]
+                                      for route, edges in self.routes.items()}, time_step_length, depart_speed,
+                                     control_type, seed)
+
+
+def generate_grid_network(output_dir: str, rows: int, columns: int, length: float = 200, lanes: int = 1,
+                          speed: float = 13.89, name: str = "grid") -> GeneratedNetwork:
+    """Generates a rows x columns grid of traffic light controlled intersections
+
+    Each intersection at the edge of the grid gets an extra road leading out of the network
+    in each direction where it has no neighbour, so that every intersection has four
+    approaches. Each traffic light is given SUMO's default program, with a separate phase
+    for each approach - these can be overridden by a
+    :class:`TLIntersectionManager <intersection_control.algorithms.traffic_light.TLIntersectionManager>`.
+
+    Requires SUMO's ``netgenerate`` tool.
+
+    :param str output_dir: The directory the network, route and configuration files are written to
+    :param int rows: The number of rows of intersections
+    :param int columns: The number of columns of intersections
+    :param float length: The length of each road in metres
+    :param int lanes: The number of lanes on each road, in each direction
+    :param float speed: The speed limit of each road in m/s
+    :param str name: The name the generated files are given
+    :return: The generated network
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    net_file = os.path.join(output_dir, f"{name}.net.xml")
+    subprocess.run([
+        sumolib.checkBinary("netgenerate"),
+        "--grid",
+        "--grid.x-number", str(columns),
+        "--grid.y-number", str(rows),
+        "--grid.length", str(length),
+        "--grid.attach-length", str(length),
+        "--default.lanenumber", str(lanes),
+        "--default.speed", str(speed),
+        "--default-junction-type", "traffic_light",
+        # Giving each approach its own phase avoids turning vehicles having to yield, so (as in the single
+        # intersection network) each connection has a single internal lane
+        "--tls.layout", "incoming",
+        "--no-turnarounds",
+        "--junctions.corner-detail", "5",
+        "--junctions.limit-turn-speed", "5.5",
+        "--no-warnings",
+        "--output-file", net_file
+    ], check=True, stdout=subprocess.DEVNULL)
+
+    net = sumolib.net.readNet(net_file)
+    routes = _get_routes(net)
+    route_file = os.path.join(output_dir, f"{name}.rou.xml")
+    with open(route_file, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n\n<routes>\n')
+        for route, edges in routes.items():
+            f.write(f'    <route id="{route}" edges="{" ".join(edges)}"/>\n')
+        f.write('</routes>\n')
+
+    config_file = os.path.join(output_dir, f"{name}.sumocfg")
+    with open(config_file, "w") as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n\n<configuration>\n    <input>\n'
+                f'        <net-file value="{name}.net.xml"/>\n'
+                f'        <route-files value="{name}.rou.xml"/>\n'
+                f'    </input>\n</configuration>\n')
+
+    return GeneratedNetwork(config_file, routes,
+                            [node.getID() for node in net.getNodes() if node.getType() == "traffic_light"])
+
+
+def generate_arterial_network(output_dir: str, intersections: int, length: float = 200, lanes: int = 1,
+                              speed: float = 13.89, name: str = "arterial") -> GeneratedNetwork:
+    """Generates a straight arterial road crossed by side roads at a number of traffic light
+    controlled intersections
+
+    See :func:`generate_grid_network` - an arterial is a grid with a single row.
+
+    :param str output_dir: The directory the network, route and configuration files are written to
+    :param int intersections: The number of intersections along the arterial
+    :param float length: The length of each road in metres
+    :param int lanes: The number of lanes on each road, in each direction
+    :param float speed: The speed limit of each road in m/s
+    :param str name: The name the generated files are given
+    :return: The generated network
+    """
+    return generate_grid_network(output_dir, 1, intersections, length, lanes, speed, name)
+
+
+def _get_routes(net: sumolib.net.Net) -> Dict[str, List[str]]:
+    fringe = [node for node in net.getNodes() if node.getType() == "dead_end"]
+    routes = {}
+    for origin in fringe:
+        for destination in fringe:
+            if origin is destination:
+                continue
+            path, _ = net.getShortestPath(origin.getOutgoing()[0], destination.getIncoming()[0])
+            routes[f"{origin.getID()}_{destination.getID()}"] = [edge.getID() for edge in path]
+    return routes
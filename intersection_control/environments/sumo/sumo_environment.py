@@ -1,10 +1,13 @@
 from __future__ import annotations
+import itertools
 import sys
 import os
-import random
-from typing import List, Optional
+import shutil
+import tempfile
+from dataclasses import dataclass
+from typing import List, Optional, Dict, Any, Iterable, FrozenSet
 
-from .utils import DemandGenerator, ControlType
+from .utils import DemandGenerator, ControlType, NewVehicleParams
 
 if 'SUMO_HOME' in os.environ:
     tools = os.path.join(os.environ['SUMO_HOME'], 'tools')
@@ -15,57 +18,129 @@ import sumolib
 import traci
 import traci.constants as tc
 from intersection_control.core import Environment
-from intersection_control.core.environment import VehicleHandler, IntersectionHandler
+from intersection_control.core.environment import VehicleHandler, IntersectionHandler, StepEvents
+from .network_cache import NetworkData, load_network_data, get_input_files
 from .sumo_intersection_handler import SumoIntersectionHandler
 from .sumo_vehicle_handler import SumoVehicleHandler
 
+# A radius large enough for a context subscription to cover the whole network
+NETWORK_RADIUS = 100_000_000
+# The vehicle variables subscribed to across the whole network when a subscription radius is given (of those needed
+# by the getters used) - enough to tell where every vehicle is, and whether it is approaching an intersection
+BASIC_VARIABLES = [tc.VAR_POSITION, tc.VAR_ROAD_ID, tc.VAR_LANE_ID]
+# The vehicle type each ControlType's vehicles are added with. These are defined in an additional file written by the
+# environment, so that a vehicle's colour and lane change behaviour do not need to be set after it is added
+VEHICLE_TYPES = {
+    ControlType.MANUAL: "manual",
+    ControlType.WITH_SAFETY_PRECAUTIONS: "with_safety_precautions"
+}
+
+
+@dataclass
+class SumoSnapshot:
+    """A saved state of a :class:`SumoEnvironment`, as returned by :func:`SumoEnvironment.snapshot`
+
+    :ivar str state_file: The SUMO state file the simulation state was saved to
+    :ivar Dict[str, Dict[int, Any]] vehicle_settings: The TraCI settings (speed mode, desired speed, etc.)
+        of each vehicle at the time of the snapshot, which SUMO does not include in its state files
+    """
+    state_file: str
+    vehicle_settings: Dict[str, Dict[int, Any]]
+
 
 class SumoEnvironment(Environment):
+    # Used to give each environment's TraCI connection a unique label
+    _labels = itertools.count()
+
     def __init__(self, net_config_file: str, demand_generator: Optional[DemandGenerator] = None,
-                 time_step: float = 0.05, gui: bool = True, warnings=True):
-        net_file = os.path.join(os.path.dirname(net_config_file),
-                                next(sumolib.xml.parse_fast(net_config_file, "net-file", "value")).value)
-        route_file = os.path.join(os.path.dirname(net_config_file),
-                                  next(sumolib.xml.parse_fast(net_config_file, "route-files", "value")).value)
-        self.net = sumolib.net.readNet(net_file, withInternal=True)
-        self.routes = {route.id: route.edges.split() for route in
-                       sumolib.xml.parse_fast(route_file, 'route', ['id', 'edges'])}
+                 time_step: float = 0.05, gui: bool = True, warnings=True, debug=False,
+                 subscription_radius: Optional[float] = None, vehicle_getters: Optional[Iterable[str]] = None,
+                 controlled_intersections: Optional[Iterable[str]] = None, cache_dir: Optional[str] = None,
+                 demand_file: Optional[str] = None):
+        # Directory the data derived from each network is cached in - see load_network_data
+        self.cache_dir = cache_dir
+        self._load_network(net_config_file)
         self.demand_generator = demand_generator
+        self._load_demand_file(demand_file)
+        self.time_step = time_step
+        self.debug = debug
+        # Radius around each intersection within which every variable of every vehicle is subscribed to. Vehicles
+        # further away only have the few variables in BASIC_VARIABLES subscribed to, and anything else is fetched on
+        # demand. This should be at least the communication range of the messaging units used, so that everything
+        # the algorithms query each step is covered. None subscribes to every variable of every vehicle
+        self.subscription_radius = subscription_radius
+        # The names of the VehicleHandler getters that will be used - only the variables they need are subscribed to.
+        # See vehicle_getters_used_by. None subscribes to the variables needed by every getter
+        self.vehicle_getters = vehicle_getters
 
         # this script has been called from the command line. It will start sumo as a
         # server, then connect and run
         sumo_binary = sumolib.checkBinary('sumo-gui') if gui else sumolib.checkBinary('sumo')
-        # this is the normal way of using traci. sumo is started as a
-        # subprocess and then the python script connects and runs
-        sumo_cmd = [
-            sumo_binary,
-            "-c", net_config_file,
+        # The options SUMO is started with (other than the configuration file), kept so that they can be passed
+        # again when the simulation is reloaded
+        self.sumo_options = [
             "--step-length", str(time_step),
             "--collision.check-junctions",
             "--default.speeddev", "0",
             "--collision.action", "warn",
+            "--save-state.precision", "8",  # So that snapshots restore vehicles exactly where they were
+            "--save-state.rng",
             "--no-step-log"
         ]
         if not warnings:
-            sumo_cmd.append("--no-warnings")
-        traci.start(sumo_cmd)
-        self.subscription_junction_id = traci.junction.getIDList()[0]
-        traci.junction.subscribeContext(self.subscription_junction_id, tc.CMD_GET_VEHICLE_VARIABLE, 100_000_000,
-                                        [tc.VAR_SPEED, tc.VAR_POSITION, tc.VAR_ROAD_ID, tc.VAR_LANE_ID, tc.VAR_LENGTH,
-                                         tc.VAR_WIDTH, tc.VAR_ROUTE_ID, tc.VAR_LANEPOSITION, tc.VAR_ANGLE,
-                                         tc.VAR_ALLOWED_SPEED, tc.VAR_ACCELERATION, tc.VAR_ACCEL, tc.VAR_DECEL])
-        traci.simulation.subscribe([tc.VAR_TIME, tc.VAR_ARRIVED_VEHICLES_IDS, tc.VAR_DEPARTED_VEHICLES_IDS,
-                                    tc.VAR_COLLIDING_VEHICLES_IDS])
-        traci.simulationStep()  # Perform a single step so all vehicles are loaded into the network.
-        traci.junction.getContextSubscriptionResults(self.subscription_junction_id)
-        self.subscription_results = traci.simulation.getSubscriptionResults()
-
-        self._intersections = SumoIntersectionHandler(self.net, self.routes)
-        self._vehicles = SumoVehicleHandler(self.net)
+            self.sumo_options.append("--no-warnings")
+        self._vehicle_types_file = self._write_vehicle_types_file()
+        # Each environment talks to its own SUMO instance through its own labelled connection, rather than the
+        # module-level default one, so that several environments can be used side by side in the same process
+        self.label = f"sumo-{next(SumoEnvironment._labels)}"
+        # this is the normal way of using traci. sumo is started as a
+        # subprocess and then the python script connects and runs
+        traci.start([sumo_binary, *self._get_sumo_args()], label=self.label)
+        self.connection = traci.getConnection(self.label)
+        self._start_simulation(controlled_intersections)
 
-    @staticmethod
-    def close():
-        traci.close(False)
+        # Directory holding the state files of any snapshots taken, created on the first snapshot
+        self._snapshot_dir: Optional[str] = None
+        self._snapshot_count = 0
+
+    def reload(self, demand_generator: Optional[DemandGenerator] = None, net_config_file: Optional[str] = None,
+               controlled_intersections: Optional[Iterable[str]] = None, demand_file: Optional[str] = None):
+        """Restarts the simulation from the beginning, reusing the SUMO instance already running
+
+        This leaves the environment as if it had just been constructed with the given
+        arguments (and the same options as before), but avoids the cost of starting a new
+        SUMO process - so a series of runs can share a single environment.
+
+        :param Optional[DemandGenerator] demand_generator: The demand generator to use from now on
+        :param Optional[str] net_config_file: The SUMO configuration file to load. Defaults to
+            the one currently loaded
+        :param Optional[Iterable[str]] controlled_intersections: The junctions to treat as
+            intersections, as in the constructor
+        :param Optional[str] demand_file: The route file of pre-sampled vehicles to use from now
+            on, as in the constructor
+        """
+        if net_config_file is not None and net_config_file != self.net_config_file:
+            self._load_network(net_config_file)
+        self.demand_generator = demand_generator
+        self._load_demand_file(demand_file)
+        self.connection.load(self._get_sumo_args())
+        self._start_simulation(controlled_intersections)
+
+    def close(self):
+        self.connection.close(False)
+        os.remove(self._vehicle_types_file)
+        if self._snapshot_dir is not None:
+            shutil.rmtree(self._snapshot_dir, ignore_errors=True)
+            self._snapshot_dir = None
+
+    @property
+    def net(self) -> sumolib.net.Net:
+        """The parsed SUMO network - only parsed the first time it is accessed, as the environment itself
+        only needs :attr:`network`
+        """
+        if self._net is None:
+            self._net = sumolib.net.readNet(self.net_file, withInternal=True)
+        return self._net
 
     @property
     def intersections(self) -> IntersectionHandler:
@@ -78,32 +153,211 @@ class SumoEnvironment(Environment):
     def get_current_time(self) -> float:
         return self.subscription_results[tc.VAR_TIME]
 
-    def step(self):
+    def step(self) -> StepEvents:
         if self.demand_generator is not None:
-            for v in self.demand_generator.step():
-                lanes_for_route = [ln.getIndex() for ln in self.net.getEdge(self.routes[v.route_id][0]).getLanes() if
-                                   self.routes[v.route_id][1] in [conn.getTo().getID() for conn in ln.getOutgoing()]]
-                traci.vehicle.add(v.veh_id, v.route_id, departLane=random.choice(lanes_for_route),
-                                  departSpeed=v.depart_speed, departPos=v.depart_pos)
-                traci.vehicle.setColor(v.veh_id, [255, 255, 255, 255])
-                if v.control_type == ControlType.MANUAL:
-                    traci.vehicle.setSpeedMode(v.veh_id, 0b100110)
-                    traci.vehicle.setSpeed(v.veh_id, v.depart_speed)  # The vehicle won't accelerate to the road's limit
-                traci.vehicle.setLaneChangeMode(v.veh_id, 0b010000000101)
-        traci.simulationStep()
-        self.vehicles.subscription_results = traci.junction.getContextSubscriptionResults(self.subscription_junction_id)
-        self.subscription_results = traci.simulation.getSubscriptionResults()
-
-    def get_removed_vehicles(self) -> List[str]:
-        return list(set(self.subscription_results[tc.VAR_ARRIVED_VEHICLES_IDS]
-                        + self.subscription_results[tc.VAR_COLLIDING_VEHICLES_IDS]))
-
-    def get_added_vehicles(self) -> List[str]:
-        return self.subscription_results[tc.VAR_DEPARTED_VEHICLES_IDS]
+            self._add_vehicles(self.demand_generator.step())
+        self.connection.simulationStep()
+        self._set_subscription_results(self.connection.simulation.getSubscriptionResults())
+        self._update_vehicle_subscription_results()
+        self._vehicles.forget_vehicles(self.subscription_results[tc.VAR_ARRIVED_VEHICLES_IDS])
+        self._control_manual_vehicles(self.step_events.added)
+        return self.step_events
+
+    def step_until(self, time: float, stop_on_added: bool = False) -> StepEvents:
+        steps = round((time - self.get_current_time()) / self.time_step)
+        if steps <= 1:
+            return self.step()
+        # SUMO only reports the vehicles that departed, arrived, collided and teleported on the last step it performed,
+        # so it is advanced a step at a time, and the events of every step are combined. This still skips everything
+        # the algorithms and the vehicle handler would otherwise do on each step
+        events = {tc.VAR_DEPARTED_VEHICLES_IDS: set(), tc.VAR_ARRIVED_VEHICLES_IDS: set(),
+                  tc.VAR_COLLIDING_VEHICLES_IDS: set(), tc.VAR_TELEPORT_STARTING_VEHICLES_IDS: set()}
+        for _ in range(steps):
+            if self.demand_generator is not None:
+                self._add_vehicles(self.demand_generator.step())
+            self.connection.simulationStep()
+            results = self.connection.simulation.getSubscriptionResults()
+            for variable, vehicle_ids in events.items():
+                vehicle_ids.update(results[variable])
+            self._control_manual_vehicles(results[tc.VAR_DEPARTED_VEHICLES_IDS])
+            if stop_on_added and results[tc.VAR_DEPARTED_VEHICLES_IDS]:
+                break
+        self._update_vehicle_subscription_results()
+        self._set_subscription_results({**results, **{variable: tuple(vehicle_ids)
+                                                      for variable, vehicle_ids in events.items()}})
+        self._vehicles.forget_vehicles(events[tc.VAR_ARRIVED_VEHICLES_IDS])
+        return self.step_events
+
+    def _add_vehicles(self, new_vehicles: List[NewVehicleParams]):
+        for v in new_vehicles:
+            # The vehicle's type sets its colour and lane change behaviour, so that (unless it is manually controlled)
+            # adding it takes a single TraCI call
+            self.connection.vehicle.add(v.veh_id, v.route_id, typeID=VEHICLE_TYPES[v.control_type],
+                                        departLane=self.demand_generator.choose_departure_lane(
+                                            v, self.departure_lanes[v.route_id]),
+                                        departSpeed=v.depart_speed, departPos=v.depart_pos)
+            if v.control_type == ControlType.MANUAL:
+                self._vehicles.set_control_mode(v.veh_id, ControlType.MANUAL)
+                # The vehicle won't accelerate to the road's limit
+                self._vehicles.set_desired_speed(v.veh_id, v.depart_speed)
+
+    def snapshot(self) -> SumoSnapshot:
+        if self._snapshot_dir is None:
+            self._snapshot_dir = tempfile.mkdtemp(prefix="sumo-snapshots-")
+        # The binary state format is the quickest for SUMO to write and read back
+        state_file = os.path.join(self._snapshot_dir, f"{self._snapshot_count}.sbx")
+        self._snapshot_count += 1
+        self.connection.simulation.saveState(state_file)
+        return SumoSnapshot(state_file, {vehicle_id: settings.copy() for vehicle_id, settings in
+                                         self._vehicles.vehicle_settings.items()})
+
+    def restore(self, snapshot: SumoSnapshot):
+        self.connection.simulation.loadState(snapshot.state_file)
+        self._subscribe()  # Loading a state drops all subscriptions
+        # Subscribing returns the current results straight away, but merges them into the previous ones, so any
+        # vehicles that are not part of the restored state need to be dropped
+        vehicle_ids = set(self.connection.vehicle.getIDList())
+        self._vehicles.subscription_results = {
+            vehicle_id: results for vehicle_id, results in self._get_vehicle_subscription_results().items()
+            if vehicle_id in vehicle_ids
+        }
+        self._set_subscription_results({**self.connection.simulation.getSubscriptionResults(),
+                                        tc.VAR_ARRIVED_VEHICLES_IDS: (), tc.VAR_DEPARTED_VEHICLES_IDS: (),
+                                        tc.VAR_COLLIDING_VEHICLES_IDS: (), tc.VAR_TELEPORT_STARTING_VEHICLES_IDS: ()})
+        self._vehicles.restore_settings({vehicle_id: settings for vehicle_id, settings in
+                                         snapshot.vehicle_settings.items() if vehicle_id in vehicle_ids})
+        self._intersections.invalidate_traffic_light_states()
+        if self.debug:
+            self._vehicles.check_subscription_consistency()
+
+    def _control_manual_vehicles(self, vehicle_ids: Iterable[str]):
+        # Vehicles in the demand file are inserted by SUMO itself, so manually controlled ones can only be put under
+        # manual control once they have departed
+        for vehicle_id in vehicle_ids:
+            depart_speed = self._manual_vehicles.get(vehicle_id)
+            if depart_speed is not None:
+                self._vehicles.set_control_mode(vehicle_id, ControlType.MANUAL)
+                self._vehicles.set_desired_speed(vehicle_id, depart_speed)
+
+    def _load_demand_file(self, demand_file: Optional[str]):
+        # A route file of pre-sampled vehicles (see compile_demand), which SUMO inserts without any TraCI calls. This
+        # is loaded alongside the route files in the configuration, and any demand generator
+        self.demand_file = demand_file
+        # Dictionary mapping the manually controlled vehicles in the demand file to their departure speeds
+        self._manual_vehicles: Dict[str, float] = {
+            vehicle.id: float(vehicle.getAttributeSecure("departSpeed", 0)) for vehicle in
+            sumolib.xml.parse(demand_file, "vehicle")
+            if vehicle.getAttributeSecure("type") == VEHICLE_TYPES[ControlType.MANUAL]
+        } if demand_file is not None else {}
+
+    def _get_sumo_args(self) -> List[str]:
+        # Giving input files on the command line replaces any listed in the configuration, so those are included
+        args = ["-c", self.net_config_file, *self.sumo_options, "--additional-files",
+                ",".join([*get_input_files(self.net_config_file, "additional-files"), self._vehicle_types_file])]
+        if self.demand_file is not None:
+            args += ["--route-files",
+                     ",".join([*get_input_files(self.net_config_file, "route-files"), self.demand_file])]
+        return args
+
+    @staticmethod
+    def _write_vehicle_types_file() -> str:
+        # Speed gain and keep right lane changes are disabled - as SUMO's lane change mode 0b010000000101 would
+        with tempfile.NamedTemporaryFile("w", prefix="sumo-vehicle-types-", suffix=".add.xml", delete=False) as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n\n<additional>\n')
+            for type_id in VEHICLE_TYPES.values():
+                f.write(f'    <vType id="{type_id}" color="white" lcSpeedGain="0" lcKeepRight="0"/>\n')
+            f.write('</additional>\n')
+        return f.name
+
+    def _load_network(self, net_config_file: str):
+        self.net_config_file = net_config_file
+        self.net_file = get_input_files(net_config_file, "net-file")[0]
+        route_file = get_input_files(net_config_file, "route-files")[0]
+        # Everything derived from the network and route files. If a cache directory is given, this is loaded from
+        # there rather than parsing the network again, whenever the files have not changed since they were last loaded
+        self.network: NetworkData = load_network_data(self.net_file, route_file, self.cache_dir)
+        self.routes = self.network.routes
+        self._net: Optional[sumolib.net.Net] = None
+        # Dictionary mapping routes to the indices of the lanes a vehicle on that route can depart from
+        self.departure_lanes = self.network.departure_lanes
+        # Any edge will do as the centre of the network-wide subscription, since its radius covers the whole network
+        self.subscription_edge_id = self.network.edge_ids[0]
+
+    def _start_simulation(self, controlled_intersections: Optional[Iterable[str]]):
+        # The junctions treated as intersections - every traffic light controlled junction if None. On large networks,
+        # restricting this to the junctions a scenario actually controls saves building anything for the others
+        self.controlled_intersections = list(controlled_intersections) if controlled_intersections is not None \
+            else None
+        self._intersections = SumoIntersectionHandler(self.network, self.connection, self.controlled_intersections)
+        self._vehicles = SumoVehicleHandler(self.network, self.connection, self.controlled_intersections)
+        # A context subscription needs at least one variable, as subscribing to none unsubscribes
+        self.subscription_variables = self._vehicles.get_subscription_variables(self.vehicle_getters) \
+            or [tc.VAR_ROAD_ID]
+        self.basic_subscription_variables = [variable for variable in self.subscription_variables
+                                             if variable in BASIC_VARIABLES] or self.subscription_variables[:1]
+        self._vehicles.subscribed_variables = set(self.subscription_variables)
+
+        self._subscribe()
+        self.connection.simulationStep()  # Perform a single step so all vehicles are loaded into the network.
+        self._set_subscription_results(self.connection.simulation.getSubscriptionResults())
+        self._update_vehicle_subscription_results()
+        self._control_manual_vehicles(self.step_events.added)
+
+    def _subscribe(self):
+        if self.subscription_radius is None:
+            self.connection.edge.subscribeContext(self.subscription_edge_id, tc.CMD_GET_VEHICLE_VARIABLE,
+                                                  NETWORK_RADIUS, self.subscription_variables)
+        else:
+            self.connection.edge.subscribeContext(self.subscription_edge_id, tc.CMD_GET_VEHICLE_VARIABLE,
+                                                  NETWORK_RADIUS, self.basic_subscription_variables)
+            for intersection_id in self._intersections.get_ids():
+                self.connection.junction.subscribeContext(intersection_id, tc.CMD_GET_VEHICLE_VARIABLE,
+                                                          self.subscription_radius, self.subscription_variables)
+        self.connection.simulation.subscribe([tc.VAR_TIME, tc.VAR_ARRIVED_VEHICLES_IDS, tc.VAR_DEPARTED_VEHICLES_IDS,
+                                              tc.VAR_COLLIDING_VEHICLES_IDS, tc.VAR_TELEPORT_STARTING_VEHICLES_IDS])
+
+    def _get_vehicle_subscription_results(self) -> Dict[str, Dict[int, Any]]:
+        results = self.connection.edge.getContextSubscriptionResults(self.subscription_edge_id)
+        if self.subscription_radius is None:
+            return results
+        nearby_results = {}
+        for intersection_id in self._intersections.get_ids():
+            nearby_results.update(self.connection.junction.getContextSubscriptionResults(intersection_id))
+        # The network-wide subscription decides which vehicles exist - the full results replace the basic ones of
+        # any vehicles near an intersection
+        return {vehicle_id: nearby_results.get(vehicle_id, basic_results)
+                for vehicle_id, basic_results in results.items()}
+
+    def _update_vehicle_subscription_results(self):
+        self._vehicles.subscription_results = self._get_vehicle_subscription_results()
+        if self.debug:
+            self._vehicles.check_subscription_consistency()
+
+    def _set_subscription_results(self, results: Dict[int, Any]):
+        self.subscription_results = results
+        # The events are built once per step, however many times they are asked for
+        collided = frozenset(results[tc.VAR_COLLIDING_VEHICLES_IDS])
+        self.step_events = StepEvents(frozenset(results[tc.VAR_DEPARTED_VEHICLES_IDS]),
+                                      frozenset(results[tc.VAR_ARRIVED_VEHICLES_IDS]) | collided, collided,
+                                      frozenset(results[tc.VAR_TELEPORT_STARTING_VEHICLES_IDS]))
+
+    def get_step_events(self) -> StepEvents:
+        return self.step_events
+
+    def get_removed_vehicles(self) -> FrozenSet[str]:
+        return self.step_events.removed
+
+    def get_added_vehicles(self) -> FrozenSet[str]:
+        return self.step_events.added
 
     def clear(self):
-        for v in traci.vehicle.getIDList():
-            traci.vehicle.remove(v)
-        traci.simulation.clearPending()
+        for v in self.vehicles.get_ids():
+            self.connection.vehicle.remove(v)
+        self.connection.simulation.clearPending()
+        self._vehicles.forget_vehicles(list(self._vehicles.vehicle_settings))
         for _ in range(10):
-            traci.simulationStep()  # Sometimes takes a few tries to flush them out
+            self.connection.simulationStep()  # Sometimes takes a few tries to flush them out
+            self._set_subscription_results(self.connection.simulation.getSubscriptionResults())
+            self._update_vehicle_subscription_results()
+            if len(self._vehicles.subscription_results) == 0:
+                break
@@ -1,8 +1,8 @@
-from typing import Dict, List, Tuple, Optional, Set
+from typing import Dict, List, Tuple, Set, FrozenSet, Optional, Iterable
 import numpy as np
 import traci
-import sumolib
 from intersection_control.core.environment import IntersectionHandler, Trajectory
+from .network_cache import NetworkData
 
 
 class PointBasedTrajectory(Trajectory):
@@ -53,57 +53,111 @@ class PointBasedTrajectory(Trajectory):
 
 
 class SumoIntersectionHandler(IntersectionHandler):
-    def __init__(self, net: sumolib.net.Net, routes: Dict[str, List[str]]):
-        self.net = net
-        self.routes = routes
+    def __init__(self, network: NetworkData, connection: traci.connection.Connection,
+                 intersection_ids: Optional[Iterable[str]] = None):
+        self.network = network
+        # The TraCI connection to the SUMO instance owned by this handler's environment
+        self.connection = connection
+        self.routes = network.routes
+        # Dictionary mapping routes to the internal lanes they pass through, and the reverse index mapping internal
+        # lanes to the routes passing through them
+        self.internal_lanes_on_route = network.internal_lanes_on_route
+        self.routes_through_internal_lane = self._get_routes_through_internal_lanes()
+        # The intersections controlled in this environment - every traffic light controlled node by default
+        self._ids = list(intersection_ids) if intersection_ids is not None else list(network.traffic_lights)
         # TODO: The notion of a trajectory here is capturing two things: routes through the intersection (does the car
         #  want to go left, straight or right?), and also the actual path the vehicle might follow through the
         #  the intersection - but these are actually two distinct things that need to be captured separately:
         #  what are the directions I can go - and if I say I am going one of those directions, how many ways (what are
         #  the trajectories I can follow) to do this? The reason this works here is because this is a single lane
         #  intersection. This would not extend to a multi-lane intersection so this needs to change!
-        self.trajectories: Dict[str, Dict[str, Trajectory]] = {
-            intersection.getID():
-                {
-                    f"{self._get_route_through_edge(edge.getID())}-{edge.getIncoming()[0].getID()}":
-                        PointBasedTrajectory(edge.getSpeed(), [np.array(point) for point in edge.getShape()])
-                    for edge in [self.net.getLane(laneId) for laneId in intersection.getInternal()]
-                }
-            for intersection in self.net.getNodes() if intersection.getType() == "traffic_light"
-        }
-        # Can assume the junctions will not move or change shape, so can do this to reduce the number of traci calls
-        self._positions = {i_id: traci.junction.getPosition(i_id) for i_id in self.get_ids()}
-        self._shapes = {i_id: traci.junction.getShape(i_id) for i_id in self.get_ids()}
+        # Dictionary mapping intersections to their trajectories, built the first time each intersection's trajectories
+        # are needed - on large networks, most intersections may never be approached
+        self.trajectories: Dict[str, Dict[str, Trajectory]] = {}
+        # Junctions will not move or change shape, so their positions and shapes are only looked up once, when they
+        # are first needed, to reduce the number of traci calls
+        self._positions: Dict[str, Tuple[float, float]] = {}
+        self._shapes: Dict[str, List[Tuple[float, float]]] = {}
+        # The links controlled by each traffic light are also static, so the routes through each link (in link index
+        # order) are looked up once, on the first phase change, rather than on every one
+        self._link_routes: Dict[str, List[List[str]]] = {}
+        # Memoised RedYellowGreen state strings for each (intersection, green, yellow, red) phase
+        self._phase_states: Dict[Tuple[str, FrozenSet[str], FrozenSet[str], FrozenSet[str]], str] = {}
+        self._current_states: Dict[str, str] = {}
 
     def get_ids(self) -> List[str]:
-        return [node.getID() for node in self.net.getNodes() if node.getType() == "traffic_light"]
+        return list(self._ids)
 
     def get_width(self, intersection_id: str) -> float:
-        shape = self._shapes[intersection_id]
+        shape = self._get_shape(intersection_id)
         xs = [x for (x, _) in shape]
         return max(xs) - min(xs)
 
     def get_height(self, intersection_id: str) -> float:
-        shape = self._shapes[intersection_id]
+        shape = self._get_shape(intersection_id)
         ys = [y for (y, _) in shape]
         return max(ys) - min(ys)
 
     def get_position(self, intersection_id: str) -> Tuple[float, float]:
-        return self._positions[intersection_id]
+        position = self._positions.get(intersection_id)
+        if position is None:
+            position = self._positions[intersection_id] = self.connection.junction.getPosition(intersection_id)
+        return position
 
     def get_trajectories(self, intersection_id: str) -> Dict[str, Trajectory]:
-        return self.trajectories[intersection_id]
+        trajectories = self.trajectories.get(intersection_id)
+        if trajectories is None:
+            trajectories = self.trajectories[intersection_id] = self._get_trajectories(intersection_id)
+        return trajectories
 
     def set_traffic_light_phase(self, intersection_id: str, phases: Tuple[Set[str], Set[str], Set[str]]):
         (g, y, r) = phases
-        links = [self._get_route_through_edge(link) for [(_, _, link)] in
-                 traci.trafficlight.getControlledLinks(intersection_id)]
-        phase = ["r" if link in r else "y" if link in y else "g" for link in links]
-        traci.trafficlight.setRedYellowGreenState(intersection_id, "".join(phase))
-
-    def _get_route_through_edge(self, edge) -> Optional[str]:
-        for route, edges in self.routes.items():
-            inner_connections = self.net.getEdge(edges[0]).getConnections(self.net.getEdge(edges[1]))
-            if edge in {self.net.getLane(ic.getViaLaneID()).getID() for ic in inner_connections}:
-                return route
-        return None
+        # frozenset() returns its argument unchanged if it is already a frozenset, so precompiled phases are cheap
+        key = (intersection_id, frozenset(g), frozenset(y), frozenset(r))
+        state = self._phase_states.get(key)
+        if state is None:
+            state = self._phase_states[key] = self._compile_phase(intersection_id, key[2], key[3])
+        if self._current_states.get(intersection_id) != state:
+            self.connection.trafficlight.setRedYellowGreenState(intersection_id, state)
+            self._current_states[intersection_id] = state
+
+    def invalidate_traffic_light_states(self):
+        """Forgets the state last set at each traffic light, so that the next call to
+        :func:`set_traffic_light_phase` is always sent to SUMO - e.g. after a saved state has been loaded
+        """
+        self._current_states.clear()
+
+    def _compile_phase(self, intersection_id: str, y: FrozenSet[str], r: FrozenSet[str]) -> str:
+        link_routes = self._link_routes.get(intersection_id)
+        if link_routes is None:
+            link_routes = self._link_routes[intersection_id] = [
+                self.routes_through_internal_lane.get(link, []) for [(_, _, link)] in
+                self.connection.trafficlight.getControlledLinks(intersection_id)]
+        # Several routes can share a link (as on larger networks), in which case it shows the most restrictive of
+        # their states
+        return "".join(["r" if any(route in r for route in routes) else "y" if any(route in y for route in routes)
+                        else "g" for routes in link_routes])
+
+    def _get_shape(self, intersection_id: str) -> List[Tuple[float, float]]:
+        shape = self._shapes.get(intersection_id)
+        if shape is None:
+            shape = self._shapes[intersection_id] = self.connection.junction.getShape(intersection_id)
+        return shape
+
+    def _get_routes_through_internal_lanes(self) -> Dict[str, List[str]]:
+        result = {}
+        for route, lanes in self.internal_lanes_on_route.items():
+            for lane in lanes:
+                result.setdefault(lane, []).append(route)
+        return result
+
+    def _get_trajectories(self, intersection_id: str) -> Dict[str, Trajectory]:
+        # In networks with several intersections, many routes share each internal lane - so every route passing
+        # through a lane gets its own trajectory ID, all referring to the same trajectory
+        result = {}
+        for lane in self.network.internal_lanes[intersection_id]:
+            incoming_lane, speed_limit, _, _ = self.network.internal_lane_geometry[lane]
+            trajectory = PointBasedTrajectory(speed_limit, [np.array(point) for point in self.network.get_shape(lane)])
+            for route in self.routes_through_internal_lane.get(lane, []):
+                result[f"{route}-{incoming_lane}"] = trajectory
+        return result
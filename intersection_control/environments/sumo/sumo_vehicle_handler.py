@@ -1,15 +1,43 @@
+import logging
 import math
-from typing import List, Dict, Optional, Tuple
-import sumolib
+from typing import List, Dict, Optional, Tuple, Any, Iterable
 import traci
 import traci.constants as tc
 from intersection_control.core.environment import VehicleHandler
+from .network_cache import NetworkData
 from .utils import ControlType
 
+logger = logging.getLogger(__name__)
+
 
 class SumoVehicleHandler(VehicleHandler):
-    def __init__(self, net: sumolib.net.Net):
-        self.net = net
+    # The SUMO variables each VehicleHandler getter reads
+    GETTER_VARIABLES = {
+        "approaching": [tc.VAR_ROAD_ID],
+        "departing": [tc.VAR_ROAD_ID],
+        "in_intersection": [tc.VAR_LANE_ID],
+        "get_trajectory": [tc.VAR_ROUTE_ID, tc.VAR_LANE_ID],
+        "get_length": [tc.VAR_LENGTH],
+        "get_width": [tc.VAR_WIDTH],
+        "get_driving_distance": [tc.VAR_LANE_ID, tc.VAR_LANEPOSITION],
+        "get_speed": [tc.VAR_SPEED],
+        "get_position": [tc.VAR_POSITION],
+        "get_direction": [tc.VAR_ANGLE],
+        "get_speed_limit": [tc.VAR_ALLOWED_SPEED],
+        "get_acceleration": [tc.VAR_ACCELERATION],
+        "get_max_acceleration": [tc.VAR_ACCEL],
+        "get_max_deceleration": [tc.VAR_DECEL]
+    }
+
+    def __init__(self, network: NetworkData, connection: traci.connection.Connection,
+                 intersection_ids: Optional[Iterable[str]] = None):
+        self.network = network
+        # The TraCI connection to the SUMO instance owned by this handler's environment
+        self.connection = connection
+
+        # The intersections controlled in this environment - every traffic light controlled node by default. Only
+        # lanes leading into, out of, or through these are mapped to intersections below
+        self.intersections = list(intersection_ids) if intersection_ids is not None else network.traffic_lights
 
         # Dictionary mapping roads to the intersections that they enter
         self.intersection_entered_by_lane = self._get_intersections_entered_by_lanes()
@@ -20,86 +48,185 @@ class SumoVehicleHandler(VehicleHandler):
         # Dictionary mapping lanes to the intersection they are inside of
         self.intersection_containing_lane = self._get_intersections_containing_lanes()
 
-        self.subscription_results = None
+        # Dictionary mapping lanes (including internal lanes) to their length
+        self.lane_lengths: Dict[str, float] = network.lane_lengths
+
+        # Dictionary mapping (route, lane) pairs to interned trajectory ids, filled in as vehicles reach each lane
+        self.trajectory_ids: Dict[Tuple[str, str], str] = {}
+
+        # Per-step vehicle variables, as returned by the environment's context subscriptions. Every vehicle in the
+        # network is included, but vehicles far from any intersection may only have a few basic variables - any
+        # others are fetched on demand using the getters below
+        self.subscription_results: Dict[str, Dict[int, Any]] = {}
+        self._getters = {
+            tc.VAR_SPEED: connection.vehicle.getSpeed,
+            tc.VAR_POSITION: connection.vehicle.getPosition,
+            tc.VAR_ROAD_ID: connection.vehicle.getRoadID,
+            tc.VAR_LANE_ID: connection.vehicle.getLaneID,
+            tc.VAR_LENGTH: connection.vehicle.getLength,
+            tc.VAR_WIDTH: connection.vehicle.getWidth,
+            tc.VAR_ROUTE_ID: connection.vehicle.getRouteID,
+            tc.VAR_LANEPOSITION: connection.vehicle.getLanePosition,
+            tc.VAR_ANGLE: connection.vehicle.getAngle,
+            tc.VAR_ALLOWED_SPEED: connection.vehicle.getAllowedSpeed,
+            tc.VAR_ACCELERATION: connection.vehicle.getAcceleration,
+            tc.VAR_ACCEL: connection.vehicle.getAccel,
+            tc.VAR_DECEL: connection.vehicle.getDecel
+        }
+        # The variables the environment subscribes to for vehicles near an intersection. Fetching any other
+        # variable on demand means a getter is being used that was not declared to the environment
+        self.subscribed_variables = set(self._getters)
+        self._warned_variables = set()
+
+        # TraCI settings applied to each vehicle, keyed by the variable they set. SUMO does not include these in its
+        # saved states, so they are recorded here in order to be re-applied when a snapshot is restored
+        self.vehicle_settings: Dict[str, Dict[int, Any]] = {}
+        self._setters = {
+            tc.VAR_SPEEDSETMODE: self.connection.vehicle.setSpeedMode,
+            tc.VAR_SPEED: self.connection.vehicle.setSpeed,
+            tc.VAR_LANECHANGE_MODE: self.connection.vehicle.setLaneChangeMode
+        }
 
     def approaching(self, vehicle_id: str) -> Optional[str]:
-        return self.intersection_entered_by_lane.get(self.subscription_results[vehicle_id][tc.VAR_ROAD_ID])
+        return self.intersection_entered_by_lane.get(self._get(vehicle_id, tc.VAR_ROAD_ID))
 
     def departing(self, vehicle_id: str) -> Optional[str]:
-        return self.intersection_exited_by_lane.get(self.subscription_results[vehicle_id][tc.VAR_ROAD_ID])
+        return self.intersection_exited_by_lane.get(self._get(vehicle_id, tc.VAR_ROAD_ID))
 
     def in_intersection(self, vehicle_id: str) -> Optional[str]:
-        return self.intersection_containing_lane.get(self.subscription_results[vehicle_id][tc.VAR_LANE_ID])
+        return self.intersection_containing_lane.get(self._get(vehicle_id, tc.VAR_LANE_ID))
 
     def get_ids(self) -> List[str]:
-        return traci.vehicle.getIDList()
+        return list(self.subscription_results)
 
     def get_trajectory(self, vehicle_id: str) -> str:
-        return f"{self.subscription_results[vehicle_id][tc.VAR_ROUTE_ID]}-" \
-               f"{self.subscription_results[vehicle_id][tc.VAR_LANE_ID]}"
+        key = (self._get(vehicle_id, tc.VAR_ROUTE_ID), self._get(vehicle_id, tc.VAR_LANE_ID))
+        trajectory_id = self.trajectory_ids.get(key)
+        if trajectory_id is None:
+            # Interned, so that the same ID is not rebuilt on every call
+            trajectory_id = self.trajectory_ids[key] = f"{key[0]}-{key[1]}"
+        return trajectory_id
 
     def get_length(self, vehicle_id: str) -> float:
-        return self.subscription_results[vehicle_id][tc.VAR_LENGTH]
+        return self._get(vehicle_id, tc.VAR_LENGTH)
 
     def get_width(self, vehicle_id: str) -> float:
-        return self.subscription_results[vehicle_id][tc.VAR_WIDTH]
+        return self._get(vehicle_id, tc.VAR_WIDTH)
 
     def get_driving_distance(self, vehicle_id: str) -> float:
-        return self.net.getLane(self.subscription_results[vehicle_id][tc.VAR_LANE_ID]).getLength() - \
-               self.subscription_results[vehicle_id][tc.VAR_LANEPOSITION]
+        return self.lane_lengths[self._get(vehicle_id, tc.VAR_LANE_ID)] - self._get(vehicle_id, tc.VAR_LANEPOSITION)
 
     def get_speed(self, vehicle_id: str) -> float:
-        return self.subscription_results[vehicle_id][tc.VAR_SPEED]
+        return self._get(vehicle_id, tc.VAR_SPEED)
 
     def get_position(self, vehicle_id) -> Tuple[float, float]:
-        return self.subscription_results[vehicle_id][tc.VAR_POSITION]
+        return self._get(vehicle_id, tc.VAR_POSITION)
 
     def get_direction(self, vehicle_id) -> float:
         # Transform as required
-        return math.pi - (math.radians(self.subscription_results[vehicle_id][tc.VAR_ANGLE]) + math.pi / 2) % (
+        return math.pi - (math.radians(self._get(vehicle_id, tc.VAR_ANGLE)) + math.pi / 2) % (
                 2 * math.pi)
 
     def set_desired_speed(self, vehicle_id: str, to: float):
-        traci.vehicle.setSpeed(vehicle_id, to)
+        self._apply_setting(vehicle_id, tc.VAR_SPEED, to)
 
     def get_speed_limit(self, vehicle_id) -> float:
-        return self.subscription_results[vehicle_id][tc.VAR_ALLOWED_SPEED]
+        return self._get(vehicle_id, tc.VAR_ALLOWED_SPEED)
 
     def get_acceleration(self, vehicle_id: str) -> float:
-        return self.subscription_results[vehicle_id][tc.VAR_ACCELERATION]
+        return self._get(vehicle_id, tc.VAR_ACCELERATION)
 
     def get_max_acceleration(self, vehicle_id: str) -> float:
-        return self.subscription_results[vehicle_id][tc.VAR_ACCEL]
+        return self._get(vehicle_id, tc.VAR_ACCEL)
 
     def get_max_deceleration(self, vehicle_id: str) -> float:
-        return self.subscription_results[vehicle_id][tc.VAR_DECEL]
+        return self._get(vehicle_id, tc.VAR_DECEL)
+
+    def check_subscription_consistency(self):
+        """Checks that the cached subscription results describe exactly the vehicles SUMO
+        reports as being in the network
+
+        Intended for debugging only, as this makes a TraCI round trip.
+
+        :raises AssertionError: If the cached vehicle IDs differ from those reported by SUMO
+        """
+        cached, actual = set(self.subscription_results), set(self.connection.vehicle.getIDList())
+        assert cached == actual, f"Subscription cache is inconsistent with SUMO: missing {actual - cached}, " \
+                                 f"unexpected {cached - actual}"
 
     def _get_intersections_entered_by_lanes(self) -> Dict[str, str]:
-        intersections = [node for node in self.net.getNodes() if node.getType() == "traffic_light"]
         result = {}
-        for intersection in intersections:
-            for edge in [edge for edge in intersection.getIncoming() if edge.getFunction() != "internal"]:
-                result[edge.getID()] = intersection.getID()
+        for intersection in self.intersections:
+            for edge in self.network.incoming_edges[intersection]:
+                result[edge] = intersection
         return result
 
     def _get_intersections_exited_by_lanes(self) -> Dict[str, str]:
-        intersections = [node for node in self.net.getNodes() if node.getType() == "traffic_light"]
         result = {}
-        for intersection in intersections:
-            for edge in [edge for edge in intersection.getOutgoing() if edge.getFunction() != "internal"]:
-                result[edge.getID()] = intersection.getID()
+        for intersection in self.intersections:
+            for edge in self.network.outgoing_edges[intersection]:
+                result[edge] = intersection
         return result
 
     def _get_intersections_containing_lanes(self) -> Dict[str, str]:
-        intersections = [node for node in self.net.getNodes() if node.getType() == "traffic_light"]
         result = {}
-        for intersection in intersections:
-            for lane in intersection.getInternal():
-                result[lane] = intersection.getID()
+        for intersection in self.intersections:
+            for lane in self.network.internal_lanes[intersection]:
+                result[lane] = intersection
         return result
 
     def set_control_mode(self, vehicle_id, control_type: ControlType):
         if control_type == ControlType.MANUAL:
-            traci.vehicle.setSpeedMode(vehicle_id, 0b100110)
+            self._apply_setting(vehicle_id, tc.VAR_SPEEDSETMODE, 0b100110)
         elif control_type == ControlType.WITH_SAFETY_PRECAUTIONS:
-            traci.vehicle.setSpeedMode(vehicle_id, 31)
+            self._apply_setting(vehicle_id, tc.VAR_SPEEDSETMODE, 31)
+
+    def set_lane_change_mode(self, vehicle_id: str, mode: int):
+        self._apply_setting(vehicle_id, tc.VAR_LANECHANGE_MODE, mode)
+
+    def restore_settings(self, vehicle_settings: Dict[str, Dict[int, Any]]):
+        """Re-applies previously recorded TraCI settings, e.g. after a saved state has been loaded
+
+        :param Dict[str, Dict[int, Any]] vehicle_settings: The settings to apply, as recorded in
+            :attr:`vehicle_settings`. These replace any settings currently recorded
+        """
+        self.vehicle_settings = {}
+        for vehicle_id, settings in vehicle_settings.items():
+            for variable, value in settings.items():
+                self._apply_setting(vehicle_id, variable, value)
+
+    def forget_vehicles(self, vehicle_ids: Iterable[str]):
+        """Discards the recorded settings of vehicles that have left the environment
+
+        :param Iterable[str] vehicle_ids: The IDs of the vehicles that have been removed
+        """
+        for vehicle_id in vehicle_ids:
+            self.vehicle_settings.pop(vehicle_id, None)
+
+    def get_subscription_variables(self, getters: Optional[Iterable[str]]) -> List[int]:
+        """Returns the SUMO variables read by the given getters
+
+        :param Optional[Iterable[str]] getters: The names of the getters that will be used,
+            or None if they are unknown
+        :return: The variables to subscribe to - all of them if the getters are unknown
+        """
+        if getters is None:
+            return list(self._getters)
+        return list(dict.fromkeys(variable for getter in getters for variable in self.GETTER_VARIABLES[getter]))
+
+    def _get(self, vehicle_id: str, variable: int) -> Any:
+        results = self.subscription_results[vehicle_id]
+        value = results.get(variable)
+        if value is None:
+            # Not subscribed to for this vehicle - fetch it directly, and keep it for the rest of the step
+            if variable not in self.subscribed_variables and variable not in self._warned_variables:
+                self._warned_variables.add(variable)
+                logger.warning(f"Vehicle variable {variable:#x} is not subscribed to, so is being fetched from SUMO "
+                               f"on demand. Declare every getter used in the VEHICLE_GETTERS of the algorithm's "
+                               f"classes to avoid this")
+            value = results[variable] = self._getters[variable](vehicle_id)
+        return value
+
+    def _apply_setting(self, vehicle_id: str, variable: int, value: Any):
+        self._setters[variable](vehicle_id, value)
+        self.vehicle_settings.setdefault(vehicle_id, {})[variable] = value
@@ -1,9 +1,16 @@
+import bisect
+import csv
+import heapq
+import math
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-import random
-from typing import Union, List, Dict
+from typing import Union, List, Dict, Optional, Sequence, Tuple, Iterator
 
-random.seed(42)
+import numpy as np
+
+
+# The seed demand generators use unless given another
+DEFAULT_SEED = 42
 
 
 class ControlType:
@@ -38,12 +45,15 @@ class NewVehicleParams:
     :ivar float depart_pos: The distance along the trajectory the vehicle should be spawned at
     :ivar ControlType control_type: The level of control the set_desired_speed method will have on
         the given vehicle
+    :ivar Optional[int] depart_lane: The index of the lane the vehicle should be spawned on, or None
+        to let the demand generator choose one of the lanes vehicles on its route can depart from
     """
     veh_id: str
     route_id: str
     depart_speed: Union[float, str] = 0
     depart_pos: float = 0
     control_type: ControlType = ControlType.WITH_SAFETY_PRECAUTIONS
+    depart_lane: Optional[int] = None
 
 
 class DemandGenerator(ABC):
@@ -68,6 +78,27 @@ class DemandGenerator(ABC):
         """
         raise NotImplementedError
 
+    def choose_departure_lane(self, vehicle: NewVehicleParams, lanes: Sequence[int]) -> int:
+        """Method called by :class:`SumoEnvironment` for each vehicle returned by :func:`step`, to
+        choose the lane the vehicle is spawned on
+
+        By default, this is the vehicle's ``depart_lane`` if it has one, and otherwise a lane drawn
+        from the generator's own random number generator (its ``rng`` attribute, which is created
+        with a fixed seed if the generator does not have one) - so the lanes vehicles depart from
+        are reproducible, and do not depend on any other random state in the process.
+
+        :param NewVehicleParams vehicle: The vehicle being spawned
+        :param Sequence[int] lanes: The indices of the lanes vehicles on the vehicle's route can
+            depart from
+        :return: The index of the lane the vehicle should be spawned on
+        """
+        if vehicle.depart_lane is not None:
+            return vehicle.depart_lane
+        rng = getattr(self, "rng", None)
+        if rng is None:
+            rng = self.rng = np.random.default_rng(DEFAULT_SEED)
+        return int(lanes[rng.integers(len(lanes))])
+
 
 class ScenarioGenerator(DemandGenerator):
     """Demand generator that produces vehicles at predefined locations
@@ -101,31 +132,278 @@ class RandomDemandGenerator(DemandGenerator):
 
     Will spawn vehicles with a probability, and on a route, provided to this
     DemandGenerator's constructor.
+
+    Each generator draws from its own random number generator, so runs are reproducible
+    given the seed, whatever else happens in the process. Rather than sampling every route
+    on every step, the gaps between spawns on each route (which are geometrically distributed)
+    are sampled in chunks, and :func:`step` just reads off the resulting schedule.
     """
+    #: The number of time steps the spawns of each route are sampled for at a time
+    CHUNK_STEPS = 10000
 
     def __init__(self, rates: Dict[str, float], time_step_length: float, depart_speed: float = 10,
-                 control_type: ControlType = ControlType.WITH_SAFETY_PRECAUTIONS):
+                 control_type: ControlType = ControlType.WITH_SAFETY_PRECAUTIONS,
+                 seed: Optional[int] = DEFAULT_SEED):
         """Construct a RandomDemandGenerator
 
         :param Dict[str, float] rates: A dictionary mapping route IDs to the
             average vehicles per minute that should be produced on that route
         :param float time_step_length: The length of a single time step in
             the sumo simulation
+        :param Optional[int] seed: The seed of the generator's random number generator. Defaults
+            to a fixed seed, so runs are reproducible. If None, a fresh seed is taken from the
+            operating system
         """
         self.time_step_length = time_step_length
         self.depart_speed = depart_speed
         self.control_type = control_type
+        self.rng = np.random.default_rng(seed)
 
         # convert rates from vehicles per minute to a probability of a spawn event occurring at each time step
         self.spawn_probabilities = {route: rate * self.time_step_length / 60 for route, rate in rates.items()}
         self.current_id = 0
+        self.current_step = 0
+        # Dictionary mapping upcoming steps to the routes a vehicle spawns on in that step, sampled up to (but not
+        # including) the step in schedule_end
+        self.schedule: Dict[int, List[str]] = {}
+        self.schedule_end = 1
+        # The spawns sampled on each route at or after schedule_end, carried over to the next chunk
+        self.pending_spawns = {route: [] for route, prob in self.spawn_probabilities.items() if prob > 0}
 
     def step(self) -> List[NewVehicleParams]:
+        self.current_step += 1
+        if self.current_step >= self.schedule_end:
+            self._extend_schedule()
         return [
             NewVehicleParams(self.get_next_id(), route, depart_speed=self.depart_speed, control_type=self.control_type)
-            for route, prob in self.spawn_probabilities.items() if random.random() <= prob
+            for route in self.schedule.pop(self.current_step, [])
         ]
 
+    def _extend_schedule(self):
+        end = self.schedule_end + self.CHUNK_STEPS
+        for route, spawns in self.pending_spawns.items():
+            while not spawns or spawns[-1] < end:
+                spawns.extend(self._sample_spawns(self.spawn_probabilities[route], spawns[-1] if spawns else 0,
+                                                  int(self.CHUNK_STEPS * self.spawn_probabilities[route]) + 1))
+            scheduled = bisect.bisect_left(spawns, end)
+            for spawn in spawns[:scheduled]:
+                self.schedule.setdefault(spawn, []).append(route)
+            del spawns[:scheduled]
+        self.schedule_end = end
+
+    def _sample_spawns(self, probability: float, after: int, count: int) -> List[int]:
+        # The number of steps between spawns of a Bernoulli process follows a geometric distribution
+        return (after + np.cumsum(self.rng.geometric(min(probability, 1), count))).tolist()
+
+    def get_next_id(self) -> str:
+        result = self.current_id
+        self.current_id += 1
+        return str(result)
+
+
+class RateProfile:
+    """A rate of vehicles per minute that varies over the course of a simulation
+
+    The rate is defined by a sequence of breakpoints, each giving the rate from a particular
+    time onwards. Between breakpoints the rate either holds the value of the previous
+    breakpoint, or is linearly interpolated between the two. Before the first breakpoint it
+    takes the first breakpoint's rate, and after the last it takes the last breakpoint's rate.
+    """
+
+    def __init__(self, breakpoints: Sequence[Tuple[float, float]], interpolate: bool = False):
+        """Construct a RateProfile
+
+        :param Sequence[Tuple[float, float]] breakpoints: The (time in seconds, vehicles per
+            minute) pairs defining the profile, in increasing order of time
+        :param bool interpolate: Whether to linearly interpolate the rate between breakpoints,
+            rather than stepping from one to the next
+        """
+        if not breakpoints:
+            raise ValueError("A rate profile needs at least one breakpoint")
+        self.times = [float(t) for t, _ in breakpoints]
+        self.rates = [float(r) for _, r in breakpoints]
+        if any(t1 >= t2 for t1, t2 in zip(self.times, self.times[1:])):
+            raise ValueError("The breakpoints of a rate profile must be in strictly increasing order of time")
+        if any(r < 0 for r in self.rates):
+            raise ValueError("The rates of a rate profile cannot be negative")
+        self.interpolate = interpolate
+        #: The highest rate reached anywhere in the profile
+        self.max_rate = max(self.rates)
+        #: The time after which the rate stays at that of the last breakpoint
+        self.end = self.times[-1]
+
+    def rate(self, time: float) -> float:
+        """Get the rate at a given time
+
+        :param float time: The time in seconds
+        :return: The rate at the given time, in vehicles per minute
+        """
+        i = bisect.bisect_right(self.times, time)
+        if i == 0:
+            return self.rates[0]
+        if i == len(self.times) or not self.interpolate:
+            return self.rates[i - 1]
+        t1, t2 = self.times[i - 1], self.times[i]
+        r1, r2 = self.rates[i - 1], self.rates[i]
+        return r1 + (r2 - r1) * (time - t1) / (t2 - t1)
+
+
+class ProfileDemandGenerator(DemandGenerator):
+    """Generates vehicles in different routes at rates that vary over time
+
+    The vehicles on each route arrive as a non-homogeneous Poisson process following that
+    route's :class:`RateProfile`. Arrivals are sampled by thinning: candidates are drawn at the
+    profile's highest rate, and each is kept with probability equal to the ratio of the rate at
+    its time to the highest rate. Only the next arrival on each route is sampled ahead of time,
+    and these are kept in a heap ordered by departure time, so :func:`step` only does work for
+    the vehicles that actually depart.
+
+    Several vehicles may depart on the same route in a single step if the rate is high enough.
+    """
+
+    def __init__(self, profiles: Dict[str, Union[RateProfile, Sequence[Tuple[float, float]]]],
+                 time_step_length: float, depart_speed: float = 10,
+                 control_type: ControlType = ControlType.WITH_SAFETY_PRECAUTIONS,
+                 seed: Optional[int] = DEFAULT_SEED):
+        """Construct a ProfileDemandGenerator
+
+        :param Dict[str, Union[RateProfile, Sequence[Tuple[float, float]]]] profiles: A dictionary
+            mapping route IDs to the rate profile of that route - either a :class:`RateProfile`
+            or the breakpoints of a stepped one
+        :param float time_step_length: The length of a single time step in
+            the sumo simulation
+        :param Optional[int] seed: The seed of the generator's random number generator. Defaults
+            to a fixed seed, so runs are reproducible. If None, a fresh seed is taken from the
+            operating system
+        """
+        self.time_step_length = time_step_length
+        self.depart_speed = depart_speed
+        self.control_type = control_type
+        self.rng = np.random.default_rng(seed)
+
+        self.profiles = {route: profile if isinstance(profile, RateProfile) else RateProfile(profile)
+                         for route, profile in profiles.items()}
+        self.current_id = 0
+        self.current_step = 0
+        # Heap of the next arrival on each route, as (arrival time, route) pairs
+        self.arrivals: List[Tuple[float, str]] = []
+        for route in self.profiles:
+            self._schedule_next_arrival(route, 0)
+
+    def step(self) -> List[NewVehicleParams]:
+        self.current_step += 1
+        end = self.current_step * self.time_step_length
+        new_vehicles = []
+        while self.arrivals and self.arrivals[0][0] <= end:
+            time, route = heapq.heappop(self.arrivals)
+            new_vehicles.append(NewVehicleParams(self.get_next_id(), route, depart_speed=self.depart_speed,
+                                                 control_type=self.control_type))
+            self._schedule_next_arrival(route, time)
+        return new_vehicles
+
+    def _schedule_next_arrival(self, route: str, after: float):
+        profile = self.profiles[route]
+        max_rate = profile.max_rate / 60  # In vehicles per second
+        if max_rate == 0:
+            return
+        time = after
+        while True:
+            if time >= profile.end and profile.rates[-1] == 0:
+                return  # No vehicles will ever arrive on this route again
+            time += self.rng.exponential(1 / max_rate)
+            if self.rng.random() * max_rate < profile.rate(time) / 60:
+                heapq.heappush(self.arrivals, (time, route))
+                return
+
+    def get_next_id(self) -> str:
+        result = self.current_id
+        self.current_id += 1
+        return str(result)
+
+
+class TraceDemandGenerator(DemandGenerator):
+    """Replays the vehicle arrivals recorded in a trace file
+
+    The trace is read lazily, a chunk at a time, as the simulation reaches it - so memory use
+    stays flat however long the trace is. Each record gives the time (in seconds from the start
+    of the trace) a number of vehicles arrived making a particular movement, and the vehicles
+    are added in the first step that reaches that time. Records must be in order of time.
+
+    Traces can be either:
+
+    - CSV files with a header row and the columns ``time``, ``movement`` and optionally
+      ``count`` (the number of vehicles, which defaults to 1). Movements are read as strings.
+    - ``.npy`` files holding a numpy structured array with the fields ``time``, ``movement``
+      and optionally ``count``, as saved by :func:`numpy.save`. These are memory-mapped rather
+      than read, and are much faster to replay. Movements are read as integers.
+    """
+    #: The number of records read from a binary trace at a time
+    CHUNK_RECORDS = 65536
+
+    def __init__(self, trace_file: str, routes: Dict[Union[str, int], Optional[str]], time_step_length: float,
+                 depart_speed: float = 10, control_type: ControlType = ControlType.WITH_SAFETY_PRECAUTIONS,
+                 start_time: float = 0):
+        """Construct a TraceDemandGenerator
+
+        :param str trace_file: The path of the trace to replay
+        :param Dict[Union[str, int], Optional[str]] routes: A dictionary mapping each movement in
+            the trace to the ID of the route its vehicles should be spawned on, or to None if
+            the movement's vehicles should be ignored
+        :param float time_step_length: The length of a single time step in
+            the sumo simulation
+        :param float start_time: The time in the trace the simulation should start at - any
+            earlier records are skipped
+        """
+        self.trace_file = trace_file
+        self.routes = routes
+        self.time_step_length = time_step_length
+        self.depart_speed = depart_speed
+        self.control_type = control_type
+        self.start_time = start_time
+
+        self.current_id = 0
+        self.current_step = 0
+        self.records = self._read_binary_trace() if trace_file.endswith(".npy") else self._read_csv_trace()
+        self.last_record_time = -math.inf
+        # The next record in the trace, which has not yet been reached by the simulation
+        self.next_record = self._next_record()
+
+    def step(self) -> List[NewVehicleParams]:
+        self.current_step += 1
+        end = self.start_time + self.current_step * self.time_step_length
+        new_vehicles = []
+        while self.next_record is not None and self.next_record[0] <= end:
+            _, route, count = self.next_record
+            new_vehicles.extend(NewVehicleParams(self.get_next_id(), route, depart_speed=self.depart_speed,
+                                                 control_type=self.control_type) for _ in range(count))
+            self.next_record = self._next_record()
+        return new_vehicles
+
+    def _next_record(self) -> Optional[Tuple[float, str, int]]:
+        for time, movement, count in self.records:
+            if time < self.last_record_time:
+                raise ValueError(f"The records of trace {self.trace_file} are not in order of time")
+            self.last_record_time = time
+            if movement not in self.routes:
+                raise ValueError(f"Movement {movement} of trace {self.trace_file} is not mapped to a route")
+            route = self.routes[movement]
+            if time >= self.start_time and route is not None and count > 0:
+                return time, route, count
+        return None
+
+    def _read_csv_trace(self) -> Iterator[Tuple[float, str, int]]:
+        with open(self.trace_file, newline="") as f:
+            for row in csv.DictReader(f):
+                yield float(row["time"]), row["movement"], int(row.get("count") or 1)
+
+    def _read_binary_trace(self) -> Iterator[Tuple[float, int, int]]:
+        trace = np.load(self.trace_file, mmap_mode="r")
+        has_counts = "count" in trace.dtype.names
+        for start in range(0, len(trace), self.CHUNK_RECORDS):
+            chunk = trace[start:start + self.CHUNK_RECORDS]
+            counts = chunk["count"].tolist() if has_counts else [1] * len(chunk)
+            yield from zip(chunk["time"].tolist(), chunk["movement"].tolist(), counts)
+
     def get_next_id(self) -> str:
         result = self.current_id
         self.current_id += 1
@@ -0,0 +1,410 @@
+import hashlib
+import itertools
+import json
+import logging
+import math
+import os
+import tempfile
+import time
+import traceback
+from dataclasses import dataclass, field
+from functools import lru_cache
+from statistics import NormalDist
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Type
+
+import numpy as np
+
+from .env_pool import EnvPool, WorkerError
+
+logger = logging.getLogger(__name__)
+
+
+class RunTimedOut(Exception):
+    """Raised by a sweep's run function to give up on a run, such as when it has taken too long
+
+    The run is recorded as timed out, rather than as failed, and is retried the next time
+    the sweep is run.
+    """
+    pass
+
+
+@dataclass
+class StoppingRule:
+    """Decides when a point of a :class:`Sweep` has been run enough times, by the width of the
+    confidence interval of the mean of its results
+
+    :ivar float precision: The largest acceptable half width of the confidence interval - as a
+        fraction of the mean if the rule is relative, or in the metric's units otherwise
+    :ivar Sequence[int] metrics: The indices of the metrics in a run's result that must all
+        reach the precision. A run's result is flattened first, so a single number is metric 0
+    :ivar bool relative: Whether the precision is relative to the mean
+    :ivar float confidence: The confidence level of the interval
+    :ivar int min_runs: The number of runs made before the interval is first checked
+    """
+    precision: float
+    metrics: Sequence[int] = (0,)
+    relative: bool = True
+    confidence: float = 0.95
+    min_runs: int = 3
+
+    def get_half_widths(self, results: Sequence[Any]) -> np.ndarray:
+        """Returns the half width of the confidence interval of the mean of each metric
+
+        :param Sequence[Any] results: The results of the successful runs. Values that are not finite
+            (such as the mean delay of a run in which no vehicle finished) are left out
+        :return: The half width of each of :attr:`metrics`, or infinity for any metric with fewer
+            than two values
+        """
+        return np.array([self._half_width(values) for values in self._metric_values(results)])
+
+    def is_satisfied(self, results: Sequence[Any]) -> bool:
+        """Returns whether enough runs have been made
+
+        :param Sequence[Any] results: The results of the successful runs
+        :return: True if there are at least :attr:`min_runs` results, and every metric has
+            reached the precision
+        """
+        return len(results) >= self.min_runs and all(self._half_width(values) <= self._target(values)
+                                                     for values in self._metric_values(results))
+
+    def get_runs_needed(self, results: Sequence[Any]) -> int:
+        """Estimates the number of successful runs needed for every metric to reach the precision,
+        assuming the spread of the results so far is representative
+
+        :param Sequence[Any] results: The results of the successful runs
+        :return: The estimated number of runs - always more than have been made, unless the rule
+            is already satisfied
+        """
+        if self.is_satisfied(results):
+            return len(results)
+        if len(results) < max(self.min_runs, 2):
+            return max(self.min_runs, 2)
+        needed = len(results) + 1
+        z = NormalDist().inv_cdf((1 + self.confidence) / 2)
+        for values in self._metric_values(results):
+            if len(values) < 2:
+                needed = max(needed, len(results) + 2 - len(values))
+                continue
+            std, target = values.std(ddof=1), self._target(values)
+            if not target > 0:
+                continue
+            # Projected using the normal distribution, and then raised until the (wider) t interval is narrow enough
+            runs = max(len(values), math.ceil((z * std / target) ** 2))
+            while _t_quantile((1 + self.confidence) / 2, runs - 1) * std / math.sqrt(runs) > target:
+                runs += 1
+            # Scaled up by the fraction of runs that gave this metric a value
+            needed = max(needed, math.ceil(runs * len(results) / len(values)))
+        return needed
+
+    def _metric_values(self, results: Sequence[Any]) -> List[np.ndarray]:
+        if len(results) == 0:
+            return [np.array([]) for _ in self.metrics]
+        values = np.asarray(results, dtype=float).reshape(len(results), -1)
+        return [values[np.isfinite(values[:, metric]), metric] for metric in self.metrics]
+
+    def _half_width(self, values: np.ndarray) -> float:
+        if len(values) < 2:
+            return math.inf
+        return _t_quantile((1 + self.confidence) / 2, len(values) - 1) * values.std(ddof=1) / math.sqrt(len(values))
+
+    def _target(self, values: np.ndarray) -> float:
+        if not self.relative:
+            return self.precision
+        return self.precision * abs(values.mean()) if len(values) > 0 else math.nan
+
+
+@dataclass
+class Sweep:
+    """A declarative description of a parameter sweep - every combination of the values of
+    each parameter is run once for each seed
+
+    :ivar str name: The name of the sweep, which its results are stored under
+    :ivar Dict[str, Sequence[Any]] parameters: A dictionary mapping each parameter's name to
+        the values it takes. Values must be JSON serialisable, so algorithms, networks and so on
+        should be referred to by name or path
+    :ivar Sequence[int] seeds: The seeds each combination of parameters is run with
+    :ivar Dict[str, Any] settings: Anything else that affects the outcome of a run, but is the same
+        for every run (such as the time step, length of a run or network). These are part of the key
+        each run's record is stored under, so changing any of them means the runs are made again,
+        rather than old results being reused. Values must be JSON serialisable
+    :ivar Optional[StoppingRule] stopping_rule: If given, each combination of parameters is only
+        run with as many of the seeds (taken in order) as the rule needs, rather than with all of them
+    """
+    name: str
+    parameters: Dict[str, Sequence[Any]]
+    seeds: Sequence[int] = field(default_factory=lambda: [0])
+    settings: Dict[str, Any] = field(default_factory=dict)
+    stopping_rule: Optional[StoppingRule] = None
+
+    def get_configs(self) -> List[Dict[str, Any]]:
+        """Returns the configuration of every run in the sweep - if the sweep has a stopping rule,
+        not all of these may be needed
+
+        :return: A list of dictionaries mapping each parameter's name, and "seed", to its value
+            in the run
+        """
+        names = list(self.parameters)
+        return [{**dict(zip(names, values)), "seed": seed}
+                for values in itertools.product(*self.parameters.values()) for seed in self.seeds]
+
+
+@dataclass
+class RunRecord:
+    """The outcome of a single run in a sweep, as stored on disk
+
+    :ivar Dict[str, Any] config: The configuration of the run
+    :ivar str status: One of "ok", "timed_out" or "failed"
+    :ivar Any result: Whatever the run function returned, if the run succeeded
+    :ivar Optional[str] error: The traceback of the exception that ended the run, if it did not succeed
+    :ivar float duration: The wall time the run took, in seconds
+    """
+    config: Dict[str, Any]
+    status: str
+    result: Any = None
+    error: Optional[str] = None
+    duration: float = 0.
+
+
+def get_config_hash(sweep: Sweep, config: Dict[str, Any]) -> str:
+    """Returns the key a run's record is stored under
+
+    :param Sweep sweep: The sweep the run is part of
+    :param Dict[str, Any] config: The configuration of the run
+    :return: A hash of the sweep's name and settings, and the run's configuration
+    """
+    key = json.dumps([sweep.name, sweep.settings, config], sort_keys=True, default=_to_json)
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def load_run_records(sweep: Sweep, results_dir: str) -> List[Optional[RunRecord]]:
+    """Loads the stored record of every run in a sweep
+
+    :param Sweep sweep: The sweep
+    :param str results_dir: The directory the sweep's results are stored in
+    :return: The record of each of the sweep's runs, in the order of :func:`Sweep.get_configs`,
+        or None for any that have not been run
+    """
+    records = []
+    for config in sweep.get_configs():
+        path = _get_record_path(sweep, config, results_dir)
+        if os.path.exists(path):
+            with open(path) as f:
+                records.append(RunRecord(**json.load(f)))
+        else:
+            records.append(None)
+    return records
+
+
+def run_sweep(sweep: Sweep, env_factory: Callable[[], Any], run_fn: Callable[[Any, Dict[str, Any]], Any],
+              results_dir: str, num_workers: Optional[int] = None,
+              fatal_errors: Tuple[Type[BaseException], ...] = ()) -> List[RunRecord]:
+    """Runs every run of a sweep that has not already succeeded, spreading them across an
+    :class:`EnvPool`
+
+    Each run's record is written to ``results_dir`` by the worker as soon as the run ends, keyed
+    by a hash of its configuration - so if the sweep is interrupted, running it again only runs
+    what is left. Runs that time out (by raising :class:`RunTimedOut`) or fail are recorded
+    as such, and retried the next time the sweep is run. If a run fails with one of
+    ``fatal_errors``, the worker's environment is rebuilt before it is used again, and the
+    run is retried on the new one (up to the pool's ``max_retries`` times). The same goes for a
+    run that kills its worker process, which is recorded as failed once it is out of retries.
+
+    If the sweep has a :class:`StoppingRule`, runs are made in rounds: each combination of
+    parameters is first run with the rule's minimum number of seeds, and then with as many more
+    as the spread of its results suggests it needs, until the rule is satisfied or every seed
+    has been used.
+
+    :param Sweep sweep: The sweep to run
+    :param Callable[[], Any] env_factory: Called once in each worker to build the environment the
+        worker owns - see :class:`EnvPool`
+    :param Callable[[Any, Dict[str, Any]], Any] run_fn: Performs a single run, given the worker's
+        environment and the run's configuration. It must be picklable, and return something JSON
+        serialisable (numpy values are converted)
+    :param str results_dir: The directory the sweep's results are stored in
+    :param Optional[int] num_workers: The number of worker processes. Defaults to the number of CPUs
+    :param Tuple[Type[BaseException], ...] fatal_errors: The exceptions that mean a worker's environment
+        can no longer be used - such as ``traci.exceptions.FatalTraCIError``, when the SUMO process
+        behind a SumoEnvironment has died. They must be picklable
+    :return: The record of every run that has been made, in the order of :func:`Sweep.get_configs`
+    """
+    os.makedirs(os.path.join(results_dir, sweep.name), exist_ok=True)
+    configs = sweep.get_configs()
+    rule = sweep.stopping_rule
+    # Dictionary mapping each combination of parameters to the indices of its runs, in seed order
+    groups: Dict[Tuple, List[int]] = {}
+    for i, config in enumerate(configs):
+        groups.setdefault(tuple(value for name, value in config.items() if name != "seed"), []).append(i)
+    records = load_run_records(sweep, results_dir)
+    # The number of each group's runs that are needed so far. Runs already made by an earlier, interrupted
+    # call are counted, so that the rounds pick up where they left off
+    needed = {key: len(indices) if rule is None else min(len(indices), max(
+        [rule.min_runs] + [n + 1 for n, i in enumerate(indices) if records[i] is not None]))
+        for key, indices in groups.items()}
+    remaining = sum(record is None or record.status != "ok" for record in records)
+    logger.info(f"{sweep.name}: {len(configs) - remaining} of {len(configs)} runs already done")
+
+    # The runs made by this call - runs that do not succeed are only retried the next time the sweep is run
+    attempted: Set[int] = set()
+    pool: Optional[EnvPool] = None
+    try:
+        while True:
+            pending = _get_pending_runs(groups, needed, records, attempted, rule)
+            if not pending:
+                break
+            if pool is None:
+                # The workers are kept across rounds, rather than starting new SUMO instances for each
+                pool = EnvPool(env_factory, min(num_workers or os.cpu_count(), remaining))
+            _run_round(pool, _RecordedRun(sweep, run_fn, results_dir, fatal_errors), [configs[i] for i in pending])
+            previous_records, records = records, load_run_records(sweep, results_dir)
+            attempted.update(i for i in pending if records[i] != previous_records[i])
+    finally:
+        if pool is not None:
+            pool.close()
+
+    if rule is not None:
+        unconverged = [key for key, indices in groups.items()
+                       if not rule.is_satisfied([records[i].result for i in indices
+                                                 if records[i] is not None and records[i].status == "ok"])]
+        logger.info(f"{sweep.name}: made {sum(record is not None for record in records)} of {len(configs)} runs")
+        if unconverged:
+            logger.warning(f"{sweep.name}: {len(unconverged)} of {len(groups)} points did not reach the required "
+                           f"precision in {len(sweep.seeds)} runs: " + ", ".join(str(key) for key in unconverged))
+
+    records = [record for record in records if record is not None]
+    unsuccessful = [record for record in records if record.status != "ok"]
+    if unsuccessful:
+        logger.warning(f"{sweep.name}: {len(unsuccessful)} of {len(records)} runs did not succeed: " +
+                       ", ".join(f"{record.config} ({record.status})" for record in unsuccessful))
+    return records
+
+
+def aggregate_results(records: Sequence[Optional[RunRecord]], group_by: Sequence[str]) -> Dict[Tuple, Any]:
+    """Averages the results of the successful runs in each group of runs
+
+    :param Sequence[Optional[RunRecord]] records: The records of the runs. Runs that have not been
+        made (as returned by :func:`load_run_records`) are ignored
+    :param Sequence[str] group_by: The parameters whose values define a group - usually every
+        parameter but the seed
+    :return: A dictionary mapping the values of the parameters in group_by to the element-wise
+        mean of the results of the group's successful runs, in the order the groups first appear
+    """
+    groups: Dict[Tuple, List[Any]] = {}
+    for record in records:
+        if record is not None and record.status == "ok":
+            groups.setdefault(tuple(record.config[name] for name in group_by), []).append(record.result)
+    return {key: np.mean(results, axis=0) for key, results in groups.items()}
+
+
+class _RecordedRun:
+    """Runs a single run in a worker, and writes its record - picklable, so it can be sent to an EnvPool"""
+
+    def __init__(self, sweep: Sweep, run_fn: Callable[[Any, Dict[str, Any]], Any], results_dir: str,
+                 fatal_errors: Tuple[Type[BaseException], ...]):
+        self.sweep = sweep
+        self.run_fn = run_fn
+        self.results_dir = results_dir
+        # A run ending in one of these is recorded as failed, and the error is then raised again so that the EnvPool
+        # restarts the worker
+        self.fatal_errors = fatal_errors
+
+    def __call__(self, env: Any, config: Dict[str, Any]) -> str:
+        start = time.time()
+        fatal_error = None
+        try:
+            record = RunRecord(config, "ok", result=self.run_fn(env, config))
+        except RunTimedOut:
+            record = RunRecord(config, "timed_out", error=traceback.format_exc())
+        except Exception as e:
+            # Recorded rather than raised, so that one broken configuration does not stop the rest of the sweep
+            record = RunRecord(config, "failed", error=traceback.format_exc())
+            if isinstance(e, self.fatal_errors):
+                fatal_error = e
+        record.duration = time.time() - start
+        _write_record(self.sweep, record, self.results_dir)
+        if fatal_error is not None:
+            raise fatal_error
+        return record.status
+
+
+def _run_round(pool: EnvPool, recorded_run: _RecordedRun, configs: List[Dict[str, Any]]):
+    """Makes a round of runs across the pool's workers, each of which records its own result"""
+    sweep, results_dir = recorded_run.sweep, recorded_run.results_dir
+    start = time.time()
+    try:
+        pool.run(recorded_run, configs)
+    except WorkerError as e:
+        if e.task_index is None:
+            # Not the fault of any one run - the pool itself can no longer be used
+            raise
+        # A run broke its worker's environment, or killed its worker, every time it was retried. Any runs the pool had
+        # not yet handed out are made in the next round
+        logger.error(f"{sweep.name}: {e}")
+        config = configs[e.task_index]
+        path = _get_record_path(sweep, config, results_dir)
+        if not os.path.exists(path) or os.path.getmtime(path) < start:
+            # The worker died before the run could record itself, so it is recorded as failed here - otherwise it
+            # would be handed out again in every round
+            _write_record(sweep, RunRecord(config, "failed", error=str(e)), results_dir)
+
+
+def _get_pending_runs(groups: Dict[Tuple, List[int]], needed: Dict[Tuple, int], records: List[Optional[RunRecord]],
+                      attempted: Set[int], rule: Optional[StoppingRule]) -> List[int]:
+    """Returns the indices of the runs to make in the next round, first raising the number of runs
+    needed by each group whose runs so far do not satisfy the stopping rule"""
+    pending = []
+    for key, indices in groups.items():
+        while True:
+            group_pending = [i for i in indices[:needed[key]]
+                             if i not in attempted and (records[i] is None or records[i].status != "ok")]
+            if rule is None or group_pending or needed[key] == len(indices):
+                break
+            results = [records[i].result for i in indices[:needed[key]]
+                       if records[i] is not None and records[i].status == "ok"]
+            if rule.is_satisfied(results):
+                break
+            # Runs that did not succeed are made up for with the next seeds
+            needed[key] = min(len(indices), needed[key] + rule.get_runs_needed(results) - len(results))
+        pending.extend(group_pending)
+    return sorted(pending)
+
+
+def _write_record(sweep: Sweep, record: RunRecord, results_dir: str):
+    path = _get_record_path(sweep, record.config, results_dir)
+    # Written atomically, so that a crash part way through never leaves a corrupt record behind
+    with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), delete=False) as f:
+        json.dump(record.__dict__, f, default=_to_json)
+    os.replace(f.name, path)
+
+
+def _get_record_path(sweep: Sweep, config: Dict[str, Any], results_dir: str) -> str:
+    return os.path.join(results_dir, sweep.name, f"{get_config_hash(sweep, config)}.json")
+
+
+def _to_json(value: Any) -> Any:
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+@lru_cache(maxsize=None)
+def _t_quantile(p: float, degrees_of_freedom: int) -> float:
+    """Returns the p quantile (for p > 0.5) of Student's t distribution, by bisecting its CDF - the CDF is found
+    by integrating the density numerically, so that sweeps do not need scipy for this alone"""
+    log_scale = math.lgamma((degrees_of_freedom + 1) / 2) - math.lgamma(degrees_of_freedom / 2) - \
+        0.5 * math.log(degrees_of_freedom * math.pi)
+
+    def cdf(x: float) -> float:
+        xs = np.linspace(0, x, 4001)
+        density = np.exp(log_scale - (degrees_of_freedom + 1) / 2 * np.log1p(xs ** 2 / degrees_of_freedom))
+        return 0.5 + float((density[1:] + density[:-1]).sum()) * (xs[1] - xs[0]) / 2
+
+    low, high = 0., 1.
+    while cdf(high) < p:
+        low, high = high, high * 2
+    for _ in range(50):
+        middle = (low + high) / 2
+        if cdf(middle) < p:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
@@ -1,102 +1,124 @@
 #!/usr/bin/env python
-from typing import Optional, Callable, List, Set, Dict
+from typing import List, Set, Dict, Any
 import numpy as np
+import os
+import tempfile
 import time
-from tqdm import tqdm
 from intersection_control.algorithms.traffic_light import TLIntersectionManager, TLVehicle
 from intersection_control.communication import DistanceBasedUnit
-from intersection_control.core import Vehicle, Environment, IntersectionManager
-from intersection_control.environments import SumoEnvironment
+from intersection_control.environments import SumoEnvironment, Sweep, StoppingRule, RunTimedOut, run_sweep, \
+    aggregate_results
 from intersection_control.algorithms import qb_im, stip
-from intersection_control.core.performance_indication import MetricCollector, Metric
-from intersection_control.environments.sumo import RandomDemandGenerator
-from misc.utils import SINGLE_INTERSECTION_TL_PHASES, ROOT_DIR
+from intersection_control.core import Simulation, StepProfiler
+from intersection_control.core.algorithm import vehicle_getters_used_by
+from intersection_control.core.performance_indication import MetricCollector, Metric, get_warm_up_length
+from intersection_control.environments.sumo import RandomDemandGenerator, compile_demand
+from traci.exceptions import FatalTraCIError
+from misc.utils import SINGLE_INTERSECTION_TL_PHASES, ROOT_DIR, NETWORK_CACHE_DIR
 
 TIME_STEP = 0.05
-VPMs = np.arange(0.2, 1.51, 0.05)
-RUNS_PER_VPM = 3
+VPMs = [round(vpm, 2) for vpm in np.arange(0.2, 1.51, 0.05)]
+# Each point is run until the 95% confidence interval of its mean delay and messages per second is within
+# PRECISION of the mean, or MAX_RUNS_PER_VPM runs have been made
+PRECISION = 0.05
+MAX_RUNS_PER_VPM = 20
+# Whether to discard what was measured before each run reached steady state
+DELETE_WARM_UP = True
 STEPS_PER_RUN = int((20 * 60) / TIME_STEP)  # 20 minutes
+NET_CONFIG_FILE = "intersection_control/environments/sumo/networks/single_intersection/intersection.sumocfg"
+ROUTES = ["NE", "NS", "NW", "EN", "ES", "EW", "SN", "SE", "SW", "WN", "WE", "WS"]
+DEPART_SPEED = 10
+STIP_RANGE = 125
+QB_IM_RANGE = 75
+QB_IM_GRANULARITY = 30
 VEHICLE_FACTORIES = {
-    "stip": lambda vid, env: stip.STIPVehicle(vid, env,
-                                              DistanceBasedUnit(vid, 125, lambda: env.vehicles.get_position(vid))),
-    "qb_im": lambda vid, env: qb_im.QBIMVehicle(vid, env,
-                                                DistanceBasedUnit(vid, 75, lambda: env.vehicles.get_position(vid))),
+    "stip": lambda vid, env: stip.STIPVehicle(
+        vid, env, DistanceBasedUnit(vid, STIP_RANGE, lambda: env.vehicles.get_position(vid))),
+    "qb_im": lambda vid, env: qb_im.QBIMVehicle(
+        vid, env, DistanceBasedUnit(vid, QB_IM_RANGE, lambda: env.vehicles.get_position(vid))),
     "tl": lambda vid, env: TLVehicle(vid, env)
 }
 IM_FACTORIES = {
     "stip": None,
     "qb_im": lambda imid, env: qb_im.QBIMIntersectionManager(
-        imid, env, 30, TIME_STEP, DistanceBasedUnit(imid, 75, lambda: env.intersections.get_position(imid))),
+        imid, env, QB_IM_GRANULARITY, TIME_STEP,
+        DistanceBasedUnit(imid, QB_IM_RANGE, lambda: env.intersections.get_position(imid))),
     "tl": lambda imid, env: TLIntersectionManager(imid, env, SINGLE_INTERSECTION_TL_PHASES)
 }
 METRICS_TO_COLLECT = [Metric.TIME, Metric.ALL_VEHICLE_IDS, Metric.MESSAGES_EXCHANGED, Metric.WALL_TIME]
+# The results of every run are kept here, so that an interrupted sweep carries on where it left off when restarted
+RESULTS_DIR = f"{ROOT_DIR}/misc/experiments/out/runs"
+# Part of the key each run's result is kept under, along with the settings above - bump it whenever a change to the
+# code changes the results, so that old results are not reused
+RESULTS_VERSION = 1
+# The phases of each step whose mean wall time is reported separately
+PROFILED_PHASES = [StepProfiler.ENVIRONMENT, StepProfiler.VEHICLES, StepProfiler.INTERSECTION_MANAGERS,
+                   StepProfiler.MESSAGING, StepProfiler.HOOKS]
+
+
+# The delay and messages per second (the first two values of each run's result) are what must be precise enough
+SWEEP = Sweep("algo_comparison", {"vpm": VPMs, "algo": list(VEHICLE_FACTORIES)}, seeds=range(MAX_RUNS_PER_VPM),
+              settings={"time_step": TIME_STEP, "steps_per_run": STEPS_PER_RUN, "net_config_file": NET_CONFIG_FILE,
+                        "routes": ROUTES, "depart_speed": DEPART_SPEED, "stip_range": STIP_RANGE,
+                        "qb_im_range": QB_IM_RANGE, "qb_im_granularity": QB_IM_GRANULARITY,
+                        "delete_warm_up": DELETE_WARM_UP, "results_version": RESULTS_VERSION},
+              stopping_rule=StoppingRule(PRECISION, metrics=[0, 1]))
 
 
 def main():
+    # Every run is independent, so they are spread across a pool of SUMO instances - one per core
+    print(f"Running up to {len(SWEEP.get_configs())} experiments")
+    results = aggregate_results(run_sweep(SWEEP, make_environment, run_experiment, RESULTS_DIR,
+                                          fatal_errors=(FatalTraCIError,)), ["vpm", "algo"])
+
     f = open(f"{ROOT_DIR}/misc/experiments/out/{time.time()}-algo_comparison_experiment.csv", "w")
-    f.write("vpm,algo,delay,messages_exchanged,time_per_step\n")
-    for vpm in VPMs:
-        print(f"Running experiments for {vpm} vehicles per minute")
-        for algo, v_factory in VEHICLE_FACTORIES.items():
-            print(f"Running experiments for {algo} algorithm")
-            totals = np.array([0.] * 3)
-            successful_experiments = 0
-            for i in range(RUNS_PER_VPM):
-                print(f"Run {i + 1}/{RUNS_PER_VPM}")
-                results = run_experiment(vpm, v_factory, IM_FACTORIES[algo])
-                if results:
-                    totals += results
-                    successful_experiments += 1
-            avgs = totals / successful_experiments
-            f.write(f"{vpm},{algo},{','.join([str(avg) for avg in avgs])}\n")
-            f.flush()
+    f.write(f"vpm,algo,delay,messages_exchanged,time_per_step,"
+            f"{','.join([f'{phase}_time_per_step' for phase in PROFILED_PHASES])},real_time_factor\n")
+    for (vpm, algo), avgs in results.items():
+        f.write(f"{vpm},{algo},{','.join([str(avg) for avg in avgs])}\n")
     f.close()
 
 
-def run_experiment(vpm: float, v_factory: Callable[[str, Environment], Vehicle],
-                   im_factory: Optional[Callable[[str, Environment], IntersectionManager]]):
-    experiment_start = time.time()
-    demand_generator = RandomDemandGenerator({
-        route: vpm for route in ["NE", "NS", "NW", "EN", "ES", "EW", "SN", "SE", "SW", "WN", "WE", "WS"]
-    }, TIME_STEP)
-    env = SumoEnvironment(
-        f"{ROOT_DIR}/intersection_control/environments/sumo/networks/single_intersection/intersection.sumocfg",
-        demand_generator=demand_generator, time_step=TIME_STEP, gui=False)
-    vehicles = {v_factory(vehicle_id, env) for vehicle_id in env.vehicles.get_ids()}
-    intersection_managers = {im_factory(intersection_id, env) for intersection_id in
-                             env.intersections.get_ids()} if im_factory else None
+def make_environment() -> SumoEnvironment:
+    return SumoEnvironment(
+        f"{ROOT_DIR}/{NET_CONFIG_FILE}",
+        time_step=TIME_STEP, gui=False, cache_dir=NETWORK_CACHE_DIR,
+        vehicle_getters=vehicle_getters_used_by(stip.STIPVehicle, qb_im.QBIMVehicle, TLVehicle,
+                                                qb_im.QBIMIntersectionManager, TLIntersectionManager))
 
-    metric_collector = MetricCollector(env, *METRICS_TO_COLLECT, messaging_unit_class=DistanceBasedUnit)
 
-    for _ in tqdm(range(STEPS_PER_RUN)):
-        env.step()
-        removed_vehicles = {v for v in vehicles if v.get_id() in env.get_removed_vehicles()}
-        for v in removed_vehicles:
-            v.destroy()
-        new_vehicles = {v_factory(vehicle_id, env) for vehicle_id in env.get_added_vehicles()}
-        vehicles = (vehicles - removed_vehicles).union(new_vehicles)
-        for vehicle in vehicles:
-            vehicle.step()
-        if intersection_managers:
-            for intersection_manager in intersection_managers:
-                intersection_manager.step()
-        metric_collector.poll()
-
-        if time.time() - experiment_start > 60 * 10:
-            # More than 10 mins for experiment
-            print("Experiment took too long, continuing to the next one")
-            for v in vehicles:
-                v.destroy()
-            env.close()
-            return None
-
-    for v in vehicles:
-        v.destroy()
-
-    env.close()
+def run_experiment(env: SumoEnvironment, config: Dict[str, Any]):
+    vpm, algo, run = config["vpm"], config["algo"], config["seed"]
+    v_factory, im_factory = VEHICLE_FACTORIES[algo], IM_FACTORIES[algo]
+    experiment_start = time.time()
+    # The demand does not depend on the algorithm, so the whole run's vehicles are sampled up front for SUMO to
+    # insert itself. The file is reused by each of the worker's runs
+    demand_generator = RandomDemandGenerator({route: vpm for route in ROUTES}, TIME_STEP, DEPART_SPEED, seed=run)
+    demand_file = os.path.join(tempfile.gettempdir(), f"algo_comparison-demand-{os.getpid()}.rou.xml")
+    compile_demand(demand_generator, env.net_config_file, STEPS_PER_RUN * TIME_STEP, demand_file, TIME_STEP,
+                   NETWORK_CACHE_DIR)
+    # Restart the worker's SUMO instance from the beginning, rather than starting a new one for every run
+    env.reload(demand_file=demand_file)
+    metric_collector = MetricCollector(env, *METRICS_TO_COLLECT, messaging_unit_class=DistanceBasedUnit)
+    # Created after the metric collector, so that the messages it counts are timed too. Closing the profiler stops it
+    # timing the messaging unit class, whether or not the run succeeds
+    with StepProfiler(DistanceBasedUnit) as profiler:
+        simulation = Simulation(env, v_factory, im_factory, profiler=profiler)
+        simulation.add_step_hook(metric_collector.poll)
+        try:
+            for _ in range(STEPS_PER_RUN):
+                simulation.step()
+
+                if time.time() - experiment_start > 60 * 10:
+                    # More than 10 mins for experiment
+                    raise RunTimedOut(f"{config} took more than 10 minutes")
+        finally:
+            simulation.close()
 
     results = metric_collector.get_results()
-    return [calculate_avg_delay(results), calculate_msgs_per_s(results), calculate_avg_step_time(results)]
+    phase_times = profiler.report()["phases"]
+    return [calculate_avg_delay(results), calculate_msgs_per_s(results), calculate_avg_step_time(results),
+            *[phase_times[phase]["wall"]["mean"] for phase in PROFILED_PHASES], profiler.real_time_factor()]
 
 
 def calculate_avg_delay(results):
@@ -110,6 +132,8 @@ def calculate_avg_delay(results):
             times.append(time - start_times[v])
         active_vehicles = vehicles
 
+    if DELETE_WARM_UP:
+        times = times[get_warm_up_length(times):]
     unhindered_time = 600 / 13.89
     return np.mean([time - unhindered_time for time in times])
 
@@ -125,6 +149,8 @@ def calculate_msgs_per_s(results):
             messages_per_second.append(messages_this_second + num_messages)
             messages_this_second = 0
             last_second += 1
+    if DELETE_WARM_UP:
+        messages_per_second = messages_per_second[get_warm_up_length(messages_per_second):]
     return np.mean(messages_per_second)
 
 
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""Shows which environment calls each algorithm makes, and what they cost
+
+Runs every algorithm on the single intersection network through a ProfilingEnvironment,
+and prints the number of calls, total time and TraCI round trips of every vehicle and
+intersection handler method, for each calling class.
+"""
+
+from intersection_control.algorithms import qb_im, stip
+from intersection_control.algorithms.traffic_light import TLIntersectionManager, TLVehicle
+from intersection_control.communication import DistanceBasedUnit
+from intersection_control.core import Simulation
+from intersection_control.environments import SumoEnvironment, ProfilingEnvironment
+from intersection_control.environments.sumo import RandomDemandGenerator
+from misc.utils import SINGLE_INTERSECTION_TL_PHASES, ROOT_DIR, NETWORK_CACHE_DIR
+
+TIME_STEP = 0.05
+VPM = 1  # Vehicles per minute on each route
+STEPS_PER_RUN = int((2 * 60) / TIME_STEP)  # 2 minutes
+VEHICLE_FACTORIES = {
+    "stip": lambda vid, env: stip.STIPVehicle(vid, env,
+                                              DistanceBasedUnit(vid, 125, lambda: env.vehicles.get_position(vid))),
+    "qb_im": lambda vid, env: qb_im.QBIMVehicle(vid, env,
+                                                DistanceBasedUnit(vid, 75, lambda: env.vehicles.get_position(vid))),
+    "tl": lambda vid, env: TLVehicle(vid, env)
+}
+IM_FACTORIES = {
+    "stip": None,
+    "qb_im": lambda imid, env: qb_im.QBIMIntersectionManager(
+        imid, env, 30, TIME_STEP, DistanceBasedUnit(imid, 75, lambda: env.intersections.get_position(imid))),
+    "tl": lambda imid, env: TLIntersectionManager(imid, env, SINGLE_INTERSECTION_TL_PHASES)
+}
+
+
+def main():
+    env = SumoEnvironment(
+        f"{ROOT_DIR}/intersection_control/environments/sumo/networks/single_intersection/intersection.sumocfg",
+        time_step=TIME_STEP, gui=False, warnings=False, cache_dir=NETWORK_CACHE_DIR)
+    for algo in VEHICLE_FACTORIES:
+        env.reload(RandomDemandGenerator({
+            route: VPM for route in ["NE", "NS", "NW", "EN", "ES", "EW", "SN", "SE", "SW", "WN", "WE", "WS"]
+        }, TIME_STEP, seed=0))
+        profiling_env = ProfilingEnvironment(env)
+        try:
+            simulation = Simulation(profiling_env, VEHICLE_FACTORIES[algo], IM_FACTORIES[algo])
+            simulation.run(STEPS_PER_RUN)
+            simulation.close()
+        finally:
+            profiling_env.stop_counting_round_trips()
+        print(f"{algo}:\n{profiling_env.summary()}\n")
+    env.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""Compares the cost of adding demand-generated vehicles to SUMO using pre-registered vehicle
+types (a single TraCI call per vehicle) with setting each vehicle's colour and lane change
+mode after adding it (three TraCI calls per vehicle)
+
+Runs the single intersection network at increasing demand with no algorithm attached, so that
+the time per step is dominated by the environment itself.
+"""
+import time
+from typing import List
+
+import numpy as np
+from intersection_control.environments import SumoEnvironment
+from intersection_control.environments.sumo import RandomDemandGenerator, NewVehicleParams, ControlType
+from misc.utils import ROOT_DIR, NETWORK_CACHE_DIR
+
+TIME_STEP = 0.05
+VPMs = [10, 30, 60, 120]  # Vehicles per minute on each route
+STEPS_PER_RUN = int((2 * 60) / TIME_STEP)  # 2 minutes
+ROUTES = ["NE", "NS", "NW", "EN", "ES", "EW", "SN", "SE", "SW", "WN", "WE", "WS"]
+
+
+class PerVehicleSettingsEnvironment(SumoEnvironment):
+    """Adds vehicles the way the environment did before vehicle types were used"""
+
+    def _add_vehicles(self, new_vehicles: List[NewVehicleParams]):
+        for v in new_vehicles:
+            self.connection.vehicle.add(v.veh_id, v.route_id,
+                                        departLane=self.demand_generator.choose_departure_lane(
+                                            v, self.departure_lanes[v.route_id]),
+                                        departSpeed=v.depart_speed, departPos=v.depart_pos)
+            self.connection.vehicle.setColor(v.veh_id, [255, 255, 255, 255])
+            if v.control_type == ControlType.MANUAL:
+                self._vehicles.set_control_mode(v.veh_id, ControlType.MANUAL)
+                self._vehicles.set_desired_speed(v.veh_id, v.depart_speed)
+            self._vehicles.set_lane_change_mode(v.veh_id, 0b010000000101)
+
+
+def main():
+    print("vpm,method,time_per_step,vehicles_added")
+    for vpm in VPMs:
+        for method, environment_class in [("per_vehicle_settings", PerVehicleSettingsEnvironment),
+                                          ("vehicle_types", SumoEnvironment)]:
+            time_per_step, vehicles_added = run_benchmark(environment_class, vpm)
+            print(f"{vpm},{method},{time_per_step},{vehicles_added}")
+
+
+def run_benchmark(environment_class, vpm: float):
+    env = environment_class(
+        f"{ROOT_DIR}/intersection_control/environments/sumo/networks/single_intersection/intersection.sumocfg",
+        demand_generator=RandomDemandGenerator({route: vpm for route in ROUTES}, TIME_STEP, seed=0),
+        time_step=TIME_STEP, gui=False, warnings=False, cache_dir=NETWORK_CACHE_DIR)
+    step_times = []
+    vehicles_added = 0
+    for _ in range(STEPS_PER_RUN):
+        start = time.perf_counter()
+        env.step()
+        step_times.append(time.perf_counter() - start)
+        vehicles_added += len(env.get_added_vehicles())
+    env.close()
+    return np.mean(step_times), vehicles_added
+
+
+if __name__ == '__main__':
+    main()
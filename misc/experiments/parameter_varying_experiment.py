@@ -1,53 +1,83 @@
 #!/usr/bin/env python
-from typing import List, Set, Dict
+from typing import List, Set, Dict, Any
 import numpy as np
+import os
+import tempfile
 import time
-from tqdm import tqdm
 
 from intersection_control.algorithms.qb_im import QBIMVehicle, QBIMIntersectionManager
 from intersection_control.communication import DistanceBasedUnit
-from intersection_control.environments import SumoEnvironment
-from intersection_control.core.performance_indication import MetricCollector, Metric
-from intersection_control.environments.sumo import RandomDemandGenerator
-from misc.utils import ROOT_DIR
+from intersection_control.environments import SumoEnvironment, Sweep, StoppingRule, RunTimedOut, run_sweep, \
+    aggregate_results
+from intersection_control.core import Simulation
+from intersection_control.core.algorithm import vehicle_getters_used_by
+from intersection_control.core.performance_indication import MetricCollector, Metric, get_warm_up_length
+from intersection_control.environments.sumo import RandomDemandGenerator, compile_demand
+from traci.exceptions import FatalTraCIError
+from misc.utils import ROOT_DIR, NETWORK_CACHE_DIR
 
 TIME_STEP = 0.05
 VPMs = [0.2, 0.6, 1.]
 GRANULARITIES = range(1, 50, 5)
-RUNS_PER_GRANULARITY = 3
+# Each point is run until the 95% confidence interval of its mean delay is within PRECISION of the mean, or
+# MAX_RUNS_PER_GRANULARITY runs have been made
+PRECISION = 0.05
+MAX_RUNS_PER_GRANULARITY = 20
+# Whether to discard the delays of vehicles that left before each run reached steady state
+DELETE_WARM_UP = True
 STEPS_PER_RUN = int((20 * 60) / TIME_STEP)  # 20 minutes
+NET_CONFIG_FILE = "intersection_control/environments/sumo/networks/single_intersection/intersection.sumocfg"
+ROUTES = ["NE", "NS", "NW", "EN", "ES", "EW", "SN", "SE", "SW", "WN", "WE", "WS"]
+DEPART_SPEED = 10
+QB_IM_RANGE = 75
 METRICS_TO_COLLECT = [Metric.TIME, Metric.ALL_VEHICLE_IDS]
+# The results of every run are kept here, so that an interrupted sweep carries on where it left off when restarted
+RESULTS_DIR = f"{ROOT_DIR}/misc/experiments/out/runs"
+# Part of the key each run's result is kept under, along with the settings above - bump it whenever a change to the
+# code changes the results, so that old results are not reused
+RESULTS_VERSION = 1
+SWEEP = Sweep("parameter_varying", {"granularity": list(GRANULARITIES), "vpm": VPMs},
+              seeds=range(MAX_RUNS_PER_GRANULARITY),
+              settings={"time_step": TIME_STEP, "steps_per_run": STEPS_PER_RUN, "net_config_file": NET_CONFIG_FILE,
+                        "routes": ROUTES, "depart_speed": DEPART_SPEED, "qb_im_range": QB_IM_RANGE,
+                        "delete_warm_up": DELETE_WARM_UP, "results_version": RESULTS_VERSION},
+              stopping_rule=StoppingRule(PRECISION))
 
 
 def main():
+    # Every run is independent, so they are spread across a pool of SUMO instances - one per core
+    print(f"Running up to {len(SWEEP.get_configs())} experiments")
+    results = aggregate_results(run_sweep(SWEEP, make_environment, run_experiment, RESULTS_DIR,
+                                          fatal_errors=(FatalTraCIError,)),
+                                ["vpm", "granularity"])
+
     f = open(f"{ROOT_DIR}/misc/experiments/out/{time.time()}-parameter_varying_experiment.csv", "w")
     f.write("vpm,granularity,delay\n")
     for granularity in GRANULARITIES:
-        print(f"Running experiments for granularity {granularity}")
         for vpm in VPMs:
-            print(f"Running experiments for {vpm} vehicles per minute")
-            total = 0
-            successful_experiments = 0
-            for i in range(RUNS_PER_GRANULARITY):
-                print(f"Run {i + 1}/{RUNS_PER_GRANULARITY}")
-                results = run_experiment(vpm, granularity)
-                if results:
-                    total += results
-                    successful_experiments += 1
-            avg = total / successful_experiments
-            f.write(f"{vpm},{granularity},{avg}\n")
-            f.flush()
+            if (vpm, granularity) in results:
+                f.write(f"{vpm},{granularity},{results[vpm, granularity]}\n")
     f.close()
 
 
-def run_experiment(vpm: float, granularity: int):
+def make_environment() -> SumoEnvironment:
+    return SumoEnvironment(
+        f"{ROOT_DIR}/{NET_CONFIG_FILE}",
+        time_step=TIME_STEP, gui=False, cache_dir=NETWORK_CACHE_DIR,
+        vehicle_getters=vehicle_getters_used_by(QBIMVehicle, QBIMIntersectionManager))
+
+
+def run_experiment(env: SumoEnvironment, config: Dict[str, Any]):
+    vpm, granularity, run = config["vpm"], config["granularity"], config["seed"]
     experiment_start = time.time()
-    demand_generator = RandomDemandGenerator({
-        route: vpm for route in ["NE", "NS", "NW", "EN", "ES", "EW", "SN", "SE", "SW", "WN", "WE", "WS"]
-    }, TIME_STEP)
-    env = SumoEnvironment(
-        f"{ROOT_DIR}/intersection_control/environments/sumo/networks/single_intersection/intersection.sumocfg",
-        demand_generator=demand_generator, time_step=TIME_STEP, gui=False)
+    # The demand does not depend on the algorithm, so the whole run's vehicles are sampled up front for SUMO to
+    # insert itself. The file is reused by each of the worker's runs
+    demand_generator = RandomDemandGenerator({route: vpm for route in ROUTES}, TIME_STEP, DEPART_SPEED, seed=run)
+    demand_file = os.path.join(tempfile.gettempdir(), f"parameter_varying-demand-{os.getpid()}.rou.xml")
+    compile_demand(demand_generator, env.net_config_file, STEPS_PER_RUN * TIME_STEP, demand_file, TIME_STEP,
+                   NETWORK_CACHE_DIR)
+    # Restart the worker's SUMO instance from the beginning, rather than starting a new one for every run
+    env.reload(demand_file=demand_file)
 
     def v_position_function(vid):
         return lambda: env.vehicles.get_position(vid)
@@ -55,40 +85,22 @@ def run_experiment(vpm: float, granularity: int):
     def im_position_function(imid):
         return lambda: env.intersections.get_position(imid)
 
-    vehicles = {QBIMVehicle(vid, env, DistanceBasedUnit(vid, 75, v_position_function(vid))) for
-                vid in env.vehicles.get_ids()}
-    intersection_managers = {QBIMIntersectionManager(imid, env, granularity, TIME_STEP,
-                                                     DistanceBasedUnit(imid, 75, im_position_function(imid)))
-                             for imid in env.intersections.get_ids()}
-
+    simulation = Simulation(
+        env, lambda vid, env: QBIMVehicle(vid, env, DistanceBasedUnit(vid, QB_IM_RANGE, v_position_function(vid))),
+        lambda imid, env: QBIMIntersectionManager(imid, env, granularity, TIME_STEP,
+                                                  DistanceBasedUnit(imid, QB_IM_RANGE, im_position_function(imid))))
     metric_collector = MetricCollector(env, *METRICS_TO_COLLECT, messaging_unit_class=DistanceBasedUnit)
+    simulation.add_step_hook(metric_collector.poll)
 
-    for _ in tqdm(range(STEPS_PER_RUN)):
-        env.step()
-        removed_vehicles = {v for v in vehicles if v.get_id() in env.get_removed_vehicles()}
-        for v in removed_vehicles:
-            v.destroy()
-        new_vehicles = {QBIMVehicle(vid, env, DistanceBasedUnit(vid, 75, v_position_function(vid)))
-                        for vid in env.get_added_vehicles()}
-        vehicles = (vehicles - removed_vehicles).union(new_vehicles)
-        for vehicle in vehicles:
-            vehicle.step()
-        for intersection_manager in intersection_managers:
-            intersection_manager.step()
-        metric_collector.poll()
+    for _ in range(STEPS_PER_RUN):
+        simulation.step()
 
         if time.time() - experiment_start > 60 * 10:
             # More than 10 mins for experiment
-            print("Experiment took too long, continuing to the next one")
-            for v in vehicles:
-                v.destroy()
-            env.close()
-            return None
-
-    for v in vehicles:
-        v.destroy()
+            simulation.close()
+            raise RunTimedOut(f"{config} took more than 10 minutes")
 
-    env.close()
+    simulation.close()
 
     results = metric_collector.get_results()
     return calculate_avg_delay(results)
@@ -105,6 +117,8 @@ def calculate_avg_delay(results):
             times.append(time - start_times[v])
         active_vehicles = vehicles
 
+    if DELETE_WARM_UP:
+        times = times[get_warm_up_length(times):]
     unhindered_time = 600 / 13.89
     return np.mean([time - unhindered_time for time in times])
 
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""Measures how each algorithm, and the framework itself, scale with the number of intersections
+
+Runs every algorithm on a pack of generated grid and arterial networks of increasing size,
+recording the average wall time per step, the average number of vehicles in the network
+and the average number of messages sent per step.
+"""
+import tempfile
+import time
+import numpy as np
+from intersection_control.algorithms import qb_im, stip
+from intersection_control.algorithms.traffic_light import TLVehicle
+from intersection_control.communication import DistanceBasedUnit
+from intersection_control.core import Simulation
+from intersection_control.core.algorithm import vehicle_getters_used_by
+from intersection_control.core.performance_indication import MetricCollector, Metric
+from intersection_control.environments import SumoEnvironment
+from intersection_control.environments.sumo import generate_grid_network, generate_arterial_network
+from misc.utils import ROOT_DIR, NETWORK_CACHE_DIR
+
+TIME_STEP = 0.05
+VPM = 5  # Vehicles per minute entering the network from each entry point
+STEPS_PER_RUN = int((5 * 60) / TIME_STEP)  # 5 minutes
+# (name, generator, size) for each network in the scenario pack
+SCENARIOS = [
+    ("grid-1x1", generate_grid_network, (1, 1)),
+    ("grid-2x2", generate_grid_network, (2, 2)),
+    ("grid-3x3", generate_grid_network, (3, 3)),
+    ("grid-4x4", generate_grid_network, (4, 4)),
+    ("arterial-2", generate_arterial_network, (2,)),
+    ("arterial-4", generate_arterial_network, (4,)),
+    ("arterial-8", generate_arterial_network, (8,)),
+]
+VEHICLE_FACTORIES = {
+    "stip": lambda vid, env: stip.STIPVehicle(vid, env,
+                                              DistanceBasedUnit(vid, 125, lambda: env.vehicles.get_position(vid))),
+    "qb_im": lambda vid, env: qb_im.QBIMVehicle(vid, env,
+                                                DistanceBasedUnit(vid, 75, lambda: env.vehicles.get_position(vid))),
+    # With no intersection managers, each traffic light follows SUMO's default program for the generated network
+    "tl": lambda vid, env: TLVehicle(vid, env)
+}
+IM_FACTORIES = {
+    "stip": None,
+    "qb_im": lambda imid, env: qb_im.QBIMIntersectionManager(
+        imid, env, 30, TIME_STEP, DistanceBasedUnit(imid, 75, lambda: env.intersections.get_position(imid))),
+    "tl": None
+}
+METRICS_TO_COLLECT = [Metric.WALL_TIME, Metric.NUM_VEHICLES, Metric.MESSAGES_EXCHANGED]
+
+
+def main():
+    f = open(f"{ROOT_DIR}/misc/experiments/out/{time.time()}-scaling_experiment.csv", "w")
+    f.write("scenario,intersections,algo,time_per_step,vehicles,messages_per_step\n")
+    env = None
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, generator, size in SCENARIOS:
+            network = generator(output_dir, *size, name=name)
+            if env is None:
+                # A single SUMO instance is reused for every run, reloading each network in turn
+                env = SumoEnvironment(network.config_file, time_step=TIME_STEP, gui=False, cache_dir=NETWORK_CACHE_DIR,
+                                      vehicle_getters=vehicle_getters_used_by(stip.STIPVehicle, qb_im.QBIMVehicle,
+                                                                              TLVehicle, qb_im.QBIMIntersectionManager))
+            for algo in VEHICLE_FACTORIES:
+                print(f"Running {algo} on {name}")
+                results = run_experiment(env, network, algo)
+                f.write(f"{name},{len(network.intersection_ids)},{algo},{','.join([str(r) for r in results])}\n")
+                f.flush()
+    if env is not None:
+        env.close()
+    f.close()
+
+
+def run_experiment(env: SumoEnvironment, network, algo: str):
+    v_factory, im_factory = VEHICLE_FACTORIES[algo], IM_FACTORIES[algo]
+    env.reload(network.demand_generator(VPM, TIME_STEP, seed=0), network.config_file)
+    simulation = Simulation(env, v_factory, im_factory)
+    metric_collector = MetricCollector(env, *METRICS_TO_COLLECT, messaging_unit_class=DistanceBasedUnit)
+    simulation.add_step_hook(metric_collector.poll)
+    simulation.run(STEPS_PER_RUN)
+    simulation.close()
+
+    results = metric_collector.get_results()
+    return [np.mean(results[Metric.WALL_TIME][1:]), np.mean(results[Metric.NUM_VEHICLES]),
+            np.mean(results[Metric.MESSAGES_EXCHANGED])]
+
+
+if __name__ == '__main__':
+    main()
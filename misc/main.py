@@ -5,6 +5,7 @@ from intersection_control.algorithms.stip.stip_vehicle import STIPVehicle
 from intersection_control.algorithms.traffic_light.tl_intersection_manager import TLIntersectionManager
 from intersection_control.algorithms.traffic_light.tl_vehicle import TLVehicle
 from intersection_control.communication import DistanceBasedUnit
+from intersection_control.core import Simulation
 from intersection_control.environments.sumo import SumoEnvironment, RandomDemandGenerator
 from intersection_control.algorithms.qb_im import QBIMIntersectionManager, QBIMVehicle
 from intersection_control.environments.sumo.networks.single_intersection.demand_generators import \
@@ -12,6 +13,9 @@ from intersection_control.environments.sumo.networks.single_intersection.demand_
 from misc.utils import SINGLE_INTERSECTION_TL_PHASES, ROOT_DIR
 
 STEP_COUNT = 360000  # 1 Hour
+# Whether to skip straight to the next time any vehicle or intersection manager needs to act, rather than stepping
+# through every step - for QB-IM and STIP, this skips the steps in which every vehicle is between intersections
+SKIP_IDLE_STEPS = False
 
 make_im = {
     "qb_im": lambda imid, env: QBIMIntersectionManager(
@@ -45,22 +49,12 @@ def main():
         f"{ROOT_DIR}/intersection_control/environments/sumo/networks/single_intersection/intersection.sumocfg",
         demand_generator=demand_generator, time_step=0.05, gui=True)
 
-    intersection_managers = {make_im[algo](intersection_id, env) for intersection_id in
-                             env.intersections.get_ids()} if make_im[algo] else None
-    vehicles = {make_vehicle[algo](vehicle_id, env) for vehicle_id in env.vehicles.get_ids()}
-
-    for _ in range(STEP_COUNT):
-        env.step()
-        removed_vehicles = {v for v in vehicles if v.get_id() in env.get_removed_vehicles()}
-        for v in removed_vehicles:
-            v.destroy()
-        new_vehicles = {make_vehicle[algo](vehicle_id, env) for vehicle_id in env.get_added_vehicles()}
-        vehicles = (vehicles - removed_vehicles).union(new_vehicles)
-        for vehicle in vehicles:
-            vehicle.step()
-        if intersection_managers:
-            for im in intersection_managers:
-                im.step()
+    simulation = Simulation(env, make_vehicle[algo], make_im[algo], skip_idle_steps=SKIP_IDLE_STEPS)
+    if SKIP_IDLE_STEPS:
+        simulation.run_until(env.get_current_time() + STEP_COUNT * env.time_step)
+    else:
+        simulation.run(STEP_COUNT)
+    simulation.close()
 
 
 # this is the main entry point of this script
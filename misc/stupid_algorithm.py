@@ -1,4 +1,4 @@
-from intersection_control.core import Vehicle, IntersectionManager, Environment, Message
+from intersection_control.core import Vehicle, IntersectionManager, Environment, Message, Simulation
 from intersection_control.communication import DistanceBasedUnit
 from intersection_control.environments import SumoEnvironment
 from intersection_control.environments.sumo import RandomDemandGenerator
@@ -38,21 +38,9 @@ def main():
     env = SumoEnvironment("../intersection_control/environments/sumo/networks/single_intersection/intersection.sumocfg",
                           demand_generator=demand_generator, time_step=0.05, gui=True)
 
-    intersection_managers = {StupidIntersectionManager(intersection_id, env) for intersection_id in
-                             env.intersections.get_ids()}
-    vehicles = {StupidVehicle(vehicle_id, env) for vehicle_id in env.vehicles.get_ids()}
-
-    for _ in range(36000):
-        env.step()
-        removed_vehicles = {v for v in vehicles if v.get_id() in env.get_removed_vehicles()}
-        for v in removed_vehicles:
-            v.destroy()
-        new_vehicles = {StupidVehicle(vehicle_id, env) for vehicle_id in env.get_added_vehicles()}
-        vehicles = (vehicles - removed_vehicles).union(new_vehicles)
-        for vehicle in vehicles:
-            vehicle.step()
-        for intersection_manager in intersection_managers:
-            intersection_manager.step()
+    simulation = Simulation(env, StupidVehicle, StupidIntersectionManager)
+    simulation.run(36000)
+    simulation.close()
 
 
 if __name__ == "__main__":
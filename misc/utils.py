@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 # Simple traffic light phase definition for single_intersection sumo network
 SINGLE_INTERSECTION_TL_PHASES = [
@@ -14,3 +15,6 @@ SINGLE_INTERSECTION_TL_PHASES = [
 ]
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Where the experiments cache the data derived from each SUMO network, so that it is only parsed once across runs
+NETWORK_CACHE_DIR = os.path.join(tempfile.gettempdir(), "intersection_control-network_cache")
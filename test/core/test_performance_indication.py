@@ -0,0 +1,19 @@
+import unittest
+
+import numpy as np
+
+from intersection_control.core.performance_indication import get_warm_up_length
+
+
+class TestWarmUpDetection(unittest.TestCase):
+    def test_detects_initial_transient(self):
+        rng = np.random.default_rng(0)
+        values = np.concatenate([np.linspace(50, 10, 100), rng.normal(10, 1, 900)])
+        self.assertAlmostEqual(get_warm_up_length(values), 100, delta=20)
+
+    def test_steady_series_has_no_warm_up(self):
+        self.assertLessEqual(get_warm_up_length(np.random.default_rng(0).normal(10, 1, 1000)), 10)
+
+    def test_never_deletes_more_than_half(self):
+        self.assertLessEqual(get_warm_up_length(np.linspace(100, 0, 1000)), 500)
+        self.assertEqual(get_warm_up_length([1, 2, 3]), 0)
@@ -0,0 +1,107 @@
+import unittest
+from os.path import join
+
+import numpy as np
+
+from intersection_control.algorithms.qb_im import QBIMIntersectionManager, QBIMVehicle
+from intersection_control.communication import DistanceBasedUnit
+from intersection_control.core import Simulation, StepProfiler, StreamingHistogram, Message
+from intersection_control.core.performance_indication import MetricCollector, Metric
+from intersection_control.environments import SumoEnvironment
+from intersection_control.environments.sumo import RandomDemandGenerator
+from misc.utils import ROOT_DIR
+
+SINGLE_INTERSECTION = join(ROOT_DIR,
+                           "intersection_control/environments/sumo/networks/single_intersection/intersection.sumocfg")
+ROUTES = ["NE", "NS", "NW", "EN", "ES", "EW", "SN", "SE", "SW", "WN", "WE", "WS"]
+
+
+class TestStreamingHistogram(unittest.TestCase):
+    def test_quantiles_are_close_to_exact(self):
+        values = np.random.default_rng(0).lognormal(-7, 1, 100000)
+        histogram = StreamingHistogram()
+        for value in values:
+            histogram.add(value)
+        self.assertEqual(histogram.count, len(values))
+        self.assertAlmostEqual(histogram.mean(), np.mean(values))
+        for q in [0.5, 0.95, 0.99]:
+            self.assertAlmostEqual(histogram.quantile(q) / np.quantile(values, q), 1, delta=0.05)
+        self.assertEqual(histogram.quantile(1), max(values))
+        self.assertLess(len(histogram.buckets), 300)
+
+    def test_zero_values(self):
+        histogram = StreamingHistogram()
+        self.assertEqual(histogram.quantile(0.5), 0)
+        for value in [0, 0, 0, 1]:
+            histogram.add(value)
+        self.assertEqual(histogram.quantile(0.5), 0)
+        self.assertEqual(histogram.quantile(0.99), 1)
+
+
+class TestStepProfiler(unittest.TestCase):
+    def setUp(self) -> None:
+        self.env = SumoEnvironment(SINGLE_INTERSECTION,
+                                   RandomDemandGenerator({route: 20 for route in ROUTES}, 0.05, seed=0), 0.05, False,
+                                   False)
+
+    def tearDown(self) -> None:
+        self.env.close()
+
+    def test_records_every_phase(self):
+        original_send = DistanceBasedUnit.send
+        profiler = StepProfiler(DistanceBasedUnit)
+        simulation = Simulation(
+            self.env,
+            lambda vid, env: QBIMVehicle(vid, env, DistanceBasedUnit(vid, 75, lambda: env.vehicles.get_position(vid))),
+            lambda imid, env: QBIMIntersectionManager(
+                imid, env, 30, 0.05, DistanceBasedUnit(imid, 75, lambda: env.intersections.get_position(imid))),
+            profiler=profiler)
+        simulation.add_step_hook(lambda: None)
+        simulation.run(600)
+        simulation.close()
+        profiler.close()
+        self.assertIs(DistanceBasedUnit.send, original_send)
+
+        report = profiler.report()
+        self.assertEqual(report["steps"], 600)
+        self.assertAlmostEqual(profiler.simulated_time, 30)
+        self.assertGreater(report["real_time_factor"], 0)
+        for phase in [StepProfiler.ENVIRONMENT, StepProfiler.LIFECYCLE, StepProfiler.VEHICLES,
+                      StepProfiler.INTERSECTION_MANAGERS, StepProfiler.HOOKS, StepProfiler.MESSAGING]:
+            self.assertEqual(profiler.wall_times[phase].count, 600)
+            self.assertIn("cpu", report["phases"][phase])
+            self.assertLessEqual(report["phases"][phase]["wall"]["p50"], report["phases"][phase]["wall"]["p99"])
+        self.assertGreater(report["phases"][StepProfiler.MESSAGING]["wall"]["total"], 0)
+        self.assertLess(report["phases"]["vehicles.QBIMVehicle"]["wall"]["total"],
+                        report["phases"][StepProfiler.VEHICLES]["wall"]["total"])
+        self.assertIn("real time factor", profiler.summary())
+
+    def test_context_manager_restores_messaging_unit_after_error(self):
+        original_send = DistanceBasedUnit.send
+        with self.assertRaises(RuntimeError):
+            with StepProfiler(DistanceBasedUnit):
+                self.assertIsNot(DistanceBasedUnit.send, original_send)
+                raise RuntimeError
+        self.assertIs(DistanceBasedUnit.send, original_send)
+
+    def test_collector_created_while_profiling_outlives_profiler(self):
+        class Unit(DistanceBasedUnit):
+            pass
+
+        sender, receiver = Unit("sender", 10, lambda: (0, 0)), Unit("receiver", 10, lambda: (1, 0))
+        try:
+            with StepProfiler(Unit) as profiler:
+                metric_collector = MetricCollector(self.env, Metric.MESSAGES_EXCHANGED, messaging_unit_class=Unit)
+                sender.send("receiver", Message("sender", {}))
+            timed = profiler._messaging_wall
+            self.assertGreater(timed, 0)
+            self.assertFalse(hasattr(Unit.send, "_profiler"))
+            self.assertIs(Unit._uncounted_send, DistanceBasedUnit.send)
+
+            sender.send("receiver", Message("sender", {}))
+            self.assertEqual(profiler._messaging_wall, timed)
+            self.assertEqual(metric_collector.num_send_calls, 2)
+            self.assertEqual(len(receiver.receive()), 2)
+        finally:
+            sender.destroy()
+            receiver.destroy()
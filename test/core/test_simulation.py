@@ -0,0 +1,96 @@
+import unittest
+from os.path import join
+
+from intersection_control.algorithms.qb_im import QBIMIntersectionManager, QBIMVehicle
+from intersection_control.algorithms.stip import STIPVehicle
+from intersection_control.algorithms.traffic_light import TLVehicle, TLIntersectionManager
+from intersection_control.communication import DistanceBasedUnit
+from intersection_control.core import Simulation
+from intersection_control.environments import SumoEnvironment
+from intersection_control.environments.sumo import RandomDemandGenerator
+from misc.utils import ROOT_DIR, SINGLE_INTERSECTION_TL_PHASES
+
+SINGLE_INTERSECTION = join(ROOT_DIR,
+                           "intersection_control/environments/sumo/networks/single_intersection/intersection.sumocfg")
+ROUTES = ["NE", "NS", "NW", "EN", "ES", "EW", "SN", "SE", "SW", "WN", "WE", "WS"]
+
+# The vehicle and intersection manager factories of the algorithms whose vehicles communicate
+ALGORITHMS = {
+    "qb_im": (
+        lambda vid, env: QBIMVehicle(vid, env, DistanceBasedUnit(vid, 75, lambda: env.vehicles.get_position(vid))),
+        lambda imid, env: QBIMIntersectionManager(
+            imid, env, 30, 0.05, DistanceBasedUnit(imid, 75, lambda: env.intersections.get_position(imid)))
+    ),
+    "stip": (
+        lambda vid, env: STIPVehicle(vid, env, DistanceBasedUnit(vid, 125, lambda: env.vehicles.get_position(vid))),
+        None
+    )
+}
+
+
+class CountingVehicle(TLVehicle):
+    destroyed = set()
+
+    def destroy(self):
+        CountingVehicle.destroyed.add(self.get_id())
+
+
+class TestSimulation(unittest.TestCase):
+    def setUp(self) -> None:
+        CountingVehicle.destroyed = set()
+        self.env = SumoEnvironment(SINGLE_INTERSECTION,
+                                   RandomDemandGenerator({route: 20 for route in ROUTES}, 0.05, seed=0), 0.05, False,
+                                   False)
+
+    def tearDown(self) -> None:
+        self.env.close()
+
+    def test_keeps_a_vehicle_for_every_vehicle_in_environment(self):
+        simulation = Simulation(self.env, CountingVehicle,
+                                lambda imid, env: TLIntersectionManager(imid, env, SINGLE_INTERSECTION_TL_PHASES))
+        steps = []
+        simulation.add_step_hook(lambda: steps.append(self.env.get_current_time()))
+        seen = set()
+        for _ in range(1200):
+            simulation.step()
+            self.assertSetEqual(set(simulation.vehicles), set(self.env.vehicles.get_ids()))
+            seen.update(simulation.vehicles)
+        self.assertEqual(len(steps), 1200)
+        self.assertSetEqual(CountingVehicle.destroyed, seen - set(simulation.vehicles))
+        self.assertGreater(len(CountingVehicle.destroyed), 0)
+
+        simulation.close()
+        self.assertSetEqual(CountingVehicle.destroyed, seen)
+        self.assertDictEqual(simulation.vehicles, {})
+
+    def test_skipping_idle_steps_reaches_the_same_state(self):
+        simulation = Simulation(self.env, CountingVehicle,
+                                lambda imid, env: TLIntersectionManager(imid, env, SINGLE_INTERSECTION_TL_PHASES),
+                                skip_idle_steps=True)
+        steps = []
+        simulation.add_step_hook(lambda: steps.append(self.env.get_current_time()))
+        simulation.run_until(60)
+        self.assertAlmostEqual(self.env.get_current_time(), 60)
+        self.assertLess(len(steps), 1200)  # Traffic light vehicles never need to act
+        self.assertSetEqual(set(simulation.vehicles), set(self.env.vehicles.get_ids()))
+        simulation.close()
+
+    def test_skipping_idle_steps_does_not_change_message_based_algorithms(self):
+        for algorithm, (make_vehicle, make_im) in ALGORITHMS.items():
+            with self.subTest(algorithm):
+                positions = {}
+                steps = {}
+                for skip_idle_steps in [False, True]:
+                    self.env.reload(RandomDemandGenerator({route: 2 for route in ROUTES}, 0.05, seed=0))
+                    simulation = Simulation(self.env, make_vehicle, make_im, skip_idle_steps=skip_idle_steps)
+                    steps[skip_idle_steps] = 0
+                    simulation.add_step_hook(lambda: steps.__setitem__(skip_idle_steps, steps[skip_idle_steps] + 1))
+                    simulation.run_until(120)
+                    positions[skip_idle_steps] = {vehicle_id: self.env.vehicles.get_position(vehicle_id)
+                                                  for vehicle_id in self.env.vehicles.get_ids()}
+                    simulation.close()
+                self.assertLess(steps[True], steps[False])
+                self.assertSetEqual(set(positions[True]), set(positions[False]))
+                for vehicle_id, (x, y) in positions[False].items():
+                    self.assertAlmostEqual(positions[True][vehicle_id][0], x, places=5)
+                    self.assertAlmostEqual(positions[True][vehicle_id][1], y, places=5)
@@ -0,0 +1,163 @@
+import os
+import random
+import tempfile
+import unittest
+
+import numpy as np
+
+from intersection_control.environments.sumo import RandomDemandGenerator, ProfileDemandGenerator, RateProfile, \
+    TraceDemandGenerator, NewVehicleParams
+
+ROUTES = ["NE", "NS", "NW", "EN", "ES", "EW", "SN", "SE", "SW", "WN", "WE", "WS"]
+
+
+def spawns(demand_generator: RandomDemandGenerator, steps: int):
+    return [[(v.veh_id, v.route_id) for v in demand_generator.step()] for _ in range(steps)]
+
+
+class TestRandomDemandGenerator(unittest.TestCase):
+    def test_same_seed_gives_same_demand(self):
+        first = spawns(RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05, seed=1), 30000)
+        random.random()  # The global random state has no effect
+        second = spawns(RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05, seed=1), 30000)
+        self.assertListEqual(first, second)
+        self.assertNotEqual(first, spawns(RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05, seed=2),
+                                          30000))
+
+    def test_default_seed_is_fixed(self):
+        self.assertListEqual(spawns(RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05), 10000),
+                             spawns(RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05), 10000))
+
+    def test_spawns_at_given_rates(self):
+        steps = 200000  # Long enough to cross several sampled chunks
+        counts = {"NS": 0, "EW": 0, "WE": 0}
+        for step in spawns(RandomDemandGenerator({"NS": 30, "EW": 5, "WE": 0}, 0.05, seed=0), steps):
+            for _, route in step:
+                counts[route] += 1
+        minutes = steps * 0.05 / 60
+        self.assertAlmostEqual(counts["NS"] / minutes, 30, delta=1.5)
+        self.assertAlmostEqual(counts["EW"] / minutes, 5, delta=0.5)
+        self.assertEqual(counts["WE"], 0)
+
+    def test_certain_spawns_happen_every_step(self):
+        self.assertTrue(all(len(step) == 1 for step in
+                            spawns(RandomDemandGenerator({"NS": 1200}, 0.05, seed=0), 20000)))
+
+    def test_departure_lanes_come_from_own_rng(self):
+        def lanes(seed: int):
+            demand_generator = RandomDemandGenerator({"NS": 600}, 0.05, seed=seed)
+            return [demand_generator.choose_departure_lane(v, [0, 1, 2])
+                    for _ in range(1000) for v in demand_generator.step()]
+
+        first = lanes(1)
+        random.random()  # The global random state has no effect
+        self.assertListEqual(lanes(1), first)
+        self.assertSetEqual(set(first), {0, 1, 2})
+        self.assertNotEqual(lanes(2), first)
+        demand_generator = RandomDemandGenerator({"NS": 600}, 0.05, seed=1)
+        self.assertEqual(demand_generator.choose_departure_lane(NewVehicleParams("0", "NS", depart_lane=1), [0, 2]), 1)
+
+
+class TestRateProfile(unittest.TestCase):
+    def test_stepped_rate(self):
+        profile = RateProfile([(0, 10), (60, 30), (120, 0)])
+        self.assertEqual(profile.rate(-5), 10)
+        self.assertEqual(profile.rate(30), 10)
+        self.assertEqual(profile.rate(60), 30)
+        self.assertEqual(profile.rate(500), 0)
+        self.assertEqual(profile.max_rate, 30)
+
+    def test_interpolated_rate(self):
+        profile = RateProfile([(0, 10), (60, 30)], interpolate=True)
+        self.assertAlmostEqual(profile.rate(15), 15)
+        self.assertEqual(profile.rate(100), 30)
+
+    def test_invalid_breakpoints(self):
+        self.assertRaises(ValueError, RateProfile, [])
+        self.assertRaises(ValueError, RateProfile, [(10, 5), (10, 6)])
+        self.assertRaises(ValueError, RateProfile, [(0, -1)])
+
+
+class TestProfileDemandGenerator(unittest.TestCase):
+    def test_spawns_follow_profiles(self):
+        time_step = 0.05
+        demand_generator = ProfileDemandGenerator({
+            "NS": [(0, 60), (600, 0), (1200, 120)],
+            "EW": RateProfile([(0, 0), (1800, 120)], interpolate=True),
+            "WE": [(0, 0)]
+        }, time_step, seed=0)
+        counts = {(route, period): 0 for route in ["NS", "EW", "WE"] for period in range(3)}
+        for i, step in enumerate(spawns(demand_generator, round(1800 / time_step))):
+            for _, route in step:
+                counts[route, int((i + 1) * time_step // 600)] += 1
+        self.assertAlmostEqual(counts["NS", 0], 600, delta=75)
+        self.assertEqual(counts["NS", 1], 0)
+        self.assertAlmostEqual(counts["NS", 2], 1200, delta=100)
+        # The rate on EW ramps up linearly, so each period has more vehicles than the last
+        self.assertAlmostEqual(counts["EW", 0], 200, delta=45)
+        self.assertAlmostEqual(counts["EW", 2], 1000, delta=100)
+        self.assertEqual(sum(counts["WE", period] for period in range(3)), 0)
+
+    def test_same_seed_gives_same_demand(self):
+        def make(seed):
+            return ProfileDemandGenerator({route: [(0, 5), (60, 40)] for route in ROUTES}, 0.05, seed=seed)
+        self.assertListEqual(spawns(make(3), 5000), spawns(make(3), 5000))
+        self.assertNotEqual(spawns(make(3), 5000), spawns(make(4), 5000))
+
+    def test_stops_after_final_zero_rate(self):
+        demand_generator = ProfileDemandGenerator({"NS": [(0, 600), (10, 0)]}, 0.05, seed=0)
+        self.assertGreater(sum(len(step) for step in spawns(demand_generator, 200)), 0)
+        self.assertEqual(sum(len(step) for step in spawns(demand_generator, 200)), 0)
+        self.assertListEqual(demand_generator.arrivals, [])
+
+
+class TestTraceDemandGenerator(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write_csv(self, rows):
+        path = os.path.join(self.dir.name, "trace.csv")
+        with open(path, "w") as f:
+            f.write("time,movement,count\n")
+            f.writelines(f"{time},{movement},{count}\n" for time, movement, count in rows)
+        return path
+
+    def test_replays_csv_trace(self):
+        trace = self.write_csv([(0, "north_through", 1), (0.12, "east_left", 2), (0.12, "u_turn", 1),
+                                (1, "north_through", "")])
+        demand_generator = TraceDemandGenerator(trace, {"north_through": "NS", "east_left": "EN", "u_turn": None},
+                                                0.05)
+        self.assertListEqual(spawns(demand_generator, 25), [[("0", "NS")], [], [("1", "EN"), ("2", "EN")]] +
+                             [[]] * 16 + [[("3", "NS")]] + [[]] * 5)
+
+    def test_starts_part_way_through_trace(self):
+        trace = self.write_csv([(10, "north_through", 1), (20, "north_through", 1), (20.6, "north_through", 1)])
+        demand_generator = TraceDemandGenerator(trace, {"north_through": "NS"}, 0.5, start_time=20)
+        self.assertListEqual(spawns(demand_generator, 2), [[("0", "NS")], [("1", "NS")]])
+
+    def test_rejects_unknown_movements_and_unordered_records(self):
+        self.assertRaises(ValueError, TraceDemandGenerator, self.write_csv([(0, "west_left", 1)]),
+                          {"north_through": "NS"}, 0.05)
+        demand_generator = TraceDemandGenerator(self.write_csv([(5, "north_through", 1), (4, "north_through", 1)]),
+                                                {"north_through": "NS"}, 0.05)
+        self.assertRaises(ValueError, spawns, demand_generator, 200)
+
+    def test_binary_trace_matches_csv_trace(self):
+        rng = np.random.default_rng(0)
+        times = np.cumsum(rng.exponential(0.01, 200000))
+        movements = rng.integers(0, 3, len(times))
+        counts = rng.integers(1, 3, len(times))
+        binary_trace = os.path.join(self.dir.name, "trace.npy")
+        records = np.zeros(len(times), dtype=[("time", "<f8"), ("movement", "<u2"), ("count", "<u1")])
+        records["time"], records["movement"], records["count"] = times, movements, counts
+        np.save(binary_trace, records)
+        csv_trace = self.write_csv((repr(t), m, c) for t, m, c in zip(times.tolist(), movements, counts))
+
+        steps = round(times[-1] / 0.05) + 1  # Spans several chunks of the binary trace
+        from_binary = spawns(TraceDemandGenerator(binary_trace, {0: "NS", 1: "EW", 2: "WE"}, 0.05), steps)
+        from_csv = spawns(TraceDemandGenerator(csv_trace, {"0": "NS", "1": "EW", "2": "WE"}, 0.05), steps)
+        self.assertListEqual(from_binary, from_csv)
+        self.assertEqual(sum(len(step) for step in from_binary), counts.sum())
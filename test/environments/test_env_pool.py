@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+from functools import partial
+
+from intersection_control.environments import EnvPool, WorkerError
+
+
+class CountingEnv:
+    def __init__(self):
+        self.steps = 0
+
+    def step(self):
+        self.steps += 1
+        return self.steps
+
+    def fail(self):
+        raise ValueError("Environment failure")
+
+
+def add_steps(env, n):
+    return env.steps + n
+
+
+def get_pid(env, _):
+    return os.getpid()
+
+
+def fail_with_value_error(env, _):
+    env.fail()
+
+
+def crash_once(env, marker_file):
+    if not os.path.exists(marker_file):
+        open(marker_file, "w").close()
+        os._exit(1)
+    return "survived"
+
+
+def build_env_unless_marked(marker_file):
+    if os.path.exists(marker_file):
+        raise RuntimeError("Cannot build the environment")
+    return CountingEnv()
+
+
+class TestEnvPool(unittest.TestCase):
+    def setUp(self) -> None:
+        self.pool = EnvPool(CountingEnv, num_workers=2)
+
+    def tearDown(self) -> None:
+        self.pool.close()
+
+    def test_steps_every_environment(self):
+        self.assertListEqual(self.pool.step(), [1, 1])
+        self.assertListEqual(self.pool.step(3), [4, 4])
+
+    def test_run_returns_results_in_task_order(self):
+        self.assertListEqual(self.pool.run(add_steps, range(10)), list(range(10)))
+
+    def test_run_uses_every_worker(self):
+        self.assertEqual(len(set(self.pool.run(get_pid, range(20)))), 2)
+
+    def test_environment_errors_are_propagated(self):
+        with self.assertRaises(WorkerError) as cm:
+            self.pool.call("fail")
+        self.assertIn("Environment failure", cm.exception.worker_traceback)
+        # The failed workers are restarted with fresh environments
+        self.assertListEqual(self.pool.step(), [1, 1])
+
+    def test_failing_tasks_are_retried_then_propagated(self):
+        with self.assertRaises(WorkerError):
+            self.pool.run(fail_with_value_error, [0])
+        self.assertListEqual(self.pool.run(add_steps, [1, 2]), [1, 2])
+
+    def test_crashed_workers_are_restarted_and_their_tasks_retried(self):
+        with tempfile.TemporaryDirectory() as directory:
+            marker_file = os.path.join(directory, "crashed")
+            self.assertListEqual(self.pool.run(crash_once, [marker_file]), ["survived"])
+        self.assertListEqual(self.pool.step(), [1, 1])
+
+    def test_pool_is_unusable_once_a_worker_cannot_be_restarted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            marker_file = os.path.join(directory, "broken")
+            pool = EnvPool(partial(build_env_unless_marked, marker_file), num_workers=2)
+            try:
+                open(marker_file, "w").close()
+                with self.assertRaises(WorkerError) as cm:
+                    pool.run(fail_with_value_error, [0])
+                self.assertIn("Cannot build the environment", cm.exception.worker_traceback)
+                self.assertEqual(cm.exception.task_index, 0)
+                with self.assertRaises(WorkerError) as cm:
+                    pool.step()
+                self.assertIn("could not be restarted", cm.exception.worker_traceback)
+            finally:
+                pool.close()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from intersection_control.environments import SumoEnvironment
+from intersection_control.environments.sumo import generate_grid_network, load_network_data
+
+
+class TestNetworkCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.output_dir.name, "cache")
+        self.network = generate_grid_network(self.output_dir.name, 2, 2)
+        self.net_file = os.path.join(self.output_dir.name, "grid.net.xml")
+        self.route_file = os.path.join(self.output_dir.name, "grid.rou.xml")
+
+    def tearDown(self) -> None:
+        self.output_dir.cleanup()
+
+    def test_cached_data_matches_parsed_data(self):
+        parsed = load_network_data(self.net_file, self.route_file)
+        load_network_data(self.net_file, self.route_file, self.cache_dir)
+        cached = load_network_data(self.net_file, self.route_file, self.cache_dir)
+        self.assertIsInstance(cached.points, np.memmap)
+        self.assertTrue((cached.points == parsed.points).all())
+        self.assertEqual(cached.routes, parsed.routes)
+        self.assertEqual(cached.lane_lengths, parsed.lane_lengths)
+        self.assertEqual(cached.internal_lane_geometry, parsed.internal_lane_geometry)
+        self.assertEqual(cached.internal_lanes_on_route, parsed.internal_lanes_on_route)
+
+    def test_changed_network_is_not_loaded_from_cache(self):
+        load_network_data(self.net_file, self.route_file, self.cache_dir)
+        with open(self.route_file, "w") as f:
+            f.write('<routes>\n    <route id="only" edges="bottom0A0 A0left0"/>\n</routes>\n')
+        self.assertEqual(list(load_network_data(self.net_file, self.route_file, self.cache_dir).routes), ["only"])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_environment_runs_from_cache(self):
+        trajectories = []
+        for _ in range(2):
+            env = SumoEnvironment(self.network.config_file, self.network.demand_generator(10, 0.05), 0.05, False,
+                                  False, debug=True, cache_dir=self.cache_dir)
+            for _ in range(200):
+                env.step()
+            trajectories.append({intersection_id: sorted(env.intersections.get_trajectories(intersection_id))
+                                 for intersection_id in env.intersections.get_ids()})
+            env.close()
+        self.assertEqual(trajectories[0], trajectories[1])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
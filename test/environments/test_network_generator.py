@@ -0,0 +1,95 @@
+import tempfile
+import unittest
+
+from intersection_control.environments import SumoEnvironment
+from intersection_control.environments.sumo import generate_grid_network, generate_arterial_network
+
+
+class TestNetworkGenerator(unittest.TestCase):
+    def setUp(self) -> None:
+        self.output_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.output_dir.cleanup()
+
+    def test_grid_has_an_intersection_per_cell(self):
+        network = generate_grid_network(self.output_dir.name, 2, 3)
+        self.assertEqual(len(network.intersection_ids), 6)
+        # 10 entry points, each with a route to every other exit point
+        self.assertEqual(len(network.get_entry_edges()), 10)
+        self.assertEqual(len(network.routes), 10 * 9)
+
+    def test_arterial_is_a_single_row(self):
+        network = generate_arterial_network(self.output_dir.name, 4)
+        self.assertEqual(len(network.intersection_ids), 4)
+        self.assertEqual(len(network.get_entry_edges()), 10)
+
+    def test_environment_runs_on_grid(self):
+        network = generate_grid_network(self.output_dir.name, 2, 2)
+        env = SumoEnvironment(network.config_file, network.demand_generator(10, 0.05), 0.05, False, False,
+                              debug=True)
+        try:
+            self.assertSetEqual(set(env.intersections.get_ids()), set(network.intersection_ids))
+            approached = set()
+            for _ in range(1000):
+                env.step()
+                for vehicle_id in env.vehicles.get_ids():
+                    intersection_id = env.vehicles.approaching(vehicle_id)
+                    if intersection_id is not None:
+                        approached.add(intersection_id)
+                        self.assertIn(env.vehicles.get_trajectory(vehicle_id),
+                                      env.intersections.get_trajectories(intersection_id))
+            self.assertSetEqual(approached, set(network.intersection_ids))
+        finally:
+            env.close()
+
+    def test_only_controlled_intersections_are_built(self):
+        network = generate_grid_network(self.output_dir.name, 2, 2)
+        controlled = network.intersection_ids[:1]
+        env = SumoEnvironment(network.config_file, network.demand_generator(10, 0.05), 0.05, False, False,
+                              debug=True, controlled_intersections=controlled)
+        try:
+            self.assertListEqual(env.intersections.get_ids(), controlled)
+            self.assertDictEqual(env.intersections.trajectories, {})
+            for _ in range(1000):
+                env.step()
+                for vehicle_id in env.vehicles.get_ids():
+                    self.assertIn(env.vehicles.approaching(vehicle_id), controlled + [None])
+                    if env.vehicles.approaching(vehicle_id):
+                        self.assertIn(env.vehicles.get_trajectory(vehicle_id),
+                                      env.intersections.get_trajectories(controlled[0]))
+            self.assertListEqual(list(env.intersections.trajectories), controlled)
+        finally:
+            env.close()
+
+    def test_environment_reloads_other_network(self):
+        grid = generate_grid_network(self.output_dir.name, 2, 2)
+        arterial = generate_arterial_network(self.output_dir.name, 3)
+        env = SumoEnvironment(grid.config_file, grid.demand_generator(10, 0.05), 0.05, False, False, debug=True)
+        try:
+            for _ in range(200):
+                env.step()
+            env.reload(arterial.demand_generator(10, 0.05), arterial.config_file)
+            self.assertListEqual(sorted(env.intersections.get_ids()), sorted(arterial.intersection_ids))
+            for _ in range(200):
+                env.step()
+                for vehicle_id in env.vehicles.get_ids():
+                    self.assertIn(env.vehicles.get_trajectory(vehicle_id).split("-")[0], arterial.routes)
+        finally:
+            env.close()
+
+    def test_shared_links_show_most_restrictive_state(self):
+        network = generate_grid_network(self.output_dir.name, 2, 2)
+        env = SumoEnvironment(network.config_file, None, 0.05, False, False)
+        try:
+            intersection_id = network.intersection_ids[0]
+            links = [link for [(_, _, link)] in env.connection.trafficlight.getControlledLinks(intersection_id)]
+            index, link = next((i, link) for i, link in enumerate(links)
+                               if len(env.intersections.routes_through_internal_lane.get(link, [])) > 1)
+            first_route, *other_routes = env.intersections.routes_through_internal_lane[link]
+            for y, r, state in [(set(), {other_routes[0]}, "r"), ({other_routes[0]}, set(), "y"),
+                                ({first_route}, {other_routes[0]}, "r"), (set(), set(), "g")]:
+                env.intersections.set_traffic_light_phase(intersection_id, (set(network.routes), y, r))
+                self.assertEqual(env.connection.trafficlight.getRedYellowGreenState(intersection_id)[index], state)
+        finally:
+            env.close()
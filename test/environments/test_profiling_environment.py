@@ -0,0 +1,86 @@
+import unittest
+from os.path import join
+
+from intersection_control.algorithms.qb_im import QBIMIntersectionManager, QBIMVehicle
+from intersection_control.communication import DistanceBasedUnit
+from intersection_control.core import Simulation
+from intersection_control.core.performance_indication import MetricCollector, Metric
+from intersection_control.environments import SumoEnvironment, ProfilingEnvironment
+from intersection_control.environments.sumo import RandomDemandGenerator
+from misc.utils import ROOT_DIR
+
+SINGLE_INTERSECTION = join(ROOT_DIR,
+                           "intersection_control/environments/sumo/networks/single_intersection/intersection.sumocfg")
+ROUTES = ["NE", "NS", "NW", "EN", "ES", "EW", "SN", "SE", "SW", "WN", "WE", "WS"]
+
+
+class TestProfilingEnvironment(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sumo_env = SumoEnvironment(SINGLE_INTERSECTION,
+                                        RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05, seed=0), 0.05,
+                                        False, False)
+        self.env = ProfilingEnvironment(self.sumo_env)
+
+    def tearDown(self) -> None:
+        self.env.stop_counting_round_trips()
+        self.sumo_env.close()
+
+    def test_records_calls_by_method_and_caller(self):
+        simulation = Simulation(
+            self.env,
+            lambda vid, env: QBIMVehicle(vid, env, DistanceBasedUnit(vid, 75, lambda: env.vehicles.get_position(vid))),
+            lambda imid, env: QBIMIntersectionManager(
+                imid, env, 30, 0.05, DistanceBasedUnit(imid, 75, lambda: env.intersections.get_position(imid))))
+        metric_collector = MetricCollector(self.env, Metric.NUM_VEHICLES)
+        simulation.add_step_hook(metric_collector.poll)
+        simulation.run(600)
+        simulation.close()
+
+        step_stats = self.env.stats["environment.step", "Simulation"]
+        self.assertEqual(step_stats.calls, 600)
+        self.assertGreaterEqual(step_stats.round_trips, 600)
+        self.assertGreater(step_stats.total_time, 0)
+        self.assertEqual(self.env.stats["vehicles.get_ids", "MetricCollector"].calls, 600)
+        # Messaging units look up positions on behalf of the vehicle using them
+        self.assertGreater(self.env.stats["vehicles.get_position", "QBIMVehicle"].calls, 0)
+        self.assertGreater(self.env.stats["intersections.get_position", "QBIMIntersectionManager"].calls, 0)
+        # Setting a vehicle's speed is a TraCI command, reading it is served from the subscription
+        self.assertEqual(self.env.stats["vehicles.set_desired_speed", "QBIMVehicle"].round_trips,
+                         self.env.stats["vehicles.set_desired_speed", "QBIMVehicle"].calls)
+        self.assertEqual(self.env.stats["vehicles.get_speed", "QBIMVehicle"].round_trips, 0)
+        self.assertIn("vehicles.set_desired_speed", self.env.summary(by_caller=False))
+
+    def test_passes_through_to_wrapped_environment(self):
+        self.assertEqual(self.env.time_step, 0.05)
+        self.assertListEqual(self.env.vehicles.get_ids(), self.sumo_env.vehicles.get_ids())
+        self.env.reload(RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05, seed=1))
+        self.env.step()
+        self.assertListEqual(self.env.vehicles.get_ids(), self.sumo_env.vehicles.get_ids())
+        self.assertEqual(self.env.stats["environment.step", "TestProfilingEnvironment"].calls, 1)
+        self.env.reset_stats()
+        self.assertDictEqual(self.env.stats, {})
+
+    def test_stopping_restores_connection(self):
+        send = vars(self.sumo_env.connection)["_sendExact"]
+        outer = ProfilingEnvironment(self.env)
+        outer.step()
+        self.assertGreater(outer.stats["environment.step", "TestProfilingEnvironment"].round_trips, 0)
+        outer.stop_counting_round_trips()
+        self.assertIs(vars(self.sumo_env.connection)["_sendExact"], send)
+        self.env.stop_counting_round_trips()
+        self.assertNotIn("_sendExact", vars(self.sumo_env.connection))
+        self.env.reset_stats()
+        self.env.step()
+        self.assertEqual(self.env.stats["environment.step", "TestProfilingEnvironment"].round_trips, 0)
+
+    def test_finds_caller_through_wrapped_handlers(self):
+        outer = ProfilingEnvironment(self.env)
+        try:
+            metric_collector = MetricCollector(outer, Metric.NUM_VEHICLES)
+            metric_collector.poll()
+            # The call reaches this environment through the outer one's handler
+            self.assertEqual(self.env.stats["vehicles.get_ids", "MetricCollector"].calls, 1)
+            self.assertEqual(outer.stats["vehicles.get_ids", "MetricCollector"].calls, 1)
+            self.assertNotIn("ProfilingEnvironment", {caller for _, caller in self.env.stats})
+        finally:
+            outer.stop_counting_round_trips()
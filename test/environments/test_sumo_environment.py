@@ -0,0 +1,235 @@
+import os
+import tempfile
+import unittest
+from os.path import join
+
+from intersection_control.algorithms.stip import STIPVehicle
+from intersection_control.algorithms.traffic_light import TLVehicle, TLIntersectionManager
+from intersection_control.core.algorithm import vehicle_getters_used_by, next_wake_up_time
+from intersection_control.environments import SumoEnvironment
+from intersection_control.core.environment import StepEvents
+from intersection_control.core.performance_indication import MetricCollector, Metric
+from intersection_control.environments.sumo import RandomDemandGenerator, ControlType, compile_demand, \
+    ScenarioGenerator, NewVehicleParams
+from misc.utils import ROOT_DIR, SINGLE_INTERSECTION_TL_PHASES
+import traci.constants as tc
+
+SINGLE_INTERSECTION = join(ROOT_DIR,
+                           "intersection_control/environments/sumo/networks/single_intersection/intersection.sumocfg")
+ROUTES = ["NE", "NS", "NW", "EN", "ES", "EW", "SN", "SE", "SW", "WN", "WE", "WS"]
+
+
+class TestSumoEnvironment(unittest.TestCase):
+    def setUp(self) -> None:
+        self.env = SumoEnvironment(SINGLE_INTERSECTION, RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05),
+                                   0.05, False, False, debug=True)
+        self.output_dir = tempfile.TemporaryDirectory()
+        self.demand_file = os.path.join(self.output_dir.name, "demand.rou.xml")
+
+    def tearDown(self) -> None:
+        self.env.close()
+        self.output_dir.cleanup()
+
+    def test_vehicle_ids_served_from_subscription_match_sumo(self):
+        seen = set()
+        for _ in range(400):
+            self.env.step()  # debug=True checks the subscription cache against SUMO on every step
+            seen.update(self.env.vehicles.get_ids())
+        self.assertGreater(len(seen), 0)
+
+    def test_clear_removes_all_vehicles(self):
+        for _ in range(100):
+            self.env.step()
+        self.env.clear()
+        self.assertListEqual(self.env.vehicles.get_ids(), [])
+
+    def test_approaching_vehicles_report_known_trajectories(self):
+        trajectories = self.env.intersections.get_trajectories(self.env.intersections.get_ids()[0])
+        for _ in range(200):
+            self.env.step()
+            for vehicle_id in self.env.vehicles.get_ids():
+                if self.env.vehicles.approaching(vehicle_id):
+                    self.assertIn(self.env.vehicles.get_trajectory(vehicle_id), trajectories)
+                    self.assertGreaterEqual(self.env.vehicles.get_driving_distance(vehicle_id), 0)
+
+    def test_restore_returns_to_snapshot(self):
+        for _ in range(200):
+            self.env.step()
+        snapshot = self.env.snapshot()
+        time = self.env.get_current_time()
+        positions = {v: self.env.vehicles.get_position(v) for v in self.env.vehicles.get_ids()}
+        for _ in range(200):
+            self.env.step()
+        self.env.restore(snapshot)
+        self.assertEqual(self.env.get_current_time(), time)
+        self.assertSetEqual(set(self.env.vehicles.get_ids()), set(positions))
+        for v, (x, y) in positions.items():
+            self.assertAlmostEqual(self.env.vehicles.get_position(v)[0], x, places=5)
+            self.assertAlmostEqual(self.env.vehicles.get_position(v)[1], y, places=5)
+        self.assertEqual(len(self.env.get_added_vehicles()), 0)
+        self.assertEqual(len(self.env.get_removed_vehicles()), 0)
+        self.env.step()
+        self.assertGreater(self.env.get_current_time(), time)
+
+    def test_environments_in_same_process_are_independent(self):
+        other = SumoEnvironment(SINGLE_INTERSECTION, None, 0.05, False, False, debug=True)
+        try:
+            for _ in range(100):
+                self.env.step()
+            other.step()
+            self.assertGreater(len(self.env.vehicles.get_ids()), 0)
+            self.assertListEqual(other.vehicles.get_ids(), [])
+            self.assertLess(other.get_current_time(), self.env.get_current_time())
+        finally:
+            other.close()
+
+    def test_subscription_radius_serves_same_values(self):
+        near = SumoEnvironment(SINGLE_INTERSECTION, RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05),
+                               0.05, False, False, debug=True, subscription_radius=50)
+        try:
+            for _ in range(200):
+                near.step()
+                for vehicle_id in near.vehicles.get_ids():
+                    self.assertEqual(near.vehicles.get_speed(vehicle_id),
+                                     near.connection.vehicle.getSpeed(vehicle_id))
+                    self.assertEqual(near.vehicles.get_driving_distance(vehicle_id),
+                                     near.vehicles.lane_lengths[near.connection.vehicle.getLaneID(vehicle_id)]
+                                     - near.connection.vehicle.getLanePosition(vehicle_id))
+        finally:
+            near.close()
+
+    def test_declared_vehicle_getters_limit_subscription(self):
+        getters = vehicle_getters_used_by(TLVehicle, TLIntersectionManager, STIPVehicle)
+        limited = SumoEnvironment(SINGLE_INTERSECTION, RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05),
+                                  0.05, False, False, debug=True, vehicle_getters=getters)
+        try:
+            for _ in range(100):
+                limited.step()
+            vehicle_id = limited.vehicles.get_ids()[0]
+            self.assertNotIn(tc.VAR_DECEL, limited.vehicles.subscription_results[vehicle_id])
+            limited.vehicles.get_speed(vehicle_id)
+            with self.assertLogs("intersection_control.environments.sumo.sumo_vehicle_handler", "WARNING"):
+                self.assertEqual(limited.vehicles.get_max_deceleration(vehicle_id),
+                                 limited.connection.vehicle.getDecel(vehicle_id))
+        finally:
+            limited.close()
+
+    def test_step_until_matches_stepping(self):
+        stepped = SumoEnvironment(SINGLE_INTERSECTION,
+                                  RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05, seed=0),
+                                  0.05, False, False, debug=True)
+        try:
+            for _ in range(400):
+                stepped.step()
+            positions = {v: stepped.vehicles.get_position(v) for v in stepped.vehicles.get_ids()}
+        finally:
+            stepped.close()
+
+        self.env.reload(RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05, seed=0))
+        vehicle_ids = set(self.env.vehicles.get_ids())
+        self.env.step_until(self.env.get_current_time() + 400 * 0.05)
+        self.assertAlmostEqual(self.env.get_current_time(), 401 * 0.05)
+        self.assertSetEqual(set(self.env.vehicles.get_ids()), set(positions))
+        for v, (x, y) in positions.items():
+            self.assertAlmostEqual(self.env.vehicles.get_position(v)[0], x, places=5)
+            self.assertAlmostEqual(self.env.vehicles.get_position(v)[1], y, places=5)
+        self.assertSetEqual(set(self.env.get_added_vehicles()), set(positions) - vehicle_ids)
+        self.assertSetEqual(set(self.env.get_removed_vehicles()), vehicle_ids - set(positions))
+
+    def test_step_returns_events(self):
+        vehicle_ids = set(self.env.vehicles.get_ids())
+        for _ in range(600):
+            events = self.env.step()
+            self.assertIs(events, self.env.get_step_events())
+            self.assertIsInstance(events.added, frozenset)
+            self.assertIs(self.env.get_added_vehicles(), events.added)
+            self.assertIs(self.env.get_removed_vehicles(), events.removed)
+            current_ids = set(self.env.vehicles.get_ids())
+            self.assertSetEqual(set(events.added), current_ids - vehicle_ids)
+            self.assertSetEqual(set(events.removed), vehicle_ids - current_ids)
+            vehicle_ids = current_ids
+
+    def test_collisions_are_reported_as_events(self):
+        self.env.reload(ScenarioGenerator([
+            NewVehicleParams("front", "NS", depart_speed=0, depart_pos=40, control_type=ControlType.MANUAL),
+            NewVehicleParams("back", "NS", depart_speed=10, depart_pos=0, control_type=ControlType.MANUAL)
+        ]))
+        metric_collector = MetricCollector(self.env, Metric.COLLISIONS, Metric.TELEPORTS)
+        events = StepEvents()
+        for _ in range(200):
+            events = self.env.step()
+            metric_collector.poll()
+            if events.collided:
+                break
+        self.assertSetEqual(set(events.collided), {"front", "back"})
+        self.assertTrue(events.collided <= events.removed)
+        results = metric_collector.get_results()
+        self.assertEqual(sum(results[Metric.COLLISIONS]), 2)
+        self.assertEqual(sum(results[Metric.TELEPORTS]), 0)
+
+    def test_step_until_reports_events_of_every_step(self):
+        self.env.reload(ScenarioGenerator([
+            NewVehicleParams("front", "NS", depart_speed=0, depart_pos=40, control_type=ControlType.MANUAL),
+            NewVehicleParams("back", "NS", depart_speed=10, depart_pos=0, control_type=ControlType.MANUAL)
+        ]))
+        metric_collector = MetricCollector(self.env, Metric.COLLISIONS)
+        events = self.env.step_until(self.env.get_current_time() + 200 * 0.05)
+        metric_collector.poll()
+        self.assertSetEqual(set(events.added), {"front", "back"})
+        self.assertSetEqual(set(events.collided), {"front", "back"})
+        self.assertSetEqual(set(events.removed), {"front", "back"})
+        self.assertEqual(sum(metric_collector.get_results()[Metric.COLLISIONS]), 2)
+
+    def test_traffic_lights_wake_up_at_phase_change(self):
+        intersection_manager = TLIntersectionManager("intersection", self.env, SINGLE_INTERSECTION_TL_PHASES)
+        vehicles = [TLVehicle(vehicle_id, self.env) for vehicle_id in self.env.vehicles.get_ids()]
+        start = self.env.get_current_time()
+        wake_up_time = next_wake_up_time([intersection_manager, *vehicles])
+        self.assertAlmostEqual(wake_up_time, start + SINGLE_INTERSECTION_TL_PHASES[0][1])
+        self.env.step_until(wake_up_time)
+        intersection_manager.step()
+        self.assertEqual(intersection_manager.phase_index, 1)
+
+    def test_reload_restarts_simulation(self):
+        start = self.env.get_current_time()
+        for _ in range(200):
+            self.env.step()
+        self.assertGreater(len(self.env.vehicles.get_ids()), 0)
+        self.env.reload(RandomDemandGenerator({"NS": 60}, 0.05))
+        self.assertEqual(self.env.get_current_time(), start)
+        self.assertListEqual(self.env.vehicles.get_ids(), [])
+        self.assertDictEqual(self.env.vehicles.vehicle_settings, {})
+        for _ in range(200):
+            self.env.step()  # debug=True checks the subscriptions were re-established on every step
+        self.assertSetEqual({self.env.vehicles.get_trajectory(v)[:2] for v in self.env.vehicles.get_ids()}, {"NS"})
+
+    def test_compiled_demand_matches_demand_generator(self):
+        self.env.reload(RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05, seed=0))
+        added = set()
+        for _ in range(400):
+            self.env.step()
+            added.update(self.env.get_added_vehicles())
+        positions = {v: self.env.vehicles.get_position(v) for v in self.env.vehicles.get_ids()}
+
+        self.env.reload(demand_file=compile_demand(RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05, seed=0),
+                                                   SINGLE_INTERSECTION, 400 * 0.05, self.demand_file))
+        compiled_added = set()
+        for _ in range(400):
+            self.env.step()
+            compiled_added.update(self.env.get_added_vehicles())
+        self.assertGreater(len(added), 0)
+        self.assertSetEqual(compiled_added, added)
+        self.assertSetEqual(set(self.env.vehicles.get_ids()), set(positions))
+        for v, (x, y) in positions.items():
+            self.assertAlmostEqual(self.env.vehicles.get_position(v)[0], x, places=5)
+            self.assertAlmostEqual(self.env.vehicles.get_position(v)[1], y, places=5)
+
+    def test_compiled_manual_vehicles_are_manually_controlled(self):
+        self.env.reload(demand_file=compile_demand(
+            RandomDemandGenerator({route: 10 for route in ROUTES}, 0.05, control_type=ControlType.MANUAL),
+            SINGLE_INTERSECTION, 400 * 0.05, self.demand_file))
+        for _ in range(400):
+            self.env.step()
+        self.assertGreater(len(self.env.vehicles.get_ids()), 0)
+        for v in self.env.vehicles.get_ids():
+            self.assertEqual(self.env.connection.vehicle.getSpeedMode(v), 0b100110)
@@ -0,0 +1,163 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from intersection_control.environments import Sweep, StoppingRule, RunTimedOut, run_sweep, load_run_records, \
+    aggregate_results
+from traci.exceptions import FatalTraCIError
+
+SWEEP = Sweep("test", {"algo": ["a", "b"], "vpm": [0.5, 1.]}, seeds=[0, 1, 2])
+
+
+ADAPTIVE_SWEEP = Sweep("adaptive", {"noise": [0.01, 1., 100.]}, seeds=range(40),
+                       stopping_rule=StoppingRule(0.05, min_runs=3))
+
+
+class CountingEnv:
+    def __init__(self):
+        self.runs = 0
+
+
+def run(env, config):
+    env.runs += 1
+    # The result of a run is a list of numpy values, like those of the experiment scripts
+    return [np.float64(config["vpm"] * (10 if config["algo"] == "a" else 20) + config["seed"]), np.int64(env.runs)]
+
+
+def run_with_failures(env, config):
+    if config["seed"] == 1 and config["vpm"] == 1.:
+        raise RunTimedOut("Took too long")
+    if config["seed"] == 2 and config["algo"] == "b":
+        raise ValueError("Broken configuration")
+    return run(env, config)
+
+
+def run_breaking_environment(env, config):
+    if getattr(env, "broken", False):
+        raise ValueError("The environment is broken")
+    if config["algo"] == "b" and config["seed"] == 0:
+        env.broken = True
+        raise FatalTraCIError("connection closed by SUMO")
+    return run(env, config)
+
+
+def run_killing_worker(env, config):
+    if config["algo"] == "b" and config["vpm"] == 1. and config["seed"] == 0:
+        os._exit(1)
+    return run(env, config)
+
+
+def run_noisy(_, config):
+    return 10 + config["noise"] * (-1) ** config["seed"]
+
+
+class TestStoppingRule(unittest.TestCase):
+    def test_half_widths_use_students_t(self):
+        rule = StoppingRule(1, metrics=[1], relative=False)
+        # The sample standard deviation of the second metric is 1, and t(0.975, 3) = 3.182
+        half_width = rule.get_half_widths([[0, 1], [0, 2], [0, 3], [0, 2]])[0]
+        self.assertAlmostEqual(half_width, 3.182 * np.sqrt(2 / 3) / 2, places=3)
+        self.assertTrue(np.isinf(rule.get_half_widths([[0, 1]])[0]))
+
+    def test_satisfied_once_precise_enough(self):
+        rule = StoppingRule(0.05, min_runs=3)
+        self.assertFalse(rule.is_satisfied([10, 10.01]))
+        self.assertTrue(rule.is_satisfied([10, 10.01, 9.99]))
+        self.assertFalse(rule.is_satisfied([10, 12, 8]))
+        # A metric that is always zero is known exactly
+        self.assertTrue(StoppingRule(0.05, metrics=[0, 1]).is_satisfied([[1, 0], [1, 0], [1, 0]]))
+        # Runs in which a metric is undefined are left out of its interval
+        self.assertTrue(rule.is_satisfied([10, np.nan, 10.01, 9.99]))
+        self.assertFalse(rule.is_satisfied([10, np.nan, np.nan]))
+
+    def test_estimates_runs_needed(self):
+        rule = StoppingRule(0.05, min_runs=3)
+        self.assertEqual(rule.get_runs_needed([10]), 3)
+        self.assertEqual(rule.get_runs_needed([10, 10.01, 9.99]), 3)
+        results = list(np.random.default_rng(0).normal(10, 1, 5))
+        needed = rule.get_runs_needed(results)
+        self.assertGreater(needed, 5)
+        self.assertTrue(rule.is_satisfied(results + list(np.random.default_rng(1).normal(10, 1, needed * 2))))
+
+
+class TestSweep(unittest.TestCase):
+    def setUp(self) -> None:
+        self.results_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.results_dir.cleanup()
+
+    def test_configs_cover_every_combination(self):
+        configs = SWEEP.get_configs()
+        self.assertEqual(len(configs), 12)
+        self.assertDictEqual(configs[0], {"algo": "a", "vpm": 0.5, "seed": 0})
+        self.assertEqual(len({tuple(sorted(config.items())) for config in configs}), 12)
+
+    def test_changing_settings_invalidates_records(self):
+        run_sweep(SWEEP, CountingEnv, run, self.results_dir.name, num_workers=2)
+        changed = Sweep(SWEEP.name, SWEEP.parameters, SWEEP.seeds, settings={"steps_per_run": 100})
+        self.assertListEqual(load_run_records(changed, self.results_dir.name), [None] * 12)
+        self.assertEqual(len(run_sweep(changed, CountingEnv, run, self.results_dir.name, num_workers=2)), 12)
+        self.assertEqual(len(os.listdir(os.path.join(self.results_dir.name, "test"))), 24)
+
+    def test_runs_and_aggregates_every_run(self):
+        records = run_sweep(SWEEP, CountingEnv, run, self.results_dir.name, num_workers=2)
+        self.assertTrue(all(record.status == "ok" for record in records))
+        self.assertEqual(len(os.listdir(os.path.join(self.results_dir.name, "test"))), 12)
+        results = aggregate_results(records, ["algo", "vpm"])
+        self.assertListEqual(list(results), [("a", 0.5), ("a", 1.), ("b", 0.5), ("b", 1.)])
+        self.assertAlmostEqual(results["b", 1.][0], 21)
+
+    def test_only_runs_what_did_not_succeed(self):
+        records = run_sweep(SWEEP, CountingEnv, run_with_failures, self.results_dir.name, num_workers=2)
+        statuses = [record.status for record in records]
+        self.assertEqual(statuses.count("timed_out"), 2)
+        self.assertEqual(statuses.count("failed"), 2)
+        self.assertIn("Broken configuration", [record for record in records if record.status == "failed"][0].error)
+        # Runs that did not succeed are left out of the results
+        self.assertAlmostEqual(aggregate_results(records, ["algo", "vpm"])["b", 0.5][0], 10.5)
+
+        durations = {tuple(record.config.values()): record.duration for record in records if record.status == "ok"}
+        records = run_sweep(SWEEP, CountingEnv, run, self.results_dir.name, num_workers=2)
+        self.assertTrue(all(record.status == "ok" for record in records))
+        # The runs that had already succeeded were not run again
+        self.assertDictEqual({tuple(record.config.values()): record.duration for record in records
+                              if tuple(record.config.values()) in durations}, durations)
+        self.assertListEqual(load_run_records(SWEEP, self.results_dir.name), records)
+        self.assertListEqual(load_run_records(Sweep("other", SWEEP.parameters, SWEEP.seeds), self.results_dir.name),
+                             [None] * 12)
+
+    def test_restarts_workers_whose_environment_died(self):
+        records = run_sweep(SWEEP, CountingEnv, run_breaking_environment, self.results_dir.name, num_workers=2,
+                            fatal_errors=(FatalTraCIError,))
+        # Only the runs that broke the environment failed - the rest were made on fresh environments
+        self.assertListEqual([(record.config["algo"], record.config["seed"]) for record in records
+                              if record.status != "ok"], [("b", 0), ("b", 0)])
+        self.assertTrue(all("FatalTraCIError" in record.error for record in records if record.status != "ok"))
+
+    def test_records_runs_that_kill_their_worker(self):
+        records = run_sweep(SWEEP, CountingEnv, run_killing_worker, self.results_dir.name, num_workers=2)
+        self.assertEqual(len(records), len(SWEEP.get_configs()))
+        failed = [record for record in records if record.status != "ok"]
+        self.assertListEqual([record.config for record in failed], [{"algo": "b", "vpm": 1., "seed": 0}])
+        self.assertEqual(failed[0].status, "failed")
+        self.assertIn("exit code 1", failed[0].error)
+
+    def test_runs_until_precise_enough(self):
+        records = run_sweep(ADAPTIVE_SWEEP, CountingEnv, run_noisy, self.results_dir.name, num_workers=2)
+        runs = {noise: sum(record.config["noise"] == noise for record in records) for noise in [0.01, 1., 100.]}
+        self.assertEqual(runs[0.01], 3)
+        self.assertGreater(runs[1.], 3)
+        self.assertLess(runs[1.], 40)
+        self.assertEqual(runs[100.], 40)
+        # The seeds are used in order
+        self.assertListEqual([record.config["seed"] for record in records if record.config["noise"] == 1.],
+                             list(range(runs[1.])))
+        rule = ADAPTIVE_SWEEP.stopping_rule
+        self.assertTrue(rule.is_satisfied([record.result for record in records if record.config["noise"] == 1.]))
+
+        # Nothing more needs to be run when the sweep is restarted
+        self.assertListEqual(run_sweep(ADAPTIVE_SWEEP, CountingEnv, run_noisy, self.results_dir.name), records)
+        self.assertEqual(len(os.listdir(os.path.join(self.results_dir.name, "adaptive"))), len(records))
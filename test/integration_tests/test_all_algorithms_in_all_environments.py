@@ -6,6 +6,7 @@ from intersection_control.algorithms.qb_im import QBIMIntersectionManager, QBIMV
 from intersection_control.algorithms.stip import STIPVehicle
 from intersection_control.algorithms.traffic_light import TLIntersectionManager, TLVehicle
 from intersection_control.communication import DistanceBasedUnit
+from intersection_control.core import Simulation
 from intersection_control.environments import SumoEnvironment
 from intersection_control.environments.sumo import RandomDemandGenerator
 from misc.utils import SINGLE_INTERSECTION_TL_PHASES, ROOT_DIR
@@ -50,20 +51,7 @@ class TestAlgorithmInEnvironment(unittest.TestCase):
             for make_env in environment_factories:
                 with self.subTest():
                     env = make_env()
-                    if make_im:
-                        ims = {make_im(imid, env) for imid in env.intersections.get_ids()}
-                    vehicles = {make_vehicle(vid, env) for vid in env.vehicles.get_ids()}
-
-                    for _ in range(FIVE_MINUTES):
-                        env.step()
-                        removed_vehicles = {v for v in vehicles if v.get_id() in env.get_removed_vehicles()}
-                        for v in removed_vehicles:
-                            v.destroy()
-                        new_vehicles = {make_vehicle(vehicle_id, env) for vehicle_id in env.get_added_vehicles()}
-                        vehicles = (vehicles - removed_vehicles).union(new_vehicles)
-                        for vehicle in vehicles:
-                            vehicle.step()
-                        if make_im:
-                            for im in ims:
-                                im.step()
+                    simulation = Simulation(env, make_vehicle, make_im)
+                    simulation.run(FIVE_MINUTES)
+                    simulation.close()
                     env.close()